@@ -40,7 +40,7 @@ class ArmDapJtagModel(object):
         self.dap_state = DrState.BYPASS
 
         self.will_enable = initial_will_enable
-        self.enabled = False
+        self.enable = initial_will_enable
 
     def shift_dr(self, tdi):
         """ DR shift state has been entered, tdi is state of TDI pin, return state of TDO pin """
@@ -50,6 +50,14 @@ class ArmDapJtagModel(object):
         """ IR shift state has been entered, tdi is state of TDI pin, return state of TDO pin """
         return self.ir.shift(tdi)
 
+    def shift_dr_bits(self, value, length):
+        """ Shift the length bits of value through the DR in one call, see jtag_models.shift_dr_bits. """
+        return self.dr.shift_bits(value, length)
+
+    def shift_ir_bits(self, value, length):
+        """ Shift the length bits of value through the IR in one call, see jtag_models.shift_ir_bits. """
+        return self.ir.shift_bits(value, length)
+
     def update_dr(self):
         """ DR update state has been entered. """
         dr = self.dr.read()
@@ -151,6 +159,8 @@ class ArmDpRegister(Enum):
 class ArmDebugModel():
     def __init__(self, callback):
         self.callback = callback
+        # None until a DP SELECT write is seen, e.g. when decoding a window
+        # that starts after it.
         self.apsel = None
         self.apbanksel = 0
         self.dpbanksel = 0
@@ -193,6 +203,13 @@ class ArmDebugModel():
                 # RDBUFF is RO
                 assert RnW == 1, (dr_state, hex(dr_value))
                 self.callback(command=ArmDebugCommand.READ_DP_REGISTER, reg=A)
+            elif dr_state == DrState.APACC and self.apsel is None:
+                # The AP and register bank are unknown, only the address
+                # within the bank is reported.
+                if RnW:
+                    self.callback(command=ArmDebugCommand.READ_AP_REGISTER, ap_num=None, reg=A)
+                else:
+                    self.callback(command=ArmDebugCommand.WRITE_AP_REGISTER, ap_num=None, reg=A, value=datain)
             elif dr_state == DrState.APACC:
                 apreg = (self.apbanksel << 4) | A
                 if RnW:
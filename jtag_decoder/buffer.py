@@ -1,64 +1,174 @@
+from array import array
+from bisect import bisect_right
+
+
 class Buffer(object):
     """ deque like object that doesn't discard data on pop.
 
     This is useful for rewinding failed decodes.
 
+    Indices (pop_index, frame extents, insert boundaries) are absolute from
+    the first byte ever added.  discard() releases consumed data, after which
+    self.buf starts at absolute index self.base.
+
+    Data is stored in a bytearray.  Frame extents are kept both in
+    self.frames ({frame: (begin, end)}) and in arrays sorted by begin index,
+    so the frame of an index is found with a binary search.
+
+    If history is not None, the buffer is a sliding window: as data is
+    added, consumed data (and frames) more than history bytes behind the pop
+    index are released, so memory use stays bounded when data is consumed as
+    it arrives.  Only seeks back to at most history bytes before the pop
+    index at the time of the last extend are possible.
+
     """
-    def __init__(self):
-        self.buf = []
+    def __init__(self, history=None):
+        self.history = history
+        self.buf = bytearray()
+        self.base = 0
         self.insert_boundry = set()
         self.pop_index = 0
         self.frames = {}
-        self.begin_to_frame = {}
-        self.frame = None
+        self.frame_begins = array('Q')
+        self.frame_ends = array('Q')
+        self.frame_numbers = array('Q')
 
     def __len__(self):
-        assert self.pop_index >= 0 and self.pop_index <= len(self.buf)
-        return len(self.buf) - self.pop_index
+        return self.base + len(self.buf) - self.pop_index
 
     def extend(self, iterable, frame=None):
-        original_index = len(self.buf)
+        # Releasing is amortized, so discard() runs at most once per history
+        # bytes consumed.
+        if self.history is not None and self.pop_index - self.base > 2 * self.history:
+            self.discard(keep=self.history)
+
+        original_index = self.base + len(self.buf)
         self.buf.extend(iterable)
-        self.insert_boundry.add(len(self.buf))
+        end_index = self.base + len(self.buf)
+        self.insert_boundry.add(end_index)
         if frame is not None:
-            self.frames[frame] = (original_index, len(self.buf))
-            self.begin_to_frame[original_index] = frame
+            self.frames[frame] = (original_index, end_index)
+            self.frame_begins.append(original_index)
+            self.frame_ends.append(end_index)
+            self.frame_numbers.append(frame)
 
     def popleft(self):
-        assert self.pop_index >= 0 and self.pop_index <= len(self.buf)
-        if self.pop_index < len(self.buf):
-            ret = self.buf[self.pop_index]
-
-            # Update self.frame
-            if self.pop_index == 0:
-                self.frame = self.begin_to_frame[self.pop_index]
-
-                b, e = self.frames[self.frame]
-                assert self.pop_index == b
-            else:
-                b, e = self.frames[self.frame]
-                assert self.pop_index >= b
-                if self.pop_index >= e:
-                    self.frame = self.begin_to_frame[self.pop_index]
-
-                    b, e = self.frames[self.frame]
-                    assert self.pop_index == b
-
-            self.pop_index += 1
-            return ret
-        else:
+        idx = self.pop_index - self.base
+        if idx >= len(self.buf):
+            raise IndexError()
+
+        self.pop_index += 1
+        return self.buf[idx]
+
+    def take(self, n):
+        """ Pop n bytes at once, returned as bytes.
+
+        Raises IndexError without popping anything if fewer than n bytes are
+        available.
+
+        """
+        idx = self.pop_index - self.base
+        if idx + n > len(self.buf):
             raise IndexError()
 
+        self.pop_index += n
+        return bytes(self.buf[idx:idx+n])
+
+    def view(self, begin, end):
+        """ Returns a memoryview of the data between absolute indices begin and end, without copying.
+
+        The buffer cannot grow or release data while the view is alive.
+
+        """
+        assert begin >= self.base and end <= self.base + len(self.buf)
+        return memoryview(self.buf)[begin-self.base:end-self.base]
+
+    def slice(self, begin, end):
+        """ Returns a new Buffer with a copy of the data between absolute indices begin and end.
+
+        Indices in the new buffer are the same as in this one, and it starts
+        with its pop index at begin.  Frames and insert boundaries within the
+        range are kept.
+
+        """
+        assert begin >= self.base and end <= self.base + len(self.buf)
+        other = Buffer()
+        other.buf = self.buf[begin-self.base:end-self.base]
+        other.base = begin
+        other.pop_index = begin
+        other.insert_boundry = set(idx for idx in self.insert_boundry if begin <= idx <= end)
+
+        first = bisect_right(self.frame_ends, begin)
+        last = bisect_right(self.frame_begins, end - 1)
+        other.frame_begins = self.frame_begins[first:last]
+        other.frame_ends = self.frame_ends[first:last]
+        other.frame_numbers = self.frame_numbers[first:last]
+        for frame, frame_begin, frame_end in zip(other.frame_numbers, other.frame_begins, other.frame_ends):
+            other.frames[frame] = (frame_begin, frame_end)
+
+        return other
+
+    def tell(self):
+        """ Returns the pop index, which can be restored with seek. """
+        return self.pop_index
+
+    def seek(self, index):
+        """ Move the pop index, e.g. to rewind a partially decoded command. """
+        assert index >= self.base and index <= self.base + len(self.buf)
+        self.pop_index = index
+
+    def discard(self, keep=0):
+        """ Release data (and frames) more than keep bytes before the pop index.
+
+        Used to bound memory when data is consumed as it arrives.  The frame
+        of the last popped byte is always kept so current_frame still works.
+
+        """
+        new_base = max(self.pop_index - keep, self.base)
+        if new_base == self.base:
+            return
+
+        del self.buf[:new_base - self.base]
+        self.base = new_base
+
+        # Frames are appended in index order, so released frames are a
+        # prefix of the arrays.
+        count = bisect_right(self.frame_ends, min(new_base, self.pop_index - 1))
+        for frame, begin in zip(self.frame_numbers[:count], self.frame_begins[:count]):
+            if self.frames.get(frame, (None, None))[0] == begin:
+                del self.frames[frame]
+
+        del self.frame_begins[:count]
+        del self.frame_ends[:count]
+        del self.frame_numbers[:count]
+
+        self.insert_boundry = set(idx for idx in self.insert_boundry if idx >= new_base)
+
     def at_boundry(self):
         return self.pop_index in self.insert_boundry
 
     def current_frame(self):
-        return self.frame
+        """ Returns the frame of the last popped byte, or None if nothing was popped. """
+        if self.pop_index > 0:
+            return self.frame_of(self.pop_index - 1)
+        else:
+            return None
 
     def frame_of(self, idx):
-        for frame, (begin, end) in self.frames.items():
-            if idx >= begin and idx < end:
-                return frame
+        pos = bisect_right(self.frame_begins, idx) - 1
+        if pos >= 0 and idx < self.frame_ends[pos]:
+            return self.frame_numbers[pos]
+
+    def frames_after(self, idx):
+        """ Yield (frame, begin index) of the frames that begin after idx, in order. """
+        for pos in range(bisect_right(self.frame_begins, idx), len(self.frame_begins)):
+            yield self.frame_numbers[pos], self.frame_begins[pos]
+
+    def first_frame_after(self, frame):
+        """ Returns (frame, begin index) of the first frame numbered after frame, or None. """
+        pos = bisect_right(self.frame_numbers, frame)
+        if pos < len(self.frame_numbers):
+            return self.frame_numbers[pos], self.frame_begins[pos]
 
     def get_context(self, C=10):
         """ Yield bytes before and after the current byte for context.
@@ -66,8 +176,7 @@ class Buffer(object):
         Useful for debugging decode failures.
 
         """
-        first_idx = max(self.pop_index - C, 0)
+        first_idx = max(self.pop_index - C, self.base)
         delta = self.pop_index - first_idx
-        for idx, data in enumerate(self.buf[first_idx:self.pop_index+C]):
+        for idx, data in enumerate(self.buf[first_idx-self.base:self.pop_index-self.base+C]):
             yield -delta + idx, data
-
@@ -0,0 +1,674 @@
+""" Synthetic FTDI MPSSE captures, for load testing the readers and decoders.
+
+Production captures cannot be shared, so this generates captures of a Zynq
+UltraScale+ MPSoC being debugged through an FTDI adapter by OpenOCD:
+
+ - ZynqCaptureScript describes the JTAG activity: IR/DR scans of the PS/PL
+   TAP and the ARM DAP, MEM-AP memory bursts through APACC, CFG_IN bitstream
+   loads and idle runs.
+ - MpsseEncoder encodes the scans as MPSSE commands the way the OpenOCD ftdi
+   driver does, in batches that end with a FLUSH if they read TDO.
+ - The CaptureWriters split the batches into USB bulk transfers, with the
+   modem status bytes the FTDI chip adds to every IN packet, and write the
+   frames as a Wireshark JSON export, a tshark field (TSV) or ek export, or a
+   Linux usbmon pcap.
+
+TDO replies are random bytes from a seeded generator, so the same seed and
+workload always generate the same capture.
+
+"""
+import json
+import random
+import struct
+from .ftdi_decoder import FtdiCommandType
+from .mpsse_encoder import MAX_CLOCK_BYTES, MAX_TMS_BITS, TMS_TDI_BIT, encode_length
+from .pcap_reader import FTDI_MAX_PACKET_SIZE, payload_field
+from .usb_pcap_reader import (LINKTYPE_USB_LINUX, PCAP_MAGIC, USB_TRANSFER_BULK, USB_TRANSFER_CONTROL,
+        USB_DESCRIPTOR_TYPE_DEVICE, USB_DEVICE_DESCRIPTOR_LENGTH, USBMON_HEADER_FORMAT, FTDI_VENDOR_ID,
+        FTDI_INTERFACE_ENDPOINTS)
+
+CAPTURE_FORMATS = ('json', 'tsv', 'ek', 'pcap')
+
+# MPSSE opcodes used by the OpenOCD ftdi driver, all clock out on the
+# falling edge and in on the rising edge, LSB first.
+CLOCK_BYTES_OUT = 0x19
+CLOCK_BITS_OUT = 0x1b
+CLOCK_BYTES = 0x3d
+CLOCK_BITS = 0x3f
+CLOCK_TMS_OUT = 0x4b
+CLOCK_TMS = 0x6f
+
+# Adapter setup written by OpenOCD when it opens the adapter: loopback off,
+# divide by 5 off, adaptive clocking off, clock divisor 1, then TCK, TDI and
+# TMS as outputs with TMS high.
+MPSSE_SETUP = bytes([0x85, 0x8a, 0x97, 0x86, 0x01, 0x00, 0x80, 0x08, 0x0b])
+
+# Size of the OpenOCD MPSSE command buffer, a batch is sent when it is full.
+MPSSE_BUFFER_SIZE = 0x20000
+
+# Largest OUT bulk transfer, and the number of 512 byte packets of an IN
+# bulk transfer.
+TX_TRANSFER_SIZE = 4096
+RX_TRANSFER_PACKETS = 8
+
+# Modem status sent by the FTDI chip at the start of every IN packet.
+MODEM_STATUS = b'\x32\x60'
+
+# Replies carried by one IN bulk transfer.
+RX_TRANSFER_SIZE = RX_TRANSFER_PACKETS * (FTDI_MAX_PACKET_SIZE - len(MODEM_STATUS))
+
+# Device descriptor of an FT2232H, sent when the adapter is enumerated.
+FTDI_DEVICE_DESCRIPTOR = struct.pack('<BBHBBBBHHHBBBB',
+        USB_DEVICE_DESCRIPTOR_LENGTH, USB_DESCRIPTOR_TYPE_DEVICE, 0x0200, 0, 0, 0, 64,
+        FTDI_VENDOR_ID, 0x6010, 0x0700, 1, 2, 0, 1)
+
+# GET_DESCRIPTOR(DEVICE) control request.
+GET_DEVICE_DESCRIPTOR = struct.pack('<BBHHH', 0x80, 6, USB_DESCRIPTOR_TYPE_DEVICE << 8, 0, USB_DEVICE_DESCRIPTOR_LENGTH)
+
+# Start of the capture, 2020-01-01, and time between frames.
+CAPTURE_START = 1577836800
+FRAME_INTERVAL_US = 10
+
+# PS/PL TAP instructions, as (12 bit IR, DR length).  The PS instruction is
+# in the high 6 bits and the PL instruction in the low 6 bits, see
+# ZynqPsJtagModel.update_ir.  Instructions without a DR length are not
+# followed by a DR scan.  Only instructions the decoders print are listed.
+PS_INSTRUCTIONS = {
+        'BYPASS': (0xfff, 1),
+        'IP_DISABLE': (0x67f, 32),
+        'PMU_MDM': (0x0e4, 32),
+        'JTAG_STATUS': (0x7e4, 32),
+        'JTAG_CTRL': (0x824, 32),
+        'ERROR_STATUS': (0xfa4, 121),
+        'USER1': (0x902, 32),
+        'USER2': (0x903, 32),
+        'USER3': (0x922, 32),
+        'CFG_OUT': (0x904, 32),
+        'CFG_IN': (0x905, None),
+        'JPROGRAM': (0x90b, None),
+        'JSTART': (0x90c, None),
+        'ISC_NOOP': (0x914, None),
+        'FUSE_DNA': (0x932, 96),
+        }
+
+# PS/PL instructions read by ps_scan steps of the default workload.
+PS_STATUS_INSTRUCTIONS = ('JTAG_STATUS', 'ERROR_STATUS', 'PMU_MDM', 'USER1', 'USER2', 'CFG_OUT', 'FUSE_DNA')
+
+# ARM DAP instructions, as (4 bit IR, DR length).
+DAP_INSTRUCTIONS = {
+        'ABORT': (0x8, 35),
+        'DPACC': (0xa, 35),
+        'APACC': (0xb, 35),
+        'IDCODE': (0xe, 32),
+        'BYPASS': (0xf, 1),
+        }
+
+DAP_IR_LENGTH = 4
+PS_IR_LENGTH = 12
+
+# IDCODE DR length of both TAPs.
+IDCODE_LENGTH = 32
+
+# JTAG_CTRL bit enabling the ARM DAP at the next reset.
+JTAG_CTRL_ARM_DAP = 0x2
+
+# DP and MEM-AP register addresses.
+DP_CTRL_STAT = 0x4
+DP_SELECT = 0x8
+DP_RDBUFF = 0xc
+MEM_AP_CSW = 0x0
+MEM_AP_TAR = 0x4
+MEM_AP_DRW = 0xc
+
+# CTRL/STAT power up request of the debug and system domains.
+DP_POWER_UP = 0x50000000
+
+# CSW of 32-bit accesses, incrementing TAR after each one.
+MEM_AP_CSW_32BIT_INCREMENT = 0x12
+
+# Clocks in Run-Test/Idle after JPROGRAM and JSTART.
+JPROGRAM_IDLE_CLOCKS = 10000
+JSTART_IDLE_CLOCKS = 2000
+
+# Steps a workload file may use, see ZynqCaptureScript.
+WORKLOAD_STEPS = ('reset', 'idle', 'idcode', 'ps_scan', 'enable_dap', 'dp_read', 'dp_write', 'mem_read', 'mem_write',
+        'load_bitstream', 'flush')
+
+SIZE_SUFFIXES = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+
+
+def parse_size(text):
+    """ Returns the number of bytes of a size like 512, 64K, 10M or 2G. """
+    text = text.strip().upper()
+    scale = SIZE_SUFFIXES.get(text[-1:], 1)
+    if scale != 1:
+        text = text[:-1]
+
+    return int(float(text) * scale)
+
+
+class MpsseEncoder(object):
+    """ Encodes JTAG scans as MPSSE commands, like the OpenOCD ftdi driver.
+
+    Commands are collected into batches, and each batch is passed to
+    write_batch(tx bytes, reply length) when the command buffer is full or
+    flush() is called.  A batch that reads TDO ends with a FLUSH.  Scans
+    start and end in Run-Test/Idle.
+
+    """
+    def __init__(self, write_batch, buffer_size=MPSSE_BUFFER_SIZE):
+        self.write_batch = write_batch
+        self.buffer_size = buffer_size
+        self.tx = bytearray()
+        self.reply_length = 0
+
+    def command(self, encoded, reply_length=0):
+        """ Add one encoded command, which clocks in reply_length bytes. """
+        if len(self.tx) + len(encoded) + 1 > self.buffer_size:
+            self.flush()
+
+        self.tx += encoded
+        self.reply_length += reply_length
+
+    def flush(self):
+        """ Send the commands collected so far as a batch. """
+        if self.reply_length:
+            self.tx.append(FtdiCommandType.FLUSH.value)
+
+        if self.tx:
+            self.write_batch(bytes(self.tx), self.reply_length)
+
+        self.tx = bytearray()
+        self.reply_length = 0
+
+    def setup(self):
+        """ Configure the adapter, leaving the TAP state unknown. """
+        self.command(MPSSE_SETUP)
+
+    def clock_tms(self, tms, length, tdi=0):
+        """ Clock the length TMS bits of tms, LSB first, without reading TDO. """
+        while length > 0:
+            bits = min(length, MAX_TMS_BITS)
+            data = (tms & ((1 << bits) - 1)) | (TMS_TDI_BIT if tdi else 0)
+            self.command(bytes([CLOCK_TMS_OUT, bits - 1, data]))
+            tms >>= bits
+            length -= bits
+
+    def reset(self):
+        """ Go to Test-Logic-Reset, then Run-Test/Idle. """
+        self.clock_tms(0x1f, 5)
+        self.clock_tms(0x0, 1)
+
+    def idle(self, clocks):
+        """ Stay in Run-Test/Idle for clocks TCK cycles. """
+        self.clock_tms(0x0, clocks)
+
+    def shift(self, data, length, read):
+        """ Shift the length bits of data (bytes, LSB first) and return to Run-Test/Idle.
+
+        The TAP must already be in Shift-DR or Shift-IR.  The last bit is
+        shifted while leaving the shift state.
+
+        """
+        body = length - 1
+        body_bytes = body // 8
+        body_bits = body % 8
+
+        opcode = CLOCK_BYTES if read else CLOCK_BYTES_OUT
+        for idx in range(0, body_bytes, MAX_CLOCK_BYTES):
+            chunk = data[idx:min(idx + MAX_CLOCK_BYTES, body_bytes)]
+            self.command(bytes([opcode]) + encode_length(len(chunk)) + chunk, len(chunk) if read else 0)
+
+        if body_bits:
+            self.command(bytes([CLOCK_BITS if read else CLOCK_BITS_OUT, body_bits - 1, data[body_bytes]]),
+                    1 if read else 0)
+
+        last = (data[body_bytes] >> body_bits) & 1
+        self.command(bytes([CLOCK_TMS if read else CLOCK_TMS_OUT, 0, 0x01 | (TMS_TDI_BIT if last else 0)]),
+                1 if read else 0)
+
+        # Exit1 -> Update -> Run-Test/Idle
+        self.clock_tms(0x1, 2)
+
+    def scan_ir(self, value, length, read=True):
+        """ IR scan of the length bit value from Run-Test/Idle. """
+        self.clock_tms(0x3, 4)
+        self.shift(value.to_bytes((length + 7) // 8, 'little'), length, read)
+
+    def scan_dr(self, value, length, read=True):
+        """ DR scan of the length bit value from Run-Test/Idle. """
+        self.scan_dr_bytes(value.to_bytes((length + 7) // 8, 'little'), length, read)
+
+    def scan_dr_bytes(self, data, length, read=True):
+        """ DR scan of the first length bits of data, LSB first. """
+        self.clock_tms(0x1, 3)
+        self.shift(data, length, read)
+
+
+class ZynqCaptureScript(object):
+    """ JTAG activity on the chain of a Zynq UltraScale+ MPSoC, see ZynqJtagModel.
+
+    The PS/PL TAP is first in the chain after TDI, followed by the ARM DAP,
+    which stays in BYPASS until enable_dap.  Each method is one step of a
+    workload, the argument values not given are chosen by rng.
+
+    """
+    def __init__(self, encoder, rng):
+        self.encoder = encoder
+        self.rng = rng
+        self.ir = None
+        self.dap_enabled = False
+        self.dap_will_enable = False
+        self.apsel = None
+
+        encoder.setup()
+        self.reset()
+
+    def random_word(self):
+        return self.rng.getrandbits(32)
+
+    def reset(self):
+        self.encoder.reset()
+        self.ir = None
+        self.apsel = None
+        self.dap_enabled = self.dap_will_enable
+
+    def idle(self, clocks=None):
+        if clocks is None:
+            clocks = self.rng.randint(1, 100)
+
+        self.encoder.idle(clocks)
+
+    def flush(self):
+        self.encoder.flush()
+
+    def idcode(self):
+        """ Reset and read the IDCODE of each TAP in the chain. """
+        self.reset()
+        dap_length = IDCODE_LENGTH if self.dap_enabled else DAP_INSTRUCTIONS['BYPASS'][1]
+        self.encoder.scan_dr(0, IDCODE_LENGTH + dap_length)
+        self.flush()
+
+    def set_ir(self, ps_instruction, dap_instruction='BYPASS'):
+        """ Load the PS/PL and DAP IRs, unless they already hold the instructions. """
+        ir = (PS_INSTRUCTIONS[ps_instruction][0] << DAP_IR_LENGTH) | DAP_INSTRUCTIONS[dap_instruction][0]
+        if ir != self.ir:
+            self.encoder.scan_ir(ir, PS_IR_LENGTH + DAP_IR_LENGTH)
+            self.ir = ir
+
+    def ps_scan(self, instruction=None, value=None):
+        """ IR/DR scan of a PS/PL TAP instruction, with the DAP in BYPASS.
+
+        Instructions without a DR (see PS_INSTRUCTIONS) only get the IR scan.
+
+        """
+        if instruction is None:
+            instruction = self.rng.choice(PS_STATUS_INSTRUCTIONS)
+
+        length = PS_INSTRUCTIONS[instruction][1]
+        self.set_ir(instruction)
+        if length is None:
+            # Instructions like JPROGRAM act on the IR update alone.
+            return
+
+        if value is None:
+            value = self.rng.getrandbits(length)
+
+        self.encoder.scan_dr(value << 1, length + 1)
+
+    def enable_dap(self):
+        """ Enable the ARM DAP through JTAG_CTRL and power up its domains. """
+        self.ps_scan('JTAG_CTRL', JTAG_CTRL_ARM_DAP)
+        self.dap_will_enable = True
+        self.reset()
+        self.dp_write(DP_CTRL_STAT, DP_POWER_UP)
+        self.dp_read(DP_CTRL_STAT)
+        self.flush()
+
+    def dap_scan(self, instruction, address, read, data=0):
+        """ DPACC or APACC scan, with the PS/PL TAP in BYPASS. """
+        if not self.dap_enabled:
+            raise ValueError('The ARM DAP must be enabled with an enable_dap step first')
+
+        self.set_ir('BYPASS', instruction)
+        value = (data << 3) | ((address >> 2) << 1) | (1 if read else 0)
+        self.encoder.scan_dr(value, DAP_INSTRUCTIONS[instruction][1] + 1)
+
+    def dp_read(self, address=DP_CTRL_STAT):
+        self.dap_scan('DPACC', address, True)
+        self.dap_scan('DPACC', DP_RDBUFF, True)
+
+    def dp_write(self, address=DP_CTRL_STAT, value=DP_POWER_UP):
+        self.dap_scan('DPACC', address, False, value)
+
+    def select_mem_ap(self, address, ap):
+        """ Select MEM-AP ap, and set up 32-bit incrementing accesses from address. """
+        if self.apsel != ap:
+            self.dap_scan('DPACC', DP_SELECT, False, ap << 24)
+            self.apsel = ap
+
+        self.dap_scan('APACC', MEM_AP_CSW, False, MEM_AP_CSW_32BIT_INCREMENT)
+        self.dap_scan('APACC', MEM_AP_TAR, False, address)
+
+    def random_burst(self, address, count):
+        if address is None:
+            address = 0xfffc0000 + self.rng.randrange(0x10000) * 4
+        if count is None:
+            count = self.rng.randint(1, 256)
+
+        return address, count
+
+    def mem_read(self, address=None, count=None, ap=0):
+        """ Read count 32-bit words from address through MEM-AP ap. """
+        address, count = self.random_burst(address, count)
+        self.select_mem_ap(address, ap)
+        for _ in range(count):
+            self.dap_scan('APACC', MEM_AP_DRW, True)
+
+        self.dap_scan('DPACC', DP_RDBUFF, True)
+        self.flush()
+
+    def mem_write(self, address=None, count=None, ap=0):
+        """ Write count random 32-bit words to address through MEM-AP ap. """
+        address, count = self.random_burst(address, count)
+        self.select_mem_ap(address, ap)
+        for _ in range(count):
+            self.dap_scan('APACC', MEM_AP_DRW, False, self.random_word())
+
+        self.dap_scan('DPACC', DP_RDBUFF, True)
+        self.flush()
+
+    def load_bitstream(self, size=None):
+        """ Load a random bitstream of size bytes through CFG_IN. """
+        if size is None:
+            size = 1 << 16
+
+        self.set_ir('JPROGRAM')
+        self.idle(JPROGRAM_IDLE_CLOCKS)
+        self.set_ir('ISC_NOOP')
+        self.set_ir('CFG_IN')
+        # The bitstream, then the DAP BYPASS bit.
+        self.encoder.scan_dr_bytes(self.rng.randbytes(size) + b'\0', size * 8 + 1, read=False)
+        self.set_ir('JSTART')
+        self.idle(JSTART_IDLE_CLOCKS)
+        self.set_ir('BYPASS')
+        self.flush()
+
+    def run_step(self, step):
+        """ Run one workload step, e.g. {"step": "mem_read", "address": 4294705152, "count": 16}. """
+        step = dict(step)
+        name = step.pop('step')
+        if name not in WORKLOAD_STEPS:
+            raise ValueError('Unknown workload step {!r}, expected one of {}'.format(name, ', '.join(WORKLOAD_STEPS)))
+
+        getattr(self, name)(**step)
+
+    def run_random_step(self, bitstream_size):
+        """ Run a step of the default workload, mostly DAP memory accesses. """
+        if not self.dap_enabled:
+            self.idcode()
+            self.enable_dap()
+            return
+
+        choice = self.rng.random()
+        if choice < 0.5:
+            self.mem_read(ap=self.rng.randint(0, 1))
+        elif choice < 0.75:
+            self.mem_write(ap=self.rng.randint(0, 1))
+        elif choice < 0.9:
+            self.ps_scan()
+            self.flush()
+        elif choice < 0.998:
+            self.idle()
+            self.dp_read()
+            self.flush()
+        else:
+            self.load_bitstream(bitstream_size)
+
+
+class CaptureWriter(object):
+    """ Base of the capture writers, writes the USB frames of one FTDI interface.
+
+    write_batch turns a batch of MPSSE commands and its replies into OUT and
+    IN bulk transfers, each a submission and a completion frame.  Subclasses
+    write each frame with write_frame(transfer_type, endpoint, completion,
+    data), where data is the TX bytes of an OUT submission, the replies of
+    an IN completion (without modem status) or the descriptor of a control
+    completion.  size counts the bytes written.
+
+    """
+    def __init__(self, f, bus=1, device=3, interface='A'):
+        self.f = f
+        self.bus = bus
+        self.device = device
+        self.interface = interface
+        self.out_endpoint, self.in_endpoint = FTDI_INTERFACE_ENDPOINTS[interface]
+        self.frame = 0
+        self.size = 0
+
+    def write(self, data):
+        self.f.write(data)
+        self.size += len(data)
+
+    def next_frame(self):
+        self.frame += 1
+        return self.frame
+
+    def write_enumeration(self):
+        """ Write the device descriptor request of the adapter being enumerated. """
+        self.write_frame(USB_TRANSFER_CONTROL, 0x80, False, b'')
+        self.write_frame(USB_TRANSFER_CONTROL, 0x80, True, FTDI_DEVICE_DESCRIPTOR)
+
+    def write_batch(self, tx, replies):
+        for idx in range(0, len(tx), TX_TRANSFER_SIZE):
+            self.write_frame(USB_TRANSFER_BULK, self.out_endpoint, False, tx[idx:idx + TX_TRANSFER_SIZE])
+            self.write_frame(USB_TRANSFER_BULK, self.out_endpoint, True, b'')
+
+        for idx in range(0, len(replies), RX_TRANSFER_SIZE):
+            self.write_frame(USB_TRANSFER_BULK, self.in_endpoint, False, b'')
+            self.write_frame(USB_TRANSFER_BULK, self.in_endpoint, True, replies[idx:idx + RX_TRANSFER_SIZE])
+
+    def close(self):
+        self.f.close()
+
+
+class FieldsCaptureWriter(CaptureWriter):
+    """ Base of the writers of Wireshark dissections, see frame_fields. """
+    def frame_fields(self, transfer_type, endpoint, completion, data):
+        """ Returns ({layer: {field: value}}, payload field or None) of one frame.
+
+        Like Wireshark, the modem status at the start of a reply is
+        stripped, and the one repeated every FTDI_MAX_PACKET_SIZE bytes is
+        kept, see strip_repeated_modem_status.
+
+        """
+        payload = None
+        if transfer_type == USB_TRANSFER_BULK and data:
+            if endpoint == self.out_endpoint and not completion:
+                payload = (payload_field(self.interface, 'tx'), data)
+            elif endpoint == self.in_endpoint and completion:
+                payload = (payload_field(self.interface, 'rx'), MODEM_STATUS.join(
+                    data[idx:idx + FTDI_MAX_PACKET_SIZE] for idx in range(0, len(data), FTDI_MAX_PACKET_SIZE)))
+
+        layers = {
+                'frame': {
+                    'frame.protocols': 'usb:ftdift' if payload is not None else 'usb',
+                    'frame.number': str(self.next_frame()),
+                    },
+                'usb': {
+                    'usb.urb_type': "'C'" if completion else "'S'",
+                    'usb.transfer_type': '0x{:02x}'.format(transfer_type),
+                    'usb.endpoint_address': '0x{:02x}'.format(endpoint),
+                    'usb.device_address': str(self.device),
+                    'usb.bus_id': str(self.bus),
+                    },
+                }
+        return layers, payload
+
+
+class JsonCaptureWriter(FieldsCaptureWriter):
+    """ Writes a Wireshark JSON export (File -> Export Packet Dissections -> As JSON). """
+    def write_frame(self, transfer_type, endpoint, completion, data):
+        layers, payload = self.frame_fields(transfer_type, endpoint, completion, data)
+        if payload is not None:
+            field, payload_data = payload
+            layers['ftdift'] = {field: payload_data.hex(':')}
+
+        cap = {
+                '_index': 'packets-2020-01-01',
+                '_type': 'doc',
+                '_score': None,
+                '_source': {'layers': layers},
+                }
+        text = json.dumps(cap, indent=2).replace('\n', '\n  ')
+        self.write('{}\n  {}'.format(',' if self.frame > 1 else '[', text))
+
+    def close(self):
+        self.write('\n]\n' if self.frame else '[]\n')
+        self.f.close()
+
+
+class TsvCaptureWriter(FieldsCaptureWriter):
+    """ Writes a tshark field export with a header line (tshark -T fields -E header=y). """
+    def __init__(self, f, bus=1, device=3, interface='A'):
+        FieldsCaptureWriter.__init__(self, f, bus, device, interface)
+        self.fields = ['frame.number', 'usb.bus_id', 'usb.device_address',
+                payload_field(interface, 'tx'), payload_field(interface, 'rx')]
+        self.write('\t'.join(self.fields) + '\n')
+
+    def write_frame(self, transfer_type, endpoint, completion, data):
+        layers, payload = self.frame_fields(transfer_type, endpoint, completion, data)
+        values = dict(layers['frame'])
+        values.update(layers['usb'])
+        if payload is not None:
+            field, payload_data = payload
+            values[field] = payload_data.hex()
+
+        self.write('\t'.join(values.get(field, '') for field in self.fields) + '\n')
+
+
+class EkCaptureWriter(FieldsCaptureWriter):
+    """ Writes a tshark -T ek export, an index line and a packet document per frame. """
+    def write_frame(self, transfer_type, endpoint, completion, data):
+        layers, payload = self.frame_fields(transfer_type, endpoint, completion, data)
+        if payload is not None:
+            field, payload_data = payload
+            layers['ftdift'] = {field: payload_data.hex()}
+
+        ek_layers = {}
+        for layer, fields in layers.items():
+            ek_layers[layer] = {'{}_{}'.format(layer, name.replace('.', '_')): value for name, value in fields.items()}
+
+        doc = {
+                'timestamp': str(CAPTURE_START * 1000 + self.frame * FRAME_INTERVAL_US // 1000),
+                'layers': ek_layers,
+                }
+        self.write('{"index":{"_index":"packets-2020-01-01","_type":"doc"}}\n')
+        self.write(json.dumps(doc, separators=(',', ':')) + '\n')
+
+
+class PcapCaptureWriter(CaptureWriter):
+    """ Writes a pcap of Linux usbmon packets (LINKTYPE_USB_LINUX).
+
+    Every IN packet of FTDI_MAX_PACKET_SIZE bytes starts with the modem
+    status, see strip_modem_status.
+
+    """
+    record_header = struct.Struct('<IIII')
+    usbmon_header = struct.Struct('<' + USBMON_HEADER_FORMAT)
+
+    def __init__(self, f, bus=1, device=3, interface='A'):
+        CaptureWriter.__init__(self, f, bus, device, interface)
+        self.write(struct.pack('<IHHiIII', PCAP_MAGIC, 2, 4, 0, 0, 0x40000, LINKTYPE_USB_LINUX))
+        self.urb_id = 0
+
+    def write_frame(self, transfer_type, endpoint, completion, data):
+        frame = self.next_frame()
+        setup = b''
+        if endpoint == self.in_endpoint:
+            packet_size = FTDI_MAX_PACKET_SIZE - len(MODEM_STATUS)
+            data = b''.join(MODEM_STATUS + data[idx:idx + packet_size] for idx in range(0, len(data), packet_size))
+            urb_length = len(data) if completion else RX_TRANSFER_PACKETS * FTDI_MAX_PACKET_SIZE
+        elif transfer_type == USB_TRANSFER_CONTROL and not completion:
+            setup = GET_DEVICE_DESCRIPTOR
+            urb_length = USB_DEVICE_DESCRIPTOR_LENGTH
+        else:
+            urb_length = len(data)
+
+        if not completion:
+            self.urb_id += 1
+
+        if data:
+            flag_data = 0
+        else:
+            flag_data = ord('<') if endpoint & 0x80 else ord('>')
+
+        timestamp = frame * FRAME_INTERVAL_US
+        seconds = CAPTURE_START + timestamp // 1000000
+        microseconds = timestamp % 1000000
+
+        header = self.usbmon_header.pack(
+                self.urb_id,
+                b'C' if completion else b'S',
+                transfer_type,
+                endpoint,
+                self.device,
+                self.bus,
+                0 if setup else ord('-'),
+                flag_data,
+                seconds,
+                microseconds,
+                0 if completion else -115,
+                urb_length,
+                len(data),
+                setup or bytes(8))
+
+        length = len(header) + len(data)
+        self.write(self.record_header.pack(seconds, microseconds, length, length))
+        self.write(header)
+        self.write(data)
+
+
+CAPTURE_WRITERS = {
+        'json': (JsonCaptureWriter, 'w'),
+        'tsv': (TsvCaptureWriter, 'w'),
+        'ek': (EkCaptureWriter, 'w'),
+        'pcap': (PcapCaptureWriter, 'wb'),
+        }
+
+
+def write_capture(path, capture_format='json', bus=1, device=3, interface='A'):
+    """ Returns a CaptureWriter writing to path in capture_format, see CAPTURE_FORMATS. """
+    if capture_format not in CAPTURE_WRITERS:
+        raise ValueError('Unknown capture format {!r}'.format(capture_format))
+
+    writer_class, mode = CAPTURE_WRITERS[capture_format]
+    return writer_class(open(path, mode), bus, device, interface)
+
+
+def generate_capture(writer, size, seed=0, workload=None, bitstream_size=1 << 16):
+    """ Write a synthetic capture of at least size bytes with writer.
+
+    workload is a list of steps (see ZynqCaptureScript.run_step), repeated
+    until the capture is big enough.  Without a workload, random steps of
+    DAP memory accesses, PS/PL TAP scans, idle runs and the occasional
+    bitstream load of bitstream_size bytes are generated.  The capture only
+    depends on the arguments.
+
+    """
+    rng = random.Random(seed)
+
+    def write_batch(tx, reply_length):
+        writer.write_batch(tx, rng.randbytes(reply_length))
+
+    writer.write_enumeration()
+    script = ZynqCaptureScript(MpsseEncoder(write_batch), rng)
+    while writer.size < size:
+        if workload:
+            for step in workload:
+                script.run_step(step)
+        else:
+            script.run_random_step(bitstream_size)
+
+    script.flush()
+    writer.close()
@@ -0,0 +1,309 @@
+""" Command line input handling shared by the decoder scripts. """
+import argparse
+import io
+import itertools
+import sys
+from .pcap_reader import (pcap_json_reader, pcap_tsv_reader, pcap_ek_reader, iter_json_array,
+        iter_json_frames, iter_tsv_frames, iter_ek_frames, collect_streams, FTDI_INTERFACES)
+from .parallel_json_reader import pcap_json_parallel_reader
+from .usb_pcap_reader import pcap_usb_reader, iter_usb_payloads, map_capture
+from .payload_cache import read_payload_cache, write_payload_cache
+from .frame_index import (read_frame_index, write_frame_index, build_frame_index,
+        frame_index_start, vendor_ids_before, window_frames, resync_frames)
+from .compression import detect_compression, open_capture
+from .follow import FollowFile, CaptureFollower, first_stream_frames
+from .streams import stream_title
+
+
+def usb_device(text):
+    """ argparse type of a USB device given as BUS.DEVICE, e.g. 1.3. """
+    try:
+        bus, device = text.split('.')
+        return int(bus), int(device)
+    except ValueError:
+        raise argparse.ArgumentTypeError('Expected BUS.DEVICE, e.g. 1.3, got {!r}'.format(text))
+
+
+def add_input_arguments(parser):
+    """ Add the capture input arguments to an argparse.ArgumentParser. """
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--json_pcap', help='Input JSON PCAP data')
+    group.add_argument('--pcap', help='Input pcap/pcapng USB capture (Linux usbmon or USBPcap)')
+    group.add_argument('--tsv_pcap', help='Input tshark field export of frame.number, ftdift.if_a_tx_payload and ftdift.if_a_rx_payload (then the if_b fields, ...), or with a header line naming the fields')
+    group.add_argument('--ek_pcap', help='Input tshark -T ek (newline delimited JSON) export')
+    group.add_argument('--command_log', help='Input FTDI commands written by --ftdi_commands, to simulate them again without decoding a capture')
+    parser.add_argument('--interface', nargs='+', choices=FTDI_INTERFACES, default=['A'],
+            help='FTDI interfaces to decode, each is decoded in its own worker process (default A)')
+    parser.add_argument('--device', type=usb_device, metavar='BUS.DEVICE',
+            help='Only decode the FTDI adapter at this USB bus number and device address (default all adapters)')
+    parser.add_argument('--stream_json', action='store_true', help='Parse the JSON PCAP one frame at a time to bound memory usage')
+    parser.add_argument('--json_workers', type=int, help='Parse the JSON PCAP in chunks with this many worker processes, 0 uses all CPUs')
+    parser.add_argument('--no_cache', action='store_true', help='Do not read or write the extracted payload cache or frame index next to the input')
+    parser.add_argument('--start_frame', type=int, help='Only decode from this frame number, starting at the first safe point in the window')
+    parser.add_argument('--end_frame', type=int, help='Only decode up to and including this frame number')
+    parser.add_argument('--follow', action='store_true', help='Decode --pcap, --tsv_pcap or --ek_pcap while it is being written, use - to read from stdin')
+    parser.add_argument('--follow_timeout', type=float, help='With --follow, stop once the input has not grown for this many seconds')
+    parser.add_argument('--bounded_memory', action='store_true',
+            help='Decode a single stream while the input is read, releasing consumed data so memory use does not grow with the capture')
+
+
+def check_input_arguments(parser, args):
+    """ Reports invalid combinations of input arguments with parser.error. """
+    if args.follow and args.json_pcap is not None:
+        parser.error('--follow requires --pcap, --tsv_pcap or --ek_pcap')
+
+    if args.json_workers is not None and args.stream_json:
+        parser.error('--json_workers cannot be combined with --stream_json')
+
+    if args.command_log is not None and (args.follow or args.bounded_memory or has_window(args)):
+        parser.error('--command_log is not supported with --follow, --bounded_memory, --start_frame or --end_frame')
+
+    if args.follow and len(args.interface) > 1:
+        parser.error('--follow decodes a single --interface')
+
+    if args.bounded_memory and len(args.interface) > 1:
+        parser.error('--bounded_memory decodes a single --interface')
+
+    if len(set(args.interface)) != len(args.interface):
+        parser.error('--interface given more than once')
+
+    if args.start_frame is not None and args.end_frame is not None and args.start_frame > args.end_frame:
+        parser.error('--start_frame must not be after --end_frame')
+
+
+def has_window(args):
+    return args.start_frame is not None or args.end_frame is not None
+
+
+def starts_mid_capture(args):
+    """ Returns True if decoding starts part way through the capture. """
+    return args.start_frame is not None and args.start_frame > 1
+
+
+def device_frames(frames, device):
+    """ Yield the (StreamKey, frame, tx bytes, rx bytes) frames of the USB device (bus, device). """
+    for frame in frames:
+        if frame[0][:2] == device:
+            yield frame
+
+
+def select_device(streams, args):
+    """ Returns the {StreamKey: (ftdi_bytes, ftdi_replies)} streams of the device selected in args. """
+    if args.device is None:
+        return streams
+
+    return {key: buffers for key, buffers in streams.items() if key[:2] == args.device}
+
+
+def apply_window(frames, args):
+    """ Restrict (StreamKey, frame, tx bytes, rx bytes) frames to the device and window selected in args. """
+    if args.device is not None:
+        frames = device_frames(frames, args.device)
+
+    frames = window_frames(frames, args.start_frame, args.end_frame)
+    if starts_mid_capture(args):
+        frames = resync_frames(frames)
+
+    return frames
+
+
+def capture_source(args):
+    """ Returns (input path, description of how it is read) for args. """
+    if args.pcap is not None:
+        return args.pcap, 'pcap'
+    elif args.tsv_pcap is not None:
+        return args.tsv_pcap, 'tsv'
+    elif args.ek_pcap is not None:
+        return args.ek_pcap, 'ek'
+    else:
+        return args.json_pcap, 'json'
+
+
+def cache_source(args):
+    """ Returns the description of how the input is read recorded in the payload cache. """
+    _, source = capture_source(args)
+    return '{}:{}'.format(source, ','.join(args.interface))
+
+
+def read_capture(args):
+    """ Parse the input selected in args into {StreamKey: (ftdi_bytes, ftdi_replies)}.
+
+    The requested interfaces of all devices are extracted in one pass over
+    the input.
+
+    Compressed inputs are decompressed as a stream.  Compressed JSON is always
+    parsed one frame at a time, so memory use does not depend on the
+    uncompressed size.
+
+    """
+    interfaces = args.interface
+    if args.pcap is not None:
+        with open_capture(args.pcap) as f:
+            return pcap_usb_reader(f, interfaces)
+    elif args.tsv_pcap is not None:
+        with open_capture(args.tsv_pcap, text=True) as f:
+            return pcap_tsv_reader(f, interfaces)
+    elif args.ek_pcap is not None:
+        with open_capture(args.ek_pcap, text=True) as f:
+            return pcap_ek_reader(f, interfaces)
+
+    compressed = detect_compression(args.json_pcap) is not None
+    if args.json_workers is not None and not compressed:
+        return pcap_json_parallel_reader(args.json_pcap, workers=args.json_workers or None, interfaces=interfaces)
+    else:
+        with open_capture(args.json_pcap, text=True) as f:
+            return pcap_json_reader(f, streaming=args.stream_json or compressed, interfaces=interfaces)
+
+
+def load_frame_index(path, source):
+    """ Returns the frame index of path, building and saving it if needed. """
+    index = read_frame_index(path, source)
+    if index is not None:
+        return index
+
+    print('Building frame index')
+    index = build_frame_index(path, source)
+    try:
+        write_frame_index(path, source, index)
+    except OSError as e:
+        print('Failed to write frame index:', e)
+
+    return index
+
+
+def iter_capture_frames(path, source, interfaces, start=None, vendor_ids=None):
+    """ Yield (StreamKey, frame, tx bytes, rx bytes) of interfaces from the capture at path.
+
+    start is a frame index entry to resume reading at, which requires an
+    uncompressed capture.  vendor_ids are the USB devices enumerated before
+    start, see iter_usb_payloads.  When resuming a tshark field export, its
+    header line (if any) is read first, so fields are still found by name.
+
+    """
+    with open_capture(path) as f:
+        if source == 'pcap':
+            yield from iter_usb_payloads(map_capture(f), interfaces, start=start, vendor_ids=vendor_ids)
+            return
+
+        first_frame = 1
+        header = []
+        if start is not None:
+            first_frame = start[0]
+            if source == 'tsv':
+                line = f.readline().decode()
+                if line.startswith('frame.number'):
+                    header.append(line)
+
+            f.seek(start[2])
+
+        text = io.TextIOWrapper(f)
+        if source == 'tsv':
+            yield from iter_tsv_frames(itertools.chain(header, text), interfaces)
+        elif source == 'ek':
+            yield from iter_ek_frames(text, first_frame, interfaces)
+        elif source == 'json':
+            yield from iter_json_frames(iter_json_array(text, started=start is not None), first_frame, interfaces)
+        else:
+            assert False, source
+
+
+def capture_frames(args):
+    """ Yield the (StreamKey, frame, tx bytes, rx bytes) frames of the device and window selected in args.
+
+    Uncompressed inputs are read from the closest frame index entry before
+    the window, reading of all inputs stops after the window.
+
+    """
+    path, source = capture_source(args)
+
+    start = None
+    vendor_ids = None
+    if args.start_frame is not None and not args.no_cache and detect_compression(path) is None:
+        index = load_frame_index(path, source)
+        start = frame_index_start(index, args.start_frame)
+        if start is not None:
+            vendor_ids = vendor_ids_before(index, start[0])
+
+    frames = iter_capture_frames(path, source, args.interface, start, vendor_ids)
+    return apply_window(frames, args)
+
+
+def read_capture_window(args):
+    """ Returns {StreamKey: (ftdi_bytes, ftdi_replies)} of the frame window selected in args. """
+    streams = collect_streams(capture_frames(args))
+
+    for key, (ftdi_bytes, _) in streams.items():
+        if ftdi_bytes.frames:
+            print('Decoding {} from frame {}'.format(stream_title(key), min(ftdi_bytes.frames)))
+
+    return streams
+
+
+def load_capture(args):
+    """ Returns {StreamKey: (ftdi_bytes, ftdi_replies)} from the input selected in args.
+
+    Uses the payload cache next to the input when it is valid, otherwise
+    parses the input and writes the cache.  The cache holds the streams of
+    every device, --device is applied after reading it.  A frame window is
+    always read from the input, without the payload cache.
+
+    """
+    if has_window(args):
+        return read_capture_window(args)
+
+    path, _ = capture_source(args)
+    if not args.no_cache:
+        streams = read_payload_cache(path, cache_source(args))
+        if streams is not None:
+            print('Using cached payloads')
+            return select_device(streams, args)
+
+    streams = read_capture(args)
+
+    if not args.no_cache:
+        try:
+            write_payload_cache(path, cache_source(args), streams)
+        except OSError as e:
+            print('Failed to write payload cache:', e)
+
+    return select_device(streams, args)
+
+
+def open_follow(path, timeout):
+    """ Open path (or stdin if path is -) for following. """
+    if path == '-':
+        return sys.stdin.buffer
+    else:
+        return FollowFile(open(path, 'rb'), timeout=timeout)
+
+
+def follow_capture(args):
+    """ Returns a CaptureFollower for the input, device and interface selected in args.
+
+    Without --device, the first adapter seen in the capture is followed.
+
+    """
+    path, source = capture_source(args)
+    f = open_follow(path, args.follow_timeout)
+
+    if source == 'pcap':
+        frames = iter_usb_payloads(f, args.interface)
+    elif source == 'tsv':
+        frames = iter_tsv_frames((line.decode() for line in f), args.interface)
+    elif source == 'ek':
+        frames = iter_ek_frames(f, interfaces=args.interface)
+    else:
+        assert False, source
+
+    return CaptureFollower(first_stream_frames(apply_window(frames, args)))
+
+
+def stream_capture(args):
+    """ Returns a CaptureFollower decoding the input selected in args while it is read.
+
+    Used for --bounded_memory, consumed data is released as decoding
+    proceeds.  Like follow_capture, the first adapter seen is decoded unless
+    --device is given.
+
+    """
+    return CaptureFollower(first_stream_frames(capture_frames(args)))
@@ -0,0 +1,312 @@
+""" Output of decoded FTDI commands (--ftdi_commands), and reading it back.
+
+Commands can be written in three formats:
+
+ - json - A JSON array with an object per command, data and reply as lists
+   of integers.
+ - jsonl - A JSON object per line, data and reply as hex strings.
+ - binary - A binary command log with an index for random access, see
+   below.
+
+All formats are read back by read_command_log, so the JTAG simulation can be
+run again without decoding the capture.  Command types and flags are not
+stored in the jsonl and binary formats, as they follow from the opcode, see
+FTDI_OPCODES.
+
+Binary command log layout (little endian):
+
+    magic         8 bytes  COMMAND_LOG_MAGIC
+    version       u32      COMMAND_LOG_VERSION
+    reserved      u32
+    then for each command, a COMMAND_LOG_RECORD:
+        opcode        u8
+        command_frame i64      -1 if unknown
+        reply_frame   i64      -1 if unknown
+        length        u32      0 if None
+        data_len      u32      0 if data is None
+        reply_len     u32      0 if reply is None
+        data          data_len bytes
+        reply         reply_len bytes
+    index         commands * u64 file offset of each record
+    trailer       COMMAND_LOG_TRAILER
+        magic         8 bytes  COMMAND_LOG_INDEX_MAGIC
+        commands      u64      number of commands
+        index_offset  u64      file offset of the index
+
+A log without a trailer (e.g. the decoder was interrupted) is still read
+sequentially, up to its last complete record.
+
+"""
+import json
+import mmap
+import struct
+import sys
+from array import array
+from .ftdi_decoder import FtdiCommand, FtdiCommandType, FTDI_OPCODES
+from .pcap_reader import json_loads
+
+COMMAND_LOG_FORMATS = ('json', 'jsonl', 'binary')
+
+COMMAND_LOG_MAGIC = b'FTDICMD\0'
+COMMAND_LOG_INDEX_MAGIC = b'FTDIIDX\0'
+COMMAND_LOG_VERSION = 1
+COMMAND_LOG_HEADER = struct.Struct('<8sII')
+COMMAND_LOG_RECORD = struct.Struct('<BqqIII')
+COMMAND_LOG_TRAILER = struct.Struct('<8sQQ')
+
+NO_FRAME = -1
+
+
+def command_to_json(command):
+    """ Returns the JSON object of an FtdiCommand, omitting fields that are None. """
+    o = command._asdict()
+    o['type'] = command.type.name
+    if command.flags is not None:
+        o['flags'] = [flag.name for flag in command.flags]
+
+    for k in command._fields:
+        if o[k] is None:
+            del o[k]
+
+    return o
+
+
+def data_to_bytes(command):
+    """ Returns the TX data of command as bytes, or None. """
+    if command.data is None:
+        return None
+    elif command.type == FtdiCommandType.SET_DIVISOR:
+        return command.data[0].to_bytes(2, 'little')
+    else:
+        return bytes(command.data)
+
+
+def make_logged_command(opcode, command_frame, reply_frame, length, data, reply):
+    """ Returns the FtdiCommand of a logged command, with data and reply as bytes or None. """
+    ftdi_opcode = FTDI_OPCODES[opcode]
+    if data is not None:
+        if ftdi_opcode.type == FtdiCommandType.SET_DIVISOR:
+            data = [int.from_bytes(data, 'little')]
+        else:
+            data = list(data)
+
+    return FtdiCommand(
+            type=ftdi_opcode.type,
+            flags=ftdi_opcode.flags,
+            command_frame=command_frame,
+            reply_frame=reply_frame,
+            opcode=opcode,
+            length=length,
+            data=data,
+            reply=None if reply is None else list(reply))
+
+
+class CommandWriter(object):
+    """ Base of the command log writers, see write_command_log. """
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+
+    def tee(self, commands):
+        """ Yield commands, writing each one first. """
+        for command in commands:
+            self.write(command)
+            yield command
+
+    def close(self):
+        self.f.close()
+
+
+class JsonCommandWriter(CommandWriter):
+    """ Writes FtdiCommands to a JSON array as they are decoded.
+
+    The output is the same as json.dump of the whole list with indent=2, but
+    commands are written one at a time, so they do not all have to be kept
+    in memory.  close() ends the array.
+
+    """
+    def write(self, command):
+        text = json.dumps(command_to_json(command), indent=2).replace('\n', '\n  ')
+        self.f.write('{}\n  {}'.format(',' if self.count else '[', text))
+        self.count += 1
+
+    def close(self):
+        self.f.write('\n]' if self.count else '[]')
+        self.f.close()
+
+
+class JsonlCommandWriter(CommandWriter):
+    """ Writes FtdiCommands as a JSON object per line, with hex data and reply. """
+    def write(self, command):
+        o = {}
+        o['type'] = command.type.name
+        for k in ('command_frame', 'reply_frame', 'opcode', 'length'):
+            if getattr(command, k) is not None:
+                o[k] = getattr(command, k)
+
+        data = data_to_bytes(command)
+        if data is not None:
+            o['data'] = data.hex()
+        if command.reply is not None:
+            o['reply'] = bytes(command.reply).hex()
+
+        self.f.write(json.dumps(o, separators=(',', ':')))
+        self.f.write('\n')
+        self.count += 1
+
+
+class BinaryCommandWriter(CommandWriter):
+    """ Writes FtdiCommands to a binary command log, see the module docstring. """
+    def __init__(self, f):
+        CommandWriter.__init__(self, f)
+        self.offsets = array('Q')
+        self.offset = COMMAND_LOG_HEADER.size
+        f.write(COMMAND_LOG_HEADER.pack(COMMAND_LOG_MAGIC, COMMAND_LOG_VERSION, 0))
+
+    def write(self, command):
+        data = data_to_bytes(command) or b''
+        reply = b'' if command.reply is None else bytes(command.reply)
+        record = COMMAND_LOG_RECORD.pack(
+                command.opcode,
+                NO_FRAME if command.command_frame is None else command.command_frame,
+                NO_FRAME if command.reply_frame is None else command.reply_frame,
+                command.length or 0,
+                len(data),
+                len(reply))
+
+        self.f.write(record)
+        self.f.write(data)
+        self.f.write(reply)
+        self.offsets.append(self.offset)
+        self.offset += len(record) + len(data) + len(reply)
+        self.count += 1
+
+    def close(self):
+        offsets = self.offsets
+        if sys.byteorder == 'big':
+            offsets = array('Q', offsets)
+            offsets.byteswap()
+
+        self.f.write(offsets.tobytes())
+        self.f.write(COMMAND_LOG_TRAILER.pack(COMMAND_LOG_INDEX_MAGIC, self.count, self.offset))
+        self.f.close()
+
+
+def write_command_log(path, log_format='json'):
+    """ Returns a CommandWriter writing to path in log_format, see COMMAND_LOG_FORMATS. """
+    if log_format == 'json':
+        return JsonCommandWriter(open(path, 'w'))
+    elif log_format == 'jsonl':
+        return JsonlCommandWriter(open(path, 'w'))
+    elif log_format == 'binary':
+        return BinaryCommandWriter(open(path, 'wb'))
+    else:
+        raise ValueError('Unknown command log format {!r}'.format(log_format))
+
+
+class BinaryCommandLog(object):
+    """ Random access to the commands of a binary command log.
+
+    The log is memory mapped, and commands are read on access.  Logs
+    without a trailer can only be iterated.
+
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, _ = COMMAND_LOG_HEADER.unpack_from(self.data)
+        if magic != COMMAND_LOG_MAGIC or version != COMMAND_LOG_VERSION:
+            raise ValueError('{} is not a version {} binary command log'.format(path, COMMAND_LOG_VERSION))
+
+        self.offsets = None
+        self.end = len(self.data)
+        if len(self.data) >= COMMAND_LOG_HEADER.size + COMMAND_LOG_TRAILER.size:
+            magic, count, index_offset = COMMAND_LOG_TRAILER.unpack_from(self.data, len(self.data) - COMMAND_LOG_TRAILER.size)
+            if magic == COMMAND_LOG_INDEX_MAGIC:
+                self.offsets = array('Q')
+                self.offsets.frombytes(self.data[index_offset:index_offset + count * 8])
+                if sys.byteorder == 'big':
+                    self.offsets.byteswap()
+
+                self.end = index_offset
+
+    def read_record(self, offset):
+        """ Returns (FtdiCommand, offset of the next record) of the record at offset. """
+        opcode, command_frame, reply_frame, length, data_len, reply_len = COMMAND_LOG_RECORD.unpack_from(self.data, offset)
+        offset += COMMAND_LOG_RECORD.size
+        data = self.data[offset:offset + data_len] if data_len else None
+        offset += data_len
+        reply = self.data[offset:offset + reply_len] if reply_len else None
+        offset += reply_len
+
+        command = make_logged_command(
+                opcode,
+                None if command_frame == NO_FRAME else command_frame,
+                None if reply_frame == NO_FRAME else reply_frame,
+                length or None,
+                data,
+                reply)
+        return command, offset
+
+    def __len__(self):
+        if self.offsets is None:
+            raise TypeError('Command log has no index')
+
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        if self.offsets is None:
+            raise TypeError('Command log has no index')
+
+        command, _ = self.read_record(self.offsets[index])
+        return command
+
+    def __iter__(self):
+        offset = COMMAND_LOG_HEADER.size
+        while offset + COMMAND_LOG_RECORD.size <= self.end:
+            _, _, _, _, data_len, reply_len = COMMAND_LOG_RECORD.unpack_from(self.data, offset)
+            if offset + COMMAND_LOG_RECORD.size + data_len + reply_len > self.end:
+                break
+
+            command, offset = self.read_record(offset)
+            yield command
+
+
+def iter_json_commands(f):
+    for o in json_loads(f.read()):
+        data = o.get('data')
+        if data is not None and o['opcode'] == FtdiCommandType.SET_DIVISOR.value:
+            data = data[0].to_bytes(2, 'little')
+
+        yield make_logged_command(o['opcode'], o.get('command_frame'), o.get('reply_frame'), o.get('length'),
+                data, o.get('reply'))
+
+
+def iter_jsonl_commands(f):
+    for line in f:
+        if not line.strip():
+            continue
+
+        o = json_loads(line)
+        data = o.get('data')
+        reply = o.get('reply')
+        yield make_logged_command(o['opcode'], o.get('command_frame'), o.get('reply_frame'), o.get('length'),
+                None if data is None else bytes.fromhex(data),
+                None if reply is None else bytes.fromhex(reply))
+
+
+def read_command_log(path):
+    """ Yield the FtdiCommands of a command log written in any of COMMAND_LOG_FORMATS. """
+    with open(path, 'rb') as f:
+        start = f.read(len(COMMAND_LOG_MAGIC))
+
+    if start == COMMAND_LOG_MAGIC:
+        yield from BinaryCommandLog(path)
+        return
+
+    with open(path) as f:
+        if start.lstrip().startswith(b'['):
+            yield from iter_json_commands(f)
+        else:
+            yield from iter_jsonl_commands(f)
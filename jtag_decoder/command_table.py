@@ -0,0 +1,184 @@
+""" Compact storage of decoded FTDI commands.
+
+A list of FtdiCommand keeps a namedtuple, lists of ints for the data and
+reply, and a list of flags per command, which is several hundred bytes per
+command.  CommandTable instead keeps each field in a typed array, and the
+data and reply as offsets into the TX and RX Buffers they were decoded from,
+which is a few dozen bytes per command.  Rows are read through CommandRow,
+which has the same fields as FtdiCommand.
+
+"""
+from array import array
+from .ftdi_decoder import (FtdiCommand, FtdiCommandType, FTDI_OPCODES, iter_commands,
+        iter_commands_recovering)
+
+# Stored in place of None in the integer arrays.
+NO_FRAME = -1
+NO_LENGTH = 0
+
+
+class CommandRow(object):
+    """ A command of a CommandTable, with the fields of FtdiCommand.
+
+    data and reply are memoryviews of the TX and RX buffers, except for
+    SET_DIVISOR, whose data is the divisor like in FtdiCommand.
+
+    """
+    __slots__ = ('table', 'index')
+    _fields = FtdiCommand._fields
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    @property
+    def opcode(self):
+        return self.table.opcodes[self.index]
+
+    @property
+    def type(self):
+        return FTDI_OPCODES[self.opcode].type
+
+    @property
+    def flags(self):
+        return FTDI_OPCODES[self.opcode].flags
+
+    @property
+    def command_frame(self):
+        frame = self.table.command_frames[self.index]
+        return None if frame == NO_FRAME else frame
+
+    @property
+    def reply_frame(self):
+        frame = self.table.reply_frames[self.index]
+        return None if frame == NO_FRAME else frame
+
+    @property
+    def length(self):
+        length = self.table.lengths[self.index]
+        return None if length == NO_LENGTH else length
+
+    @property
+    def data(self):
+        begin = self.table.data_begins[self.index]
+        end = self.table.data_ends[self.index]
+        if begin == end:
+            return None
+
+        data = self.table.ftdi_bytes.view(begin, end)
+        if self.opcode == FtdiCommandType.SET_DIVISOR.value:
+            return [data[0] | (data[1] << 8)]
+        else:
+            return data
+
+    @property
+    def reply(self):
+        begin = self.table.reply_begins[self.index]
+        end = self.table.reply_ends[self.index]
+        if begin == end:
+            return None
+
+        return self.table.ftdi_replies.view(begin, end)
+
+    def to_command(self):
+        """ Returns the row as an FtdiCommand. """
+        data = self.data
+        reply = self.reply
+        return FtdiCommand(
+                type=self.type,
+                flags=self.flags,
+                command_frame=self.command_frame,
+                reply_frame=self.reply_frame,
+                opcode=self.opcode,
+                length=self.length,
+                data=None if data is None else list(data),
+                reply=None if reply is None else list(reply))
+
+    def _asdict(self):
+        return self.to_command()._asdict()
+
+    def __repr__(self):
+        return repr(self.to_command())
+
+
+class CommandTable(object):
+    """ FTDI commands decoded from ftdi_bytes and ftdi_replies, stored as parallel arrays.
+
+    The type and flags of a command follow from its opcode, see FTDI_OPCODES,
+    so only the opcode is stored.  The buffers must keep all of their data
+    (no history) for as long as the table is used, and cannot grow while
+    views of a row's data or reply are alive.
+
+    """
+    def __init__(self, ftdi_bytes, ftdi_replies):
+        self.ftdi_bytes = ftdi_bytes
+        self.ftdi_replies = ftdi_replies
+        self.opcodes = array('B')
+        self.lengths = array('L')
+        self.command_frames = array('q')
+        self.reply_frames = array('q')
+        self.data_begins = array('Q')
+        self.data_ends = array('Q')
+        self.reply_begins = array('Q')
+        self.reply_ends = array('Q')
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError('command index out of range')
+
+        return CommandRow(self, index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield CommandRow(self, index)
+
+    def append(self, command, tx_end, rx_end):
+        """ Append an FtdiCommand whose TX and RX data end at absolute indices tx_end and rx_end.
+
+        As decoded commands read their data last, the data and reply are the
+        bytes just before tx_end and rx_end.
+
+        """
+        if command.data is None:
+            data_size = 0
+        elif command.type == FtdiCommandType.SET_DIVISOR:
+            data_size = 2
+        else:
+            data_size = len(command.data)
+
+        reply_size = 0 if command.reply is None else len(command.reply)
+
+        self.opcodes.append(command.opcode)
+        self.lengths.append(NO_LENGTH if command.length is None else command.length)
+        self.command_frames.append(NO_FRAME if command.command_frame is None else command.command_frame)
+        self.reply_frames.append(NO_FRAME if command.reply_frame is None else command.reply_frame)
+        self.data_begins.append(tx_end - data_size)
+        self.data_ends.append(tx_end)
+        self.reply_begins.append(rx_end - reply_size)
+        self.reply_ends.append(rx_end)
+
+
+def decode_command_table(ftdi_bytes, ftdi_replies, recoveries=None):
+    """ Decode commands from ftdi_bytes, paired with replies, into a CommandTable.
+
+    If recoveries is not None, decode errors are skipped over and appended to
+    it, see iter_commands_recovering.
+
+    """
+    table = CommandTable(ftdi_bytes, ftdi_replies)
+    if recoveries is None:
+        commands = iter_commands(ftdi_bytes, ftdi_replies)
+    else:
+        commands = iter_commands_recovering(ftdi_bytes, ftdi_replies, recoveries)
+
+    # Commands are yielded as soon as they are decoded, so the buffers are
+    # still positioned just after each command.
+    for command in commands:
+        table.append(command, ftdi_bytes.tell(), ftdi_replies.tell())
+
+    return table
@@ -0,0 +1,81 @@
+""" Transparent decompression of compressed captures.
+
+The compression format is detected from the magic bytes at the start of the
+file, and the file is decompressed as a stream while it is read, so nothing
+is unpacked to disk and memory use does not depend on the uncompressed size.
+
+"""
+import bz2
+import gzip
+import io
+import lzma
+
+# Optional, only needed for zstd compressed captures.
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_MAGIC = [
+        ('gzip', b'\x1f\x8b'),
+        ('xz', b'\xfd7zXZ\x00'),
+        ('zstd', b'\x28\xb5\x2f\xfd'),
+        ('bzip2', b'BZh'),
+        ]
+
+
+def detect_compression(path):
+    """ Returns name of the compression used by the file at path, or None. """
+    with open(path, 'rb') as f:
+        magic = f.read(max(len(m) for _, m in COMPRESSION_MAGIC))
+
+    for name, m in COMPRESSION_MAGIC:
+        if magic.startswith(m):
+            return name
+
+    return None
+
+
+def open_binary(path, compression):
+    if compression is None:
+        return open(path, 'rb')
+    elif compression == 'gzip':
+        return gzip.open(path, 'rb')
+    elif compression == 'xz':
+        return lzma.open(path, 'rb')
+    elif compression == 'bzip2':
+        return bz2.open(path, 'rb')
+    elif compression == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('{} is zstd compressed, install the zstandard package to read it'.format(path))
+
+        # Captures compressed in parallel (pzstd) or concatenated hold
+        # several frames, stream_reader stops after the first by default.
+        f = open(path, 'rb')
+        try:
+            reader = zstandard.ZstdDecompressor().stream_reader(f, closefd=True, read_across_frames=True)
+        except TypeError:
+            f.close()
+            raise RuntimeError('{} is zstd compressed, the installed zstandard package is too old to read '
+                    'multi-frame streams, upgrade it to 0.16 or later'.format(path))
+
+        return io.BufferedReader(reader)
+    else:
+        assert False, compression
+
+
+def open_capture(path, text=False):
+    """ Open the capture at path for reading, decompressing it if needed.
+
+    Returns a binary file object, or a text file object if text is set.
+
+    """
+    compression = detect_compression(path)
+    if compression is None:
+        return open(path, 'r' if text else 'rb')
+
+    f = open_binary(path, compression)
+    if text:
+        return io.TextIOWrapper(f)
+    else:
+        return f
@@ -0,0 +1,126 @@
+""" Decoding of captures while they are still being written.
+
+Frames are read from a pipe (e.g. "tshark -l -T ek" or "dumpcap -w -") or a
+file that is being appended to, and FTDI commands are decoded as soon as all
+of their bytes have arrived.  Consumed data is released as decoding proceeds,
+so memory use does not grow with the length of the capture.
+
+"""
+import time
+from .buffer import Buffer
+from .ftdi_decoder import DecodeError, DECODE_HISTORY, CommandHistory, decode_available_commands
+from .pcap_reader import add_payloads
+
+# How often a followed file is checked for new data, in seconds.
+FOLLOW_POLL_INTERVAL = 0.1
+
+# Number of consumed bytes kept in each Buffer as context for a DecodeError.
+FOLLOW_CONTEXT_BYTES = 64
+
+
+class FollowFile(object):
+    """ Binary file wrapper that waits for a growing file to be appended to.
+
+    Reads block until the requested data has been written.  If timeout is
+    not None, the file is considered complete once it has not grown for
+    timeout seconds, and reads then return short like at end of file.
+
+    """
+    def __init__(self, f, poll_interval=FOLLOW_POLL_INTERVAL, timeout=None):
+        self.f = f
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.last_data = time.monotonic()
+
+    def wait(self):
+        """ Wait for more data, returns False if the timeout has expired. """
+        if self.timeout is not None and time.monotonic() - self.last_data > self.timeout:
+            return False
+
+        time.sleep(self.poll_interval)
+        return True
+
+    def read(self, n):
+        chunks = []
+        while n > 0:
+            data = self.f.read(n)
+            if data:
+                chunks.append(data)
+                n -= len(data)
+                self.last_data = time.monotonic()
+            elif not self.wait():
+                break
+
+        return b''.join(chunks)
+
+    def readline(self):
+        chunks = []
+        while True:
+            data = self.f.readline()
+            if data:
+                chunks.append(data)
+                self.last_data = time.monotonic()
+                if data.endswith(b'\n'):
+                    break
+            elif not self.wait():
+                break
+
+        return b''.join(chunks)
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+
+            yield line
+
+
+def first_stream_frames(frames):
+    """ Yield the (StreamKey, frame, tx bytes, rx bytes) frames of the first stream in frames.
+
+    Frames of other streams (e.g. another FTDI adapter in the capture) are
+    dropped.
+
+    """
+    first_key = None
+    for frame in frames:
+        if first_key is None:
+            first_key = frame[0]
+        elif frame[0] != first_key:
+            continue
+
+        yield frame
+
+
+class CaptureFollower(object):
+    """ Decodes FTDI commands from frames as they arrive.
+
+    frames is an iterator of (StreamKey, frame, tx bytes, rx bytes) of a
+    single stream, which may block while waiting for the capture to grow.
+
+    Decoding stops at the first command that is missing bytes or replies, and
+    resumes from that command when the next frame arrives.  Only a small
+    amount of consumed data and command history is kept for error context.
+
+    """
+    def __init__(self, frames, history=DECODE_HISTORY, context=FOLLOW_CONTEXT_BYTES):
+        self.frames = frames
+        self.ftdi_bytes = Buffer(history=context)
+        self.ftdi_replies = Buffer(history=context)
+        self.history = CommandHistory(history)
+
+    def commands(self):
+        """ Yield each FtdiCommand as soon as it has been decoded. """
+        for _, frame, tx_data, rx_data in self.frames:
+            add_payloads(self.ftdi_bytes, self.ftdi_replies, frame, tx_data, rx_data)
+
+            for command in decode_available_commands(self.ftdi_bytes, self.ftdi_replies, self.history):
+                self.history.append(command)
+                yield command
+
+        if len(self.ftdi_bytes) != 0:
+            raise DecodeError('Capture ended part way through a command, leftover = {}.'.format(len(self.ftdi_bytes)), self.history)
+
+        if len(self.ftdi_replies) != 0:
+            raise DecodeError('Leftover RX data, leftover = {}.'.format(len(self.ftdi_replies)), self.history)
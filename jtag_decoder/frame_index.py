@@ -0,0 +1,301 @@
+""" Persistent index from frame number to byte offset in a capture.
+
+Decoding a window of a large capture (--start_frame/--end_frame) should not
+require parsing every frame before the window.  The index records the byte
+offset of every FRAME_INDEX_STRIDE'th frame record, so reading can seek to
+shortly before the window.  It is built once and stored next to the input.
+
+Sidecar layout (little endian):
+
+    magic         8 bytes  FRAME_INDEX_MAGIC
+    version       u32      FRAME_INDEX_VERSION
+    source_len    u32      length of source
+    input_size    u64      size of the input capture
+    input_mtime   u64      st_mtime_ns of the input capture
+    stride        u64      frames between index entries
+    entries       u64      number of index entries
+    enumerations  u64      number of device enumerations
+    source        source_len bytes, describes how the input was read
+    entries       entries * (frame u64, section offset u64, record offset u64)
+    enumerations  enumerations * (frame u64, bus u64, device u64, vendor ID u64)
+
+The section offset and enumerations are only used for pcap/pcapng, see
+iter_pcap_packets and iter_usb_payloads.  Unlike the payload cache the input
+is not hashed, as that would read the whole capture on every run.
+
+"""
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+from .pcap_reader import json_loads, ek_field
+from .parallel_json_reader import FRAME_START_RE
+from .usb_pcap_reader import iter_pcap_packets, parse_usb_packet, device_vendor_id
+
+FRAME_INDEX_MAGIC = b'FRMINDX\0'
+FRAME_INDEX_VERSION = 1
+FRAME_INDEX_SUFFIX = '.frame_index'
+FRAME_INDEX_HEADER = struct.Struct('<8sII QQ QQQ')
+
+# Frames between index entries.  Reading seeks to the closest entry before
+# the window, so at most this many frames are parsed and dropped.
+FRAME_INDEX_STRIDE = 1024
+
+# Frame index of a capture.
+#
+#  entries - array of (frame, section offset, record offset) triples, in
+#            frame order.
+#  enumerations - array of (frame, bus, device, vendor ID) quads, one for
+#                 each device descriptor in a USB capture.
+FrameIndex = namedtuple('FrameIndex', 'entries enumerations')
+
+
+def index_path(path):
+    return path + FRAME_INDEX_SUFFIX
+
+
+def iter_pcap_index(f, stride, enumerations):
+    """ Yield (frame, section offset, record offset) of every stride'th pcap record.
+
+    Device enumerations are appended to enumerations.
+
+    """
+    for idx, (frame, (section, offset), linktype, byte_order, packet) in enumerate(iter_pcap_packets(f)):
+        if idx % stride == 0:
+            yield frame, section, offset
+
+        usb_packet = parse_usb_packet(linktype, byte_order, packet)
+        if usb_packet is not None:
+            vendor_id = device_vendor_id(usb_packet)
+            if vendor_id is not None:
+                enumerations.extend((frame, usb_packet.bus, usb_packet.device, vendor_id))
+
+
+def iter_json_index(f, stride):
+    """ Yield (frame, 0, offset) of every stride'th frame of a pretty printed JSON export.
+
+    Frame objects are found the same way as when splitting the export for
+    parallel parsing, an export that is not pretty printed has no entries.
+
+    """
+    for idx, m in enumerate(FRAME_START_RE.finditer(f)):
+        if idx % stride == 0:
+            yield idx + 1, 0, m.start() + 1
+
+
+def iter_tsv_index(f, stride):
+    """ Yield (frame, 0, offset) of every stride'th frame line of a tshark field export. """
+    offset = 0
+    idx = 0
+    for line in f:
+        frame = line.split(b'\t', 1)[0]
+        if frame.isdigit():
+            if idx % stride == 0:
+                yield int(frame), 0, offset
+            idx += 1
+
+        offset += len(line)
+
+
+def iter_ek_index(f, stride):
+    """ Yield (frame, 0, offset) of every stride'th packet document of a tshark -T ek export.
+
+    Only the indexed documents are parsed, the others are told apart from
+    index lines by their start.
+
+    """
+    offset = 0
+    idx = 0
+    for line in f:
+        if line.strip() and not line.startswith(b'{"index"'):
+            if idx % stride == 0:
+                frame = ek_field(json_loads(line).get('layers', {}).get('frame', {}), 'frame.number')
+                yield idx + 1 if frame is None else int(frame), 0, offset
+            idx += 1
+
+        offset += len(line)
+
+
+def build_frame_index(path, source, stride=FRAME_INDEX_STRIDE):
+    """ Returns the FrameIndex of the uncompressed capture at path. """
+    index = FrameIndex(array('Q'), array('Q'))
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return index
+
+        if source == 'pcap':
+            entries = iter_pcap_index(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), stride, index.enumerations)
+        elif source == 'json':
+            entries = iter_json_index(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), stride)
+        elif source == 'tsv':
+            entries = iter_tsv_index(f, stride)
+        elif source == 'ek':
+            entries = iter_ek_index(f, stride)
+        else:
+            assert False, source
+
+        for entry in entries:
+            index.entries.extend(entry)
+
+    return index
+
+
+def write_frame_index(path, source, index, stride=FRAME_INDEX_STRIDE):
+    """ Write the frame index sidecar for the capture at path. """
+    st = os.stat(path)
+    source = source.encode('utf-8')
+
+    entries = array('Q', index.entries)
+    enumerations = array('Q', index.enumerations)
+    if sys.byteorder == 'big':
+        entries.byteswap()
+        enumerations.byteswap()
+
+    header = FRAME_INDEX_HEADER.pack(
+            FRAME_INDEX_MAGIC,
+            FRAME_INDEX_VERSION,
+            len(source),
+            st.st_size,
+            st.st_mtime_ns,
+            stride,
+            len(entries) // 3,
+            len(enumerations) // 4)
+
+    tmp_path = index_path(path) + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        f.write(source)
+        f.write(entries.tobytes())
+        f.write(enumerations.tobytes())
+
+    os.replace(tmp_path, index_path(path))
+
+
+def read_frame_index(path, source, stride=FRAME_INDEX_STRIDE):
+    """ Returns the FrameIndex from the sidecar of path.
+
+    Returns None if there is no sidecar, or it does not match the current
+    input file, source or stride.
+
+    """
+    try:
+        f = open(index_path(path), 'rb')
+    except FileNotFoundError:
+        return None
+
+    with f:
+        data = f.read()
+
+    if len(data) < FRAME_INDEX_HEADER.size:
+        return None
+
+    (magic, version, source_len, input_size, input_mtime, index_stride,
+            num_entries, num_enumerations) = FRAME_INDEX_HEADER.unpack_from(data, 0)
+
+    if magic != FRAME_INDEX_MAGIC or version != FRAME_INDEX_VERSION or index_stride != stride:
+        return None
+
+    offset = FRAME_INDEX_HEADER.size
+    if data[offset:offset+source_len] != source.encode('utf-8'):
+        return None
+    offset += source_len
+
+    st = os.stat(path)
+    if st.st_size != input_size or st.st_mtime_ns != input_mtime:
+        return None
+
+    if len(data) != offset + (num_entries * 3 + num_enumerations * 4) * 8:
+        return None
+
+    index = FrameIndex(array('Q'), array('Q'))
+    index.entries.frombytes(data[offset:offset+num_entries*3*8])
+    index.enumerations.frombytes(data[offset+num_entries*3*8:])
+    if sys.byteorder == 'big':
+        index.entries.byteswap()
+        index.enumerations.byteswap()
+
+    return index
+
+
+def frame_index_start(index, frame):
+    """ Returns the last (frame, section offset, record offset) entry at or before frame.
+
+    Returns None if frame is before the first entry.
+
+    """
+    entries = index.entries
+    idx = bisect_right(entries[0::3], frame) - 1
+    if idx < 0:
+        return None
+
+    return tuple(entries[idx*3:idx*3+3])
+
+
+def vendor_ids_before(index, frame):
+    """ Returns {(bus, device): vendor ID} of the devices enumerated before frame. """
+    vendor_ids = {}
+    enumerations = index.enumerations
+    for idx in range(0, len(enumerations), 4):
+        enumeration_frame, bus, device, vendor_id = enumerations[idx:idx+4]
+        if enumeration_frame >= frame:
+            break
+
+        vendor_ids[bus, device] = vendor_id
+
+    return vendor_ids
+
+
+def window_frames(frames, start_frame=None, end_frame=None):
+    """ Yield the (StreamKey, frame, tx bytes, rx bytes) in frames between start_frame and end_frame (inclusive).
+
+    Frames of each stream after end_frame are yielded up to its next safe
+    point (see resync_frames), so the last commands in the window get their
+    replies.  Iteration stops once every stream has reached it, so the rest
+    of the capture is not read.
+
+    """
+    previous_rx = {}
+    ended = set()
+    for frame in frames:
+        key, frame_number, tx_data, rx_data = frame
+        if end_frame is not None and frame_number > end_frame:
+            if key in ended:
+                continue
+
+            if key not in previous_rx or (previous_rx[key] and tx_data is not None):
+                ended.add(key)
+                if ended.issuperset(previous_rx):
+                    return
+
+                continue
+
+        if start_frame is None or frame_number >= start_frame:
+            yield frame
+
+        previous_rx[key] = rx_data is not None
+
+
+def resync_frames(frames):
+    """ Drop (StreamKey, frame, tx bytes, rx bytes) frames up to a safe point to start decoding.
+
+    A window of a capture generally starts part way through a command, and
+    with replies to commands before the window still pending.  Decoding of
+    each stream starts at its first TX frame directly following an RX frame:
+    the host has read the replies to the previous flush, and starts writing a
+    new batch of commands.
+
+    """
+    previous_rx = {}
+    started = set()
+    for frame in frames:
+        key, _, tx_data, rx_data = frame
+        if key in started:
+            yield frame
+        elif previous_rx.get(key, False) and tx_data is not None:
+            started.add(key)
+            yield frame
+        else:
+            previous_rx[key] = rx_data is not None
@@ -1,5 +1,10 @@
 from enum import Enum
-from collections import namedtuple
+from collections import namedtuple, deque
+from itertools import chain
+
+# Number of FLUSHes back that decoded commands are kept as context for a
+# DecodeError, see CommandHistory.
+DECODE_HISTORY = 2
 
 
 class FtdiCommandType(Enum):
@@ -43,6 +48,18 @@ class FtdiFlags(Enum):
 
 FtdiCommand = namedtuple('FtdiCommand', 'type flags command_frame reply_frame opcode length data reply')
 
+# A decode error that decode_commands_recovering skipped over.
+#
+#  error - Description of the error.
+#  command_frame / reply_frame - Frames of the TX and RX data where the
+#                                failing command started.
+#  resume_frame - TX frame decoding resumed at, None if it did not resume.
+#  command_index - Index of the first command decoded after resuming.
+#  skipped_bytes - Number of TX bytes skipped.
+#  skipped_replies - Number of RX bytes skipped, negative if RX was rewound
+#                    to realign it with TX.
+DecodeRecovery = namedtuple('DecodeRecovery', 'error command_frame reply_frame resume_frame command_index skipped_bytes skipped_replies')
+
 
 class DecodeError(RuntimeError):
     """ Raised when a decoding error is found. """
@@ -55,6 +72,34 @@ class DecodeError(RuntimeError):
         return self.last_byte
 
 
+class CommandHistory(object):
+    """ The last decoded commands, kept as context for a DecodeError.
+
+    Commands are kept back to the last flushes FLUSH commands, so memory use
+    is bounded by the size of a few batches of commands rather than by the
+    length of the capture.  Iterating yields the kept commands in order.
+
+    """
+    def __init__(self, flushes=DECODE_HISTORY):
+        self.flushes = flushes
+        # Commands up to and including each FLUSH, then those after the
+        # last FLUSH.
+        self.segments = deque([[]])
+
+    def append(self, command):
+        self.segments[-1].append(command)
+        if command.type == FtdiCommandType.FLUSH:
+            self.segments.append([])
+            if len(self.segments) > self.flushes + 1:
+                self.segments.popleft()
+
+    def __iter__(self):
+        return chain.from_iterable(self.segments)
+
+    def __len__(self):
+        return sum(len(segment) for segment in self.segments)
+
+
 def get_write_flags(byte):
     """ Get command flags for write from command byte. Returns list of FtdiFlags. """
     flags = []
@@ -85,149 +130,388 @@ def read_data(byte, ftdi_bytes, ftdi_replies):
         number_of_bytes = ftdi_bytes.popleft()
         number_of_bytes |= ftdi_bytes.popleft() << 8
         number_of_bytes += 1
-        data = [ftdi_bytes.popleft() for _ in range(number_of_bytes)]
+        data = list(ftdi_bytes.take(number_of_bytes))
         reply = None
 
         if byte & FtdiCommandType.CLOCK_TDO.value != 0:
-            reply = [ftdi_replies.popleft() for _ in range(number_of_bytes)]
+            reply = list(ftdi_replies.take(number_of_bytes))
 
         return number_of_bytes, data, reply
 
 
-def decode_commands(ftdi_bytes, ftdi_replies):
-    """ Attempt to decode commands from ftdi_bytes, paired with replies. """
+def make_command(ftdi_bytes, ftdi_replies, command_type, command_opcode, flags=None, length=None, data=None, reply=None):
+    """ Returns FtdiCommand for a command just read from ftdi_bytes and ftdi_replies. """
+    if reply is not None:
+        reply_frame = ftdi_replies.current_frame()
+    else:
+        reply_frame = None
 
-    ftdi_commands = []
-    def add_command(command_type, command_opcode, flags=None, length=None, data=None, reply=None):
-        if length is not None:
-            #assert len(data) == length
-            #if reply is not None:
-            #    assert len(reply) == length
-            pass
+    return FtdiCommand(
+        type=command_type,
+        opcode=command_opcode,
+        command_frame=ftdi_bytes.current_frame(),
+        reply_frame=reply_frame,
+        flags=flags,
+        length=length,
+        data=data,
+        reply=reply)
 
-        if reply is not None:
-            reply_frame = ftdi_replies.current_frame()
-        else:
-            reply_frame = None
 
-        ftdi_commands.append(FtdiCommand(
-            type=command_type,
-            opcode=command_opcode,
-            command_frame=ftdi_bytes.current_frame(),
-            reply_frame=reply_frame,
-            flags=flags,
+# Decoders of the command following each opcode byte.
+#
+# Called as decode(opcode, ftdi_bytes, ftdi_replies, ftdi_commands), where
+# opcode is the FtdiOpcode, see decode_command.
+
+def decode_unknown(opcode, ftdi_bytes, ftdi_replies, ftdi_commands):
+    raise DecodeError('Unknown byte {}'.format(hex(opcode.byte)), ftdi_commands, last_byte=opcode.byte)
+
+
+def decode_tms_and_tdi(opcode, ftdi_bytes, ftdi_replies, ftdi_commands):
+    raise DecodeError('When clocking TMS, cannot clock TDI?', ftdi_commands, last_byte=opcode.byte)
+
+
+def decode_two_byte_reply(opcode, ftdi_bytes, ftdi_replies, ftdi_commands):
+    reply = list(ftdi_replies.take(2))
+    return make_command(ftdi_bytes, ftdi_replies, opcode.type, opcode.byte, reply=reply)
+
+
+def decode_no_data(opcode, ftdi_bytes, ftdi_replies, ftdi_commands):
+    return make_command(ftdi_bytes, ftdi_replies, opcode.type, opcode.byte)
+
+
+def decode_clock_data(opcode, ftdi_bytes, ftdi_replies, ftdi_commands):
+    """ CLOCK_TMS and CLOCK_TDI, which clock out data and optionally read TDO. """
+    length, data, reply = read_data(opcode.byte, ftdi_bytes, ftdi_replies)
+
+    return make_command(
+            ftdi_bytes,
+            ftdi_replies,
+            command_type=opcode.type,
+            command_opcode=opcode.byte,
+            flags=opcode.flags,
             length=length,
             data=data,
-            reply=reply))
+            reply=reply,
+            )
+
+
+def decode_clock_tdo(opcode, ftdi_bytes, ftdi_replies, ftdi_commands):
+    if opcode.bitwise:
+        length = ftdi_bytes.popleft() + 1
+
+        if length > 7:
+            raise DecodeError('Bitwise clocking should only clock 7 or less bits, found {}'.format(length), ftdi_commands, last_byte=opcode.byte)
+
+        reply = [ftdi_replies.popleft()]
+    else:
+        length = ftdi_bytes.popleft()
+        length |= ftdi_bytes.popleft() << 8
+        length += 1
+        reply = list(ftdi_replies.take(length))
+
+    return make_command(
+            ftdi_bytes,
+            ftdi_replies,
+            command_type=opcode.type,
+            command_opcode=opcode.byte,
+            flags=opcode.flags,
+            length=length,
+            reply=reply,
+            )
+
+
+def decode_clock_no_data(opcode, ftdi_bytes, ftdi_replies, ftdi_commands):
+    length = ftdi_bytes.popleft()
+    length |= ftdi_bytes.popleft() << 8
+    length += 1
+
+    return make_command(
+            ftdi_bytes,
+            ftdi_replies,
+            command_type=opcode.type,
+            command_opcode=opcode.byte,
+            flags=opcode.flags,
+            length=length,
+            )
+
+
+def decode_set_gpio(opcode, ftdi_bytes, ftdi_replies, ftdi_commands):
+    data = list(ftdi_bytes.take(2))
+    return make_command(ftdi_bytes, ftdi_replies, opcode.type, opcode.byte, data=data)
+
+
+def decode_get_gpio(opcode, ftdi_bytes, ftdi_replies, ftdi_commands):
+    reply = [ftdi_replies.popleft()]
+    return make_command(ftdi_bytes, ftdi_replies, opcode.type, opcode.byte, reply=reply)
+
+
+def decode_set_divisor(opcode, ftdi_bytes, ftdi_replies, ftdi_commands):
+    data = ftdi_bytes.popleft()
+    data |= ftdi_bytes.popleft() << 8
+    return make_command(ftdi_bytes, ftdi_replies, opcode.type, opcode.byte, data=[data])
+
+
+def decode_flush(opcode, ftdi_bytes, ftdi_replies, ftdi_commands):
+    if not ftdi_replies.at_boundry():
+        raise DecodeError('Should have a RX boundry in reply data?',
+                ftdi_commands, last_byte=opcode.byte)
+
+    return make_command(ftdi_bytes, ftdi_replies, opcode.type, opcode.byte)
+
+
+# Everything known about an opcode byte before decoding its command.
+#
+#  byte - The opcode byte.
+#  decode - Decoder of the command, see decode_unknown.
+#  type - FtdiCommandType of the command.
+#  flags - Tuple of FtdiFlags of clocking commands, else None.
+#  bitwise - Length is in bits (FtdiFlags.BITWISE).
+#  reading - The command clocks in TDO (FtdiCommandType.CLOCK_TDO bit).
+FtdiOpcode = namedtuple('FtdiOpcode', 'byte decode type flags bitwise reading')
+
+
+def make_opcode(byte):
+    """ Returns the FtdiOpcode of byte. """
+    bitwise = byte & FtdiFlags.BITWISE.value != 0
+    reading = byte & FtdiCommandType.CLOCK_TDO.value != 0
+    flags = tuple(get_write_flags(byte))
+
+    def opcode(decode, command_type, flags=None):
+        return FtdiOpcode(byte, decode, command_type, flags, bitwise, reading)
+
+    # Order matters, e.g. 0xaa and DISABLE_RCLK have clocking bits set.
+    if byte in (0xaa, 0xab):
+        return opcode(decode_two_byte_reply, FtdiCommandType.UNKNOWN)
+    elif byte == FtdiCommandType.DISABLE_RCLK.value:
+        return opcode(decode_no_data, FtdiCommandType.DISABLE_RCLK)
+    elif byte & FtdiCommandType.CLOCK_TMS.value != 0:
+        if byte & FtdiCommandType.CLOCK_TDI.value != 0:
+            return opcode(decode_tms_and_tdi, FtdiCommandType.UNKNOWN)
+
+        return opcode(decode_clock_data, FtdiCommandType.CLOCK_TMS, flags)
+    elif byte & FtdiCommandType.CLOCK_TDI.value != 0:
+        return opcode(decode_clock_data, FtdiCommandType.CLOCK_TDI, flags)
+    elif byte & FtdiCommandType.CLOCK_TDO.value != 0:
+        return opcode(decode_clock_tdo, FtdiCommandType.CLOCK_TDO, flags)
+    elif byte == FtdiCommandType.CLOCK_NO_DATA.value:
+        return opcode(decode_clock_no_data, FtdiCommandType.CLOCK_NO_DATA, ())
+    elif byte in (FtdiCommandType.SET_GPIO_LOW_BYTE.value, FtdiCommandType.SET_GPIO_HIGH_BYTE.value):
+        return opcode(decode_set_gpio, FtdiCommandType(byte))
+    elif byte in (FtdiCommandType.GET_GPIO_LOW_BYTE.value, FtdiCommandType.GET_GPIO_HIGH_BYTE.value):
+        return opcode(decode_get_gpio, FtdiCommandType(byte))
+    elif byte in (FtdiCommandType.DISABLE_LOOPBACK.value, FtdiCommandType.DISABLE_DIV_BY_5.value):
+        return opcode(decode_no_data, FtdiCommandType(byte))
+    elif byte == FtdiCommandType.SET_DIVISOR.value:
+        return opcode(decode_set_divisor, FtdiCommandType.SET_DIVISOR)
+    elif byte == FtdiCommandType.FLUSH.value:
+        return opcode(decode_flush, FtdiCommandType.FLUSH)
+    else:
+        return opcode(decode_unknown, FtdiCommandType.UNKNOWN)
+
+
+# FtdiOpcode of every opcode byte.
+FTDI_OPCODES = tuple(make_opcode(byte) for byte in range(256))
+
+
+def decode_command(ftdi_bytes, ftdi_replies, ftdi_commands):
+    """ Decode one command from ftdi_bytes, paired with replies.
+
+    ftdi_commands are the commands decoded so far, and are attached to any
+    DecodeError raised as context.  Raises IndexError if ftdi_bytes or
+    ftdi_replies run out of data part way through the command.
+
+    """
+    opcode = FTDI_OPCODES[ftdi_bytes.popleft()]
+    return opcode.decode(opcode, ftdi_bytes, ftdi_replies, ftdi_commands)
 
+
+def iter_commands(ftdi_bytes, ftdi_replies, history=DECODE_HISTORY):
+    """ Yield each command decoded from ftdi_bytes, paired with replies.
+
+    Only the commands back to the last history FLUSHes are kept, as context
+    for a DecodeError.
+
+    """
+    ftdi_commands = CommandHistory(history)
     while len(ftdi_bytes):
-        byte = ftdi_bytes.popleft()
-
-        if byte == 0xaa:
-            reply = [ftdi_replies.popleft() for _ in range(2)]
-            add_command(FtdiCommandType.UNKNOWN, byte, reply=reply)
-        elif byte == 0xab:
-            reply = [ftdi_replies.popleft() for _ in range(2)]
-            add_command(FtdiCommandType.UNKNOWN, byte, reply=reply)
-        elif byte == FtdiCommandType.DISABLE_RCLK.value:
-            add_command(FtdiCommandType.DISABLE_RCLK, byte)
-        elif byte & FtdiCommandType.CLOCK_TMS.value != 0:
-            if byte & FtdiCommandType.CLOCK_TDI.value != 0:
-                raise DecodeError('When clocking TMS, cannot clock TDI?', ftdi_commands, last_byte=byte)
-
-            flags = get_write_flags(byte)
-            length, data, reply = read_data(byte, ftdi_bytes, ftdi_replies)
-            add_command(
-                    command_type=FtdiCommandType.CLOCK_TMS,
-                    command_opcode=byte,
-                    flags=flags,
-                    length=length,
-                    data=data,
-                    reply=reply,
-                    )
-        elif byte & FtdiCommandType.CLOCK_TDI.value != 0:
-            if byte & FtdiCommandType.CLOCK_TMS.value != 0:
-                raise DecodeError('When clocking TDI, cannot clock TMS?', ftdi_commands, last_byte=byte)
-
-            flags = get_write_flags(byte)
-            length, data, reply = read_data(byte, ftdi_bytes, ftdi_replies)
-            add_command(
-                    command_type=FtdiCommandType.CLOCK_TDI,
-                    command_opcode=byte,
-                    flags=flags,
-                    length=length,
-                    data=data,
-                    reply=reply,
-                    )
-        elif byte & FtdiCommandType.CLOCK_TDO.value != 0:
-            # These shouldn't been detected in the previous elif blocks
-            assert byte & FtdiCommandType.CLOCK_TMS.value == 0, hex(byte)
-            assert byte & FtdiCommandType.CLOCK_TDI.value == 0, hex(byte)
-
-            flags = get_write_flags(byte)
-            length = 0
-            if byte & FtdiFlags.BITWISE.value != 0:
-                length = ftdi_bytes.popleft() + 1
-
-                if length > 7:
-                    raise DecodeError('Bitwise clocking should only clock 7 or less bits, found {}'.format(length), ftdi_commands, last_byte=byte)
-
-                reply = [ftdi_replies.popleft()]
+        command = decode_command(ftdi_bytes, ftdi_replies, ftdi_commands)
+        ftdi_commands.append(command)
+        yield command
+
+    if len(ftdi_replies) != 0:
+        raise DecodeError('Leftover RX data, leftover = {}.'.format(len(ftdi_replies)), ftdi_commands)
+
+
+def decode_commands(ftdi_bytes, ftdi_replies):
+    """ Attempt to decode commands from ftdi_bytes, paired with replies. """
+    return list(iter_commands(ftdi_bytes, ftdi_replies))
+
+
+def find_resync_point(ftdi_bytes, ftdi_replies, tx_index):
+    """ Returns (TX frame, TX index, RX index) of the first safe point to resume decoding after tx_index.
+
+    A safe point is the start of a TX frame that directly follows an RX
+    frame: the host has read the replies to the previous flush, and starts
+    writing a new batch of commands.  Replies are resumed at the first RX
+    frame after that TX frame.  Returns None if there is no such point.
+
+    """
+    previous = ftdi_bytes.frame_of(tx_index) or 0
+    for frame, begin in ftdi_bytes.frames_after(tx_index):
+        reply = ftdi_replies.first_frame_after(previous)
+        if reply is not None and reply[0] < frame:
+            reply = ftdi_replies.first_frame_after(frame)
+            if reply is not None:
+                return frame, begin, reply[1]
             else:
-                length = ftdi_bytes.popleft()
-                length |= ftdi_bytes.popleft() << 8
-                length += 1
-                reply = [ftdi_replies.popleft() for _ in range(length)]
-
-            add_command(
-                    command_type=FtdiCommandType.CLOCK_TDO,
-                    command_opcode=byte,
-                    flags=flags,
-                    length=length,
-                    reply=reply,
-                    )
-        elif byte == FtdiCommandType.CLOCK_NO_DATA.value:
-            flags = []
-            length = ftdi_bytes.popleft()
-            length |= ftdi_bytes.popleft() << 8
-            length += 1
-
-            add_command(
-                    command_type=FtdiCommandType.CLOCK_NO_DATA,
-                    command_opcode=byte,
-                    flags=flags,
-                    length=length,
-                    )
-        elif byte == FtdiCommandType.SET_GPIO_LOW_BYTE.value:
-            data = [ftdi_bytes.popleft() for _ in range(2)]
-            add_command(FtdiCommandType.SET_GPIO_LOW_BYTE, byte, data=data)
-        elif byte == FtdiCommandType.GET_GPIO_LOW_BYTE.value:
-            reply = [ftdi_replies.popleft()]
-            add_command(FtdiCommandType.GET_GPIO_LOW_BYTE, byte, reply=reply)
-        elif byte == FtdiCommandType.SET_GPIO_HIGH_BYTE.value:
-            data = [ftdi_bytes.popleft() for _ in range(2)]
-            add_command(FtdiCommandType.SET_GPIO_HIGH_BYTE, byte, data=data)
-        elif byte == FtdiCommandType.GET_GPIO_HIGH_BYTE.value:
-            reply = [ftdi_replies.popleft()]
-            add_command(FtdiCommandType.GET_GPIO_HIGH_BYTE, byte, reply=reply)
-        elif byte == FtdiCommandType.DISABLE_LOOPBACK.value:
-            add_command(FtdiCommandType.DISABLE_LOOPBACK, byte)
-        elif byte == FtdiCommandType.SET_DIVISOR.value:
-            data = ftdi_bytes.popleft()
-            data |= ftdi_bytes.popleft() << 8
-            add_command(FtdiCommandType.SET_DIVISOR, byte, data=[data])
-        elif byte == FtdiCommandType.FLUSH.value:
-            if not ftdi_replies.at_boundry():
-                raise DecodeError('Should have a RX boundry in reply data?',
-                        ftdi_commands, last_byte=byte)
-
-            add_command(FtdiCommandType.FLUSH, byte)
-        elif byte == FtdiCommandType.DISABLE_DIV_BY_5.value:
-            add_command(FtdiCommandType.DISABLE_DIV_BY_5, byte)
+                return frame, begin, ftdi_replies.tell() + len(ftdi_replies)
+
+        previous = frame
+
+
+def iter_commands_recovering(ftdi_bytes, ftdi_replies, recoveries, history=DECODE_HISTORY):
+    """ Yield each command decoded from ftdi_bytes, skipping over decode errors.
+
+    Instead of raising DecodeError, decoding resumes at the next safe point
+    (see find_resync_point).  Running out of TX or RX data part way through
+    a command is treated the same way, as it happens when frames are missing
+    from the capture.  A DecodeRecovery is appended to recoveries for each
+    error, before the first command after it is yielded.
+
+    """
+    ftdi_commands = CommandHistory(history)
+    count = 0
+    while len(ftdi_bytes):
+        tx_index = ftdi_bytes.tell()
+        rx_index = ftdi_replies.tell()
+        try:
+            command = decode_command(ftdi_bytes, ftdi_replies, ftdi_commands)
+            ftdi_commands.append(command)
+            count += 1
+            yield command
+            continue
+        except DecodeError as e:
+            error = str(e)
+        except IndexError:
+            error = 'Ran out of data part way through a command'
+
+        command_frame = ftdi_bytes.frame_of(tx_index)
+        reply_frame = ftdi_replies.frame_of(rx_index)
+
+        point = find_resync_point(ftdi_bytes, ftdi_replies, tx_index)
+        if point is None:
+            resume_frame = None
+            resume_tx = ftdi_bytes.tell() + len(ftdi_bytes)
+            resume_rx = ftdi_replies.tell() + len(ftdi_replies)
         else:
-            raise DecodeError('Unknown byte {}'.format(hex(byte)), ftdi_commands, last_byte=byte)
+            resume_frame, resume_tx, resume_rx = point
+
+        ftdi_bytes.seek(resume_tx)
+        ftdi_replies.seek(resume_rx)
+
+        recoveries.append(DecodeRecovery(
+            error=error,
+            command_frame=command_frame,
+            reply_frame=reply_frame,
+            resume_frame=resume_frame,
+            command_index=count,
+            skipped_bytes=resume_tx - tx_index,
+            skipped_replies=resume_rx - rx_index))
 
     if len(ftdi_replies) != 0:
-        raise DecodeError('Leftover RX data, leftover = {}.'.format(len(ftdi_replies)), ftdi_commands)
+        recoveries.append(DecodeRecovery(
+            error='Leftover RX data, leftover = {}.'.format(len(ftdi_replies)),
+            command_frame=None,
+            reply_frame=ftdi_replies.frame_of(ftdi_replies.tell()),
+            resume_frame=None,
+            command_index=count,
+            skipped_bytes=0,
+            skipped_replies=len(ftdi_replies)))
+
+
+def decode_commands_recovering(ftdi_bytes, ftdi_replies):
+    """ Decode commands from ftdi_bytes, skipping over decode errors.
+
+    Returns (commands, [DecodeRecovery]), see iter_commands_recovering.
+
+    """
+    recoveries = []
+    ftdi_commands = list(iter_commands_recovering(ftdi_bytes, ftdi_replies, recoveries))
+    return ftdi_commands, recoveries
+
 
-    return ftdi_commands
+def print_recoveries(recoveries):
+    """ Print the decode errors skipped by decode_commands_recovering. """
+    if not recoveries:
+        return
+
+    print('Recovered from {} decode errors:'.format(len(recoveries)))
+    for recovery in recoveries:
+        if recovery.resume_frame is not None:
+            resumed = 'resumed at frame {}'.format(recovery.resume_frame)
+        else:
+            resumed = 'not resumed'
+
+        print('  TX frame {} RX frame {}: {} ({} TX bytes skipped, RX moved {:+d} bytes, {})'.format(
+            recovery.command_frame,
+            recovery.reply_frame,
+            recovery.error,
+            recovery.skipped_bytes,
+            recovery.skipped_replies,
+            resumed))
+
+
+def decode_available_commands(ftdi_bytes, ftdi_replies, ftdi_commands):
+    """ Yield the commands that can be decoded from the data received so far.
+
+    Used when data is added to the buffers as it arrives.  If the bytes or
+    replies of a command have not all arrived yet, both buffers are rewound
+    to the start of that command, and decoding resumes from it on the next
+    call.
+
+    """
+    while len(ftdi_bytes):
+        tx_index = ftdi_bytes.tell()
+        rx_index = ftdi_replies.tell()
+        try:
+            command = decode_command(ftdi_bytes, ftdi_replies, ftdi_commands)
+        except IndexError:
+            ftdi_bytes.seek(tx_index)
+            ftdi_replies.seek(rx_index)
+            return
+
+        yield command
+
+
+def print_decode_error(e, ftdi_bytes, ftdi_replies, C=50):
+    """ Print context for a DecodeError raised while decoding ftdi_bytes. """
+    if e.get_last_byte() is not None:
+        print('Failed decode at:', hex(e.get_last_byte()))
+    else:
+        print('Failed decode:', e)
+    print('Next TX frame', ftdi_bytes.current_frame())
+    print('Next RX frame', ftdi_replies.current_frame())
+    print('Context:')
+    for offset, context_bytes in ftdi_bytes.get_context(C=C):
+        print(offset+1, hex(context_bytes))
+
+    # Find previous two flushes to get sufficient context.  The error may be
+    # before the first command, e.g. at the start of a window or when
+    # following a capture.
+    commands = list(e.commands) if e.commands is not None else []
+    if commands:
+        flush_count = 0
+        for idx, cmd in enumerate(commands[::-1]):
+            if cmd.type == FtdiCommandType.FLUSH:
+                flush_count += 1
+                if flush_count == 2:
+                    break
+
+        idx += 1
+
+        if flush_count == 2:
+            print('Last {} commands (2 flushes backward):'.format(idx))
+        else:
+            print('Last {} commands ({} flushes backward, all commands kept):'.format(idx, flush_count))
+        for cmd in commands[-idx:]:
+            print(cmd)
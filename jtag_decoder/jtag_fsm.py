@@ -1,4 +1,7 @@
+from collections import namedtuple
 from enum import Enum
+from .jtag_models import shift_dr_bits, shift_ir_bits
+from .utils import int_to_bits, bits_to_int
 
 class JtagState(Enum):
   """ Set of JTAG states. """
@@ -60,8 +63,76 @@ JTAG_STATE_TABLE = {
         }
 
 
+# jtag_model method called on each clock in a state, see JtagFsm.
+STATE_HOOKS = {
+        JtagState.RESET: 'reset',
+        JtagState.RUN_IDLE: 'run_idle',
+        JtagState.DRSHIFT: 'shift_dr',
+        JtagState.DRUPDATE: 'update_dr',
+        JtagState.DRCAPTURE: 'capture_dr',
+        JtagState.IRSHIFT: 'shift_ir',
+        JtagState.IRUPDATE: 'update_ir',
+        JtagState.IRCAPTURE: 'capture_ir',
+        }
+
+# Hooks taking TDI and returning TDO, and their bulk versions, see
+# jtag_models.shift_dr_bits.
+SHIFT_HOOKS = {
+        'shift_dr': ('shift_dr_bits', shift_dr_bits),
+        'shift_ir': ('shift_ir_bits', shift_ir_bits),
+        }
+
+# JtagFsm keeps the state as the JtagState value, a small int.  These map
+# values back to JtagStates, and (value * 2 + TMS) to the next value.
+STATE_COUNT = max(state.value for state in JtagState) + 1
+JTAG_STATES = [None] * STATE_COUNT
+NEXT_STATE = [None] * (STATE_COUNT * 2)
+for (_state, _tms), _next_state in JTAG_STATE_TABLE.items():
+    JTAG_STATES[_state.value] = _state
+    NEXT_STATE[_state.value * 2 + _tms] = _next_state.value
+
+DRSHIFT = JtagState.DRSHIFT.value
+IRSHIFT = JtagState.IRSHIFT.value
+
+# Most TMS bits clocked by one MPSSE CLOCK_TMS command.
+MAX_TMS_PATH_LENGTH = 7
+
+# Effect of clocking a sequence of TMS bits from a state, as JtagState
+# values.
+#
+#  state - State after the last clock.
+#  states - State at each clock.
+#  events - (clock index, state) of each clock that calls a jtag_model
+#           hook, in order.
+TmsPath = namedtuple('TmsPath', 'state states events')
+
+
+def make_tms_path(state, tms, length):
+    """ Returns the TmsPath of clocking the length bits of tms, LSB first, from state. """
+    states = []
+    events = []
+    for clock in range(length):
+        states.append(state)
+        if JTAG_STATES[state] in STATE_HOOKS:
+            events.append((clock, state))
+
+        state = NEXT_STATE[state * 2 + ((tms >> clock) & 1)]
+
+    return TmsPath(state, tuple(states), tuple(events))
+
+
+# TmsPath of every TMS sequence a CLOCK_TMS command can clock, indexed by
+# [state][length][TMS bits].  OpenOCD reuses a handful of TMS sequences,
+# like Run-Test/Idle to DRSHIFT, millions of times.
+TMS_PATHS = [
+        None if JTAG_STATES[state] is None else
+        [None] + [[make_tms_path(state, tms, length) for tms in range(1 << length)]
+            for length in range(1, MAX_TMS_PATH_LENGTH + 1)]
+        for state in range(STATE_COUNT)]
+
+
 class JtagFsm(object):
-    def __init__(self, jtag_model, print_transitions=False, print_dr_shift=False, print_ir_shift=False):
+    def __init__(self, jtag_model):
         """ JTAG finite state machine.
 
         Simulates a JTAG chain bit by bit when method clock is invoked.
@@ -80,22 +151,41 @@ class JtagFsm(object):
          - jtag_model.update_ir() when JtagState.IRSHIFT is entered
          - jtag_model.capture_ir() when JtagState.IRCAPTURE is entered
 
-        Optional debug prints can be enabled with:
-         print_transitions - Print all state transitions, except for DRSHIFT
-                             and IRSHIFT.
-         print_dr_shift - Print DRSHIFT state transitions (if print_transitions
-                          is set)
-         print_ir_shift - Print IRSHIFT state transitions (if print_transitions
-                          is set)
+        clock_tms clocks up to 7 TMS bits at once, making the same calls to
+        jtag_model from a precomputed TmsPath.
+
+        shift_bits shifts many bits in DRSHIFT or IRSHIFT with one call to
+        jtag_model.shift_dr_bits(value, length) or
+        jtag_model.shift_ir_bits(value, length) instead, if the model has
+        them, see jtag_models.shift_dr_bits.
+
+        The state is kept as a JtagState value, and the hooks are looked up
+        in per state tables of bound methods.  Use TracingJtagFsm to print
+        the transitions.
 
         """
-        self.state = JtagState.RESET
+        self.state_value = JtagState.RESET.value
         self.jtag_model = jtag_model
         self.last_tdo = 1
         self.pins_locked = True
-        self.print_transitions = print_transitions
-        self.print_dr_shift = print_dr_shift
-        self.print_ir_shift = print_ir_shift
+
+        # Per state value, the shift hook or the hook without arguments, and
+        # the bulk shift hook.
+        self.shift_hooks = [None] * STATE_COUNT
+        self.state_hooks = [None] * STATE_COUNT
+        self.bulk_shift_hooks = [None] * STATE_COUNT
+        for state, hook in STATE_HOOKS.items():
+            if hook in SHIFT_HOOKS:
+                bulk_hook, bulk_fallback = SHIFT_HOOKS[hook]
+                self.shift_hooks[state.value] = getattr(jtag_model, hook)
+                self.bulk_shift_hooks[state.value] = getattr(jtag_model, bulk_hook, None) or (
+                        lambda value, length, bulk_fallback=bulk_fallback: bulk_fallback(jtag_model, value, length))
+            else:
+                self.state_hooks[state.value] = getattr(jtag_model, hook)
+
+    @property
+    def state(self):
+        return JTAG_STATES[self.state_value]
 
     def get_state(self):
         return self.state
@@ -106,34 +196,124 @@ class JtagFsm(object):
     def unlock(self):
         self.pins_locked = False
 
+    def assume_state(self, state):
+        """ Continue the simulation from state, with the pins already driven.
+
+        Used when decoding starts part way through a capture, where the
+        state of the chain is not in the capture.
+
+        """
+        self.state_value = state.value
+        self.unlock()
+
     def clock(self, tdi, tms):
         assert not self.pins_locked
-        next_state = JTAG_STATE_TABLE[self.state, tms]
-        if self.print_transitions:
-            if self.state == JtagState.DRSHIFT and self.print_dr_shift:
-                print(self.state, tdi)
-            elif self.state == JtagState.DRSHIFT and self.print_ir_shift:
-                print(self.state, tdi)
-            else:
-                print(self.state, tdi)
-
-        if self.state == JtagState.RESET:
-            self.jtag_model.reset()
-        elif self.state == JtagState.RUN_IDLE:
-            self.jtag_model.run_idle()
-        elif self.state == JtagState.DRSHIFT:
-            self.last_tdo = self.jtag_model.shift_dr(tdi)
-        elif self.state == JtagState.DRUPDATE:
-            self.jtag_model.update_dr()
-        elif self.state == JtagState.DRCAPTURE:
-            self.jtag_model.capture_dr()
-        elif self.state == JtagState.IRSHIFT:
-            self.last_tdo = self.jtag_model.shift_ir(tdi)
-        elif self.state == JtagState.IRUPDATE:
-            self.jtag_model.update_ir()
-        elif self.state == JtagState.IRCAPTURE:
-            self.jtag_model.capture_ir()
-
-        self.state = next_state
+        state = self.state_value
+        shift = self.shift_hooks[state]
+        if shift is not None:
+            self.last_tdo = shift(tdi)
+        else:
+            hook = self.state_hooks[state]
+            if hook is not None:
+                hook()
 
+        self.state_value = NEXT_STATE[state * 2 + tms]
         return self.last_tdo
+
+    def clock_bits(self, tdi, tms, length):
+        """ Call clock for each of the length bits of tdi and tms (ints, LSB first).
+
+        Returns the TDO bits as an int.
+
+        """
+        return bits_to_int([self.clock(tdi=tdi_bit, tms=tms_bit)
+            for tdi_bit, tms_bit in zip(int_to_bits(tdi, length), int_to_bits(tms, length))])
+
+    def shift_bits(self, tdi, length):
+        """ Clock the length bits of tdi (an int, LSB first) with TMS low.
+
+        Returns the TDO bits as an int.  The same as calling clock for each
+        bit, but in DRSHIFT and IRSHIFT the bits are shifted through the
+        model in one call.
+
+        """
+        assert not self.pins_locked
+        state = self.state_value
+        if state != DRSHIFT and state != IRSHIFT:
+            return self.clock_bits(tdi, 0, length)
+
+        tdo = self.bulk_shift_hooks[state](tdi, length)
+        if length:
+            self.last_tdo = (tdo >> (length - 1)) & 1
+
+        return tdo
+
+    def clock_tms(self, tms, length, tdi):
+        """ Clock the length bits of tms (LSB first, up to 7) with TDI held at tdi.
+
+        Returns the TDO bits as an int.  The same as calling clock for each
+        bit, using the precomputed TmsPath of the bits.
+
+        """
+        assert not self.pins_locked
+        path = TMS_PATHS[self.state_value][length][tms & ((1 << length) - 1)]
+        shift_hooks = self.shift_hooks
+        state_hooks = self.state_hooks
+
+        # The TDO of each clock is last_tdo, which only changes on shifts.
+        tdo = 0
+        last_tdo = self.last_tdo
+        done = 0
+        for clock, state in path.events:
+            shift = shift_hooks[state]
+            if shift is not None:
+                if last_tdo:
+                    tdo |= (1 << clock) - (1 << done)
+                last_tdo = shift(tdi)
+                done = clock
+            else:
+                state_hooks[state]()
+
+        if last_tdo:
+            tdo |= (1 << length) - (1 << done)
+
+        self.last_tdo = last_tdo
+        self.state_value = path.state
+        return tdo
+
+
+class TracingJtagFsm(JtagFsm):
+    def __init__(self, jtag_model, print_dr_shift=False, print_ir_shift=False):
+        """ JtagFsm printing the state and TDI of every clock.
+
+        Clocks in DRSHIFT and IRSHIFT are only printed if print_dr_shift
+        and print_ir_shift are set.  Every bit goes through clock, so bulk
+        shifts and TMS paths are printed bit by bit.
+
+        """
+        JtagFsm.__init__(self, jtag_model)
+        self.print_dr_shift = print_dr_shift
+        self.print_ir_shift = print_ir_shift
+
+    def clock(self, tdi, tms):
+        state = self.state_value
+        if (state != DRSHIFT or self.print_dr_shift) and (state != IRSHIFT or self.print_ir_shift):
+            print(self.state, tdi)
+
+        return JtagFsm.clock(self, tdi, tms)
+
+    def shift_bits(self, tdi, length):
+        assert not self.pins_locked
+        return self.clock_bits(tdi, 0, length)
+
+    def clock_tms(self, tms, length, tdi):
+        assert not self.pins_locked
+        return self.clock_bits((1 << length) - 1 if tdi else 0, tms, length)
+
+
+def make_jtag_fsm(jtag_model, print_transitions=False, print_dr_shift=False, print_ir_shift=False):
+    """ Returns a JtagFsm, or a TracingJtagFsm if print_transitions is set. """
+    if print_transitions:
+        return TracingJtagFsm(jtag_model, print_dr_shift=print_dr_shift, print_ir_shift=print_ir_shift)
+    else:
+        return JtagFsm(jtag_model)
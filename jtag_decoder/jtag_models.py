@@ -1,3 +1,27 @@
+from .utils import int_to_bits, bits_to_int
+
+
+def shift_dr_bits(model, value, length):
+    """ Shift the length bits of value, LSB first, through the DR of model.
+
+    Returns the TDO bits as an int.  Uses model.shift_dr_bits if the model
+    has it, otherwise model.shift_dr is called for each bit.
+
+    """
+    if hasattr(model, 'shift_dr_bits'):
+        return model.shift_dr_bits(value, length)
+
+    return bits_to_int([model.shift_dr(tdi) for tdi in int_to_bits(value, length)])
+
+
+def shift_ir_bits(model, value, length):
+    """ Shift the length bits of value, LSB first, through the IR of model, see shift_dr_bits. """
+    if hasattr(model, 'shift_ir_bits'):
+        return model.shift_ir_bits(value, length)
+
+    return bits_to_int([model.shift_ir(tdi) for tdi in int_to_bits(value, length)])
+
+
 class JtagChain(object):
     """ Models a chain of JTAG models. """
     def __init__(self, models):
@@ -20,6 +44,20 @@ class JtagChain(object):
 
         return tdo
 
+    def shift_dr_bits(self, value, length):
+        # Each model shifts all of the bits in turn, which is the same as
+        # shifting them through the chain one at a time.
+        for model in self.models:
+            value = shift_dr_bits(model, value, length)
+
+        return value
+
+    def shift_ir_bits(self, value, length):
+        for model in self.models:
+            value = shift_ir_bits(model, value, length)
+
+        return value
+
     def update_dr(self):
         """ DR update state has been entered. """
         for model in self.models:
@@ -50,3 +88,38 @@ class JtagChain(object):
         for model in self.models:
             model.run_idle()
 
+
+class DummyJtagModel(object):
+    """ JTAG model that ignores all transitions, TDO is always 1. """
+    def __init__(self):
+        pass
+
+    def shift_dr(self, tdi):
+        return 1
+
+    def shift_ir(self, tdi):
+        return 1
+
+    def shift_dr_bits(self, value, length):
+        return (1 << length) - 1
+
+    def shift_ir_bits(self, value, length):
+        return (1 << length) - 1
+
+    def update_dr(self):
+        pass
+
+    def update_ir(self):
+        pass
+
+    def capture_dr(self):
+        pass
+
+    def capture_ir(self):
+        pass
+
+    def reset(self):
+        pass
+
+    def run_idle(self):
+        pass
@@ -1,103 +1,142 @@
-from .ftdi_decoder import FtdiCommandType, FtdiFlags
+from collections import namedtuple
+from .ftdi_decoder import FtdiCommandType, FtdiFlags, FTDI_OPCODES
 from .jtag_fsm import JtagState
-from .utils import bits_to_bytes
 
 TCK = 0
 TDI = 1
 TDO = 2
 TMS = 3
 
-def run_ftdi_command(command, jtag_fsm):
-    output = []
 
-    if command.type == FtdiCommandType.CLOCK_TMS:
-        assert FtdiFlags.LSB_FIRST in command.flags
-        assert FtdiFlags.NEG_EDGE_OUT in command.flags
-        assert FtdiFlags.BITWISE in command.flags
+# Simulation of the commands of each opcode byte, see run_ftdi_command.
+#
+#  run - Called as run(command, jtag_fsm, sim_opcode), returns the reply.
+#  reading - The command clocks in TDO.
+#  bitwise - Length is in bits.
+#  tdi - TDI level for commands that do not clock out data.
+SimOpcode = namedtuple('SimOpcode', 'run reading bitwise tdi')
+
+
+def sim_clock_tms(command, jtag_fsm, sim):
+    assert command.length <= 7
+
+    data = command.data[0]
+    tdi = 1 if data & 0x80 != 0 else 0
+    tdo = jtag_fsm.clock_tms(data & 0x7f, command.length, tdi)
+    if sim.reading:
+        return (tdo,)
+    else:
+        return ()
 
-        reading = (command.opcode & FtdiCommandType.CLOCK_TDO.value != 0)
-        if reading:
-            assert FtdiFlags.NEG_EDGE_IN in command.flags
 
+def clock_bits(jtag_fsm, sim, tdi, length):
+    """ Clock length TDI bits with TMS low, returns the reply if the command reads TDO. """
+    tdo = jtag_fsm.shift_bits(tdi, length)
+    if sim.reading:
+        return tuple(tdo.to_bytes((length + 7) // 8, 'little'))
+    else:
+        return ()
+
+
+def sim_clock_tdi(command, jtag_fsm, sim):
+    # TMS is always low when clocking data?
+    if sim.bitwise:
         assert command.length <= 7
-        tdi = 1 if command.data[0] & 0x80 != 0 else 0
-        for bit in range(command.length):
-            tms = 1 if (command.data[0] & (1 << bit)) != 0 else 0
-            tdo = jtag_fsm.clock(tdi=tdi, tms=tms)
-            if reading:
-                output.append(tdo)
-    elif command.type == FtdiCommandType.CLOCK_TDI:
-        assert FtdiFlags.LSB_FIRST in command.flags
-        assert FtdiFlags.NEG_EDGE_OUT in command.flags
-
-        reading = (command.opcode & FtdiCommandType.CLOCK_TDO.value != 0)
-        if reading:
-            assert FtdiFlags.NEG_EDGE_IN in command.flags
-
-        # TMS is always low when clocking data?
-        tms = 0
-
-        if FtdiFlags.BITWISE in command.flags:
-            assert command.length <= 7
-
-            for bit in range(command.length):
-                tdi = 1 if (command.data[0] & (1 << bit)) != 0 else 0
-                tdo = jtag_fsm.clock(tdi=tdi, tms=tms)
-
-                if reading:
-                    output.append(tdo)
-        else:
-            for byte in command.data:
-                for bit in range(8):
-                    tdi = 1 if (byte & (1 << bit)) != 0 else 0
-                    tdo = jtag_fsm.clock(tdi=tdi, tms=tms)
-
-                    if reading:
-                        output.append(tdo)
-    elif command.type == FtdiCommandType.CLOCK_TDO:
-        assert FtdiFlags.LSB_FIRST in command.flags
-        assert FtdiFlags.NEG_EDGE_IN in command.flags
 
-        # TDI is 1 when clocking TDO?
-        tdi = 1
+        length = command.length
+        tdi = command.data[0] & ((1 << length) - 1)
+    else:
+        # Whole payload at once, so a scan in DRSHIFT or IRSHIFT is a single
+        # call into the JTAG model, see JtagFsm.shift_bits.
+        length = len(command.data) * 8
+        tdi = int.from_bytes(bytes(command.data), 'little')
+
+    return clock_bits(jtag_fsm, sim, tdi, length)
+
+
+def sim_clock_tdo(command, jtag_fsm, sim):
+    # TMS is always low when clocking data?
+    if sim.bitwise:
+        assert command.length <= 7
+        length = command.length
+    else:
+        length = command.length * 8
+
+    tdi = (1 << length) - 1 if sim.tdi else 0
+    return clock_bits(jtag_fsm, sim, tdi, length)
+
 
-        # TMS is always low when clocking data?
-        tms = 0
+def sim_set_gpio_low_byte(command, jtag_fsm, sim):
+    data, direction = command.data
 
-        if FtdiFlags.BITWISE in command.flags:
-            assert command.length <= 7
+    # Inputs
+    if direction == 0:
+        assert jtag_fsm.get_state() in [JtagState.RUN_IDLE, JtagState.RESET]
+        jtag_fsm.lock()
+        return
 
-            for bit in range(command.length):
-                tdo = jtag_fsm.clock(tdi=tdi, tms=tms)
-                output.append(tdo)
-        else:
-            for _ in range(command.length):
-                for _ in range(8):
-                    tdo = jtag_fsm.clock(tdi=tdi, tms=tms)
-                    output.append(tdo)
+    assert (direction & (1 << TCK)) != 0, (hex(data), hex(direction))
+    assert (direction & (1 << TDI)) != 0, (hex(data), hex(direction))
+    assert (direction & (1 << TMS)) != 0, (hex(data), hex(direction))
 
-    elif command.type == FtdiCommandType.SET_GPIO_LOW_BYTE:
-        data, direction = command.data
+    # Outputs
+    assert (direction & (1 << TDO)) == 0, (hex(data), hex(direction))
 
-        # Inputs
-        if direction == 0:
-            assert jtag_fsm.get_state() in [JtagState.RUN_IDLE, JtagState.RESET]
-            jtag_fsm.lock()
-            return
+    assert (data & (1 << TCK)) == 0, (hex(data), hex(direction))
+    assert (data & (1 << TDI)) == 0, (hex(data), hex(direction))
+    assert (data & (1 << TMS)) != 0, (hex(data), hex(direction))
+    jtag_fsm.unlock()
 
-        assert (direction & (1 << TCK)) != 0, (hex(data), hex(direction))
-        assert (direction & (1 << TDI)) != 0, (hex(data), hex(direction))
-        assert (direction & (1 << TMS)) != 0, (hex(data), hex(direction))
+    return ()
 
-        # Outputs
-        assert (direction & (1 << TDO)) == 0, (hex(data), hex(direction))
 
-        assert (data & (1 << TCK)) == 0, (hex(data), hex(direction))
-        assert (data & (1 << TDI)) == 0, (hex(data), hex(direction))
-        assert (data & (1 << TMS)) != 0, (hex(data), hex(direction))
-        jtag_fsm.unlock()
-    elif command.type == FtdiCommandType.CLOCK_NO_DATA:
-        pass
+def sim_no_reply(command, jtag_fsm, sim):
+    return ()
 
-    return tuple(bits_to_bytes(output))
 
+def sim_unsupported(command, jtag_fsm, sim):
+    assert False, 'Unsupported clocking flags {} in opcode 0x{:02x}'.format(
+            [flag.name for flag in command.flags], command.opcode)
+
+
+def make_sim_opcode(opcode):
+    """ Returns the SimOpcode of an FtdiOpcode. """
+    flags = opcode.flags or ()
+    supported = True
+    tdi = None
+
+    if opcode.type == FtdiCommandType.CLOCK_TMS:
+        run = sim_clock_tms
+        supported = (FtdiFlags.LSB_FIRST in flags and FtdiFlags.NEG_EDGE_OUT in flags
+                and FtdiFlags.BITWISE in flags)
+        if opcode.reading:
+            supported = supported and FtdiFlags.NEG_EDGE_IN in flags
+    elif opcode.type == FtdiCommandType.CLOCK_TDI:
+        run = sim_clock_tdi
+        supported = FtdiFlags.LSB_FIRST in flags and FtdiFlags.NEG_EDGE_OUT in flags
+        if opcode.reading:
+            supported = supported and FtdiFlags.NEG_EDGE_IN in flags
+    elif opcode.type == FtdiCommandType.CLOCK_TDO:
+        run = sim_clock_tdo
+        supported = FtdiFlags.LSB_FIRST in flags and FtdiFlags.NEG_EDGE_IN in flags
+
+        # TDI is 1 when clocking TDO?
+        tdi = 1
+    elif opcode.type == FtdiCommandType.SET_GPIO_LOW_BYTE:
+        run = sim_set_gpio_low_byte
+    else:
+        run = sim_no_reply
+
+    if not supported:
+        run = sim_unsupported
+
+    return SimOpcode(run, opcode.reading, opcode.bitwise, tdi)
+
+
+# SimOpcode of every opcode byte.
+SIM_OPCODES = tuple(make_sim_opcode(opcode) for opcode in FTDI_OPCODES)
+
+
+def run_ftdi_command(command, jtag_fsm):
+    sim = SIM_OPCODES[command.opcode]
+    return sim.run(command, jtag_fsm, sim)
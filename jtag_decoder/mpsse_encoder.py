@@ -0,0 +1,216 @@
+""" Encoding of decoded FTDI commands back into an MPSSE byte stream.
+
+encode_commands is the inverse of decode_commands for the TX stream, so a
+decoded session can be replayed to an adapter.  optimize_commands rewrites
+the commands of a session into an equivalent, shorter stream:
+
+ - Adjacent bytewise CLOCK_TDI or CLOCK_TDO commands with the same opcode
+   are merged, up to the 65536 bytes one command can clock.
+ - Adjacent CLOCK_TMS commands that do not read TDO and hold TDI at the same
+   level are merged, up to the 7 bits one command can clock.
+ - SET_GPIO_LOW_BYTE, SET_GPIO_HIGH_BYTE and SET_DIVISOR commands that set
+   the value already set are dropped.  Clocking commands drive TCK, TDI and
+   TMS (bits 0-3 of the low GPIO byte), so a SET_GPIO_LOW_BYTE after one is
+   always kept, as it may restore the pin levels.
+ - FLUSH commands with no replies pending since the previous FLUSH are
+   dropped, so consecutive batches that only write are sent as one.
+
+The JTAG clocks of the optimized commands are the same as those of the
+original ones, which tap_trajectory checks by simulation.
+
+"""
+from array import array
+from collections import Counter
+from .ftdi_decoder import FtdiCommandType, FTDI_OPCODES
+from .jtag_fsm import JtagFsm, TMS_PATHS, DRSHIFT, IRSHIFT
+from .jtag_models import DummyJtagModel
+from .jtag_sim import run_ftdi_command
+from .command_log import data_to_bytes
+
+# Most bytes clocked by one bytewise clocking command.
+MAX_CLOCK_BYTES = 0x10000
+
+# Most TMS bits clocked by one CLOCK_TMS command.
+MAX_TMS_BITS = 7
+
+# Bit of the CLOCK_TMS data byte holding the TDI level.
+TMS_TDI_BIT = 0x80
+
+# Commands whose repeats with the same data are dropped.
+SETTING_COMMANDS = (FtdiCommandType.SET_GPIO_LOW_BYTE, FtdiCommandType.SET_GPIO_HIGH_BYTE,
+        FtdiCommandType.SET_DIVISOR)
+
+# Commands changing the levels of the JTAG pins in the low GPIO byte.
+CLOCKING_COMMANDS = (FtdiCommandType.CLOCK_TDI, FtdiCommandType.CLOCK_TDO, FtdiCommandType.CLOCK_TMS,
+        FtdiCommandType.CLOCK_NO_DATA)
+
+
+def encode_length(length):
+    """ Returns the two byte length field of a bytewise command clocking length bytes or bits. """
+    return (length - 1).to_bytes(2, 'little')
+
+
+def encode_command(command):
+    """ Returns the MPSSE bytes of an FtdiCommand. """
+    opcode = FTDI_OPCODES[command.opcode]
+    encoded = bytearray([command.opcode])
+
+    if opcode.type == FtdiCommandType.CLOCK_NO_DATA:
+        encoded += encode_length(command.length)
+    elif opcode.type in (FtdiCommandType.CLOCK_TMS, FtdiCommandType.CLOCK_TDI, FtdiCommandType.CLOCK_TDO):
+        if opcode.bitwise:
+            encoded.append(command.length - 1)
+        else:
+            encoded += encode_length(command.length)
+
+    data = data_to_bytes(command)
+    if data is not None:
+        encoded += data
+
+    return bytes(encoded)
+
+
+def encode_commands(commands):
+    """ Returns the MPSSE byte stream of commands. """
+    return b''.join(encode_command(command) for command in commands)
+
+
+def merge_commands(first, second, extend=False):
+    """ Returns a command clocking the data of first then second.
+
+    The data and reply of the result are new lists, unless extend is set, in
+    which case those of first (which must be lists) are extended in place.
+
+    """
+    data = first.data
+    reply = first.reply
+    if not extend:
+        data = None if data is None else list(data)
+        reply = None if reply is None else list(reply)
+
+    if data is not None:
+        data.extend(second.data)
+    if reply is not None:
+        reply.extend(second.reply)
+
+    return first._replace(
+            reply_frame=second.reply_frame if reply is not None else first.reply_frame,
+            length=first.length + second.length,
+            data=data,
+            reply=reply)
+
+
+def merge_tms(first, second):
+    """ Returns a CLOCK_TMS command clocking the TMS bits of first then second. """
+    mask = (1 << first.length) - 1
+    data = (first.data[0] & (mask | TMS_TDI_BIT)) | ((second.data[0] << first.length) & ~TMS_TDI_BIT & 0xff)
+    return first._replace(length=first.length + second.length, data=[data])
+
+
+def can_merge(previous, command):
+    """ Returns True if command can be merged into the previous command. """
+    opcode = FTDI_OPCODES[command.opcode]
+    if previous.opcode != command.opcode:
+        return False
+    elif opcode.type in (FtdiCommandType.CLOCK_TDI, FtdiCommandType.CLOCK_TDO) and not opcode.bitwise:
+        return previous.length + command.length <= MAX_CLOCK_BYTES
+    elif opcode.type == FtdiCommandType.CLOCK_TMS and not opcode.reading:
+        return (previous.length + command.length <= MAX_TMS_BITS
+                and (previous.data[0] ^ command.data[0]) & TMS_TDI_BIT == 0)
+    else:
+        return False
+
+
+def optimize_commands(commands):
+    """ Returns (optimized commands, Counter of the optimizations applied).
+
+    See the module docstring for the optimizations.  Commands are FtdiCommands
+    or CommandRows, the optimized commands are FtdiCommands.
+
+    """
+    optimized = []
+    stats = Counter()
+    settings = {}
+    replies_pending = False
+    # The last optimized command is the result of merge_commands.
+    merged = False
+
+    for command in commands:
+        command_type = command.type
+        if hasattr(command, 'to_command'):
+            command = command.to_command()
+
+        if command_type in SETTING_COMMANDS:
+            data = tuple(command.data)
+            if settings.get(command_type) == data:
+                stats['Dropped repeated {}'.format(command_type.name)] += 1
+                continue
+
+            settings[command_type] = data
+        elif command_type == FtdiCommandType.FLUSH:
+            if not replies_pending:
+                stats['Dropped FLUSH with no pending replies'] += 1
+                continue
+
+            replies_pending = False
+        elif command_type in CLOCKING_COMMANDS:
+            settings.pop(FtdiCommandType.SET_GPIO_LOW_BYTE, None)
+
+        if command.reply is not None:
+            replies_pending = True
+
+        if optimized and can_merge(optimized[-1], command):
+            if command_type == FtdiCommandType.CLOCK_TMS:
+                optimized[-1] = merge_tms(optimized[-1], command)
+            else:
+                optimized[-1] = merge_commands(optimized[-1], command, extend=merged)
+                merged = True
+
+            stats['Merged {}'.format(command_type.name)] += 1
+            continue
+
+        optimized.append(command)
+        merged = False
+
+    return optimized, stats
+
+
+class TrajectoryFsm(JtagFsm):
+    """ JtagFsm recording the state of the TAP at each clock. """
+    def __init__(self):
+        JtagFsm.__init__(self, DummyJtagModel())
+        self.states = array('B')
+
+    def clock(self, tdi, tms):
+        self.states.append(self.state_value)
+        return JtagFsm.clock(self, tdi, tms)
+
+    def shift_bits(self, tdi, length):
+        # Bits shifted in one call all clock in the current state, other
+        # bits are recorded by clock.
+        if self.state_value == DRSHIFT or self.state_value == IRSHIFT:
+            self.states.extend(array('B', [self.state_value]) * length)
+
+        return JtagFsm.shift_bits(self, tdi, length)
+
+    def clock_tms(self, tms, length, tdi):
+        self.states.extend(TMS_PATHS[self.state_value][length][tms & ((1 << length) - 1)].states)
+        return JtagFsm.clock_tms(self, tms, length, tdi)
+
+
+def tap_trajectory(commands, initial_state=None):
+    """ Returns (TAP state at each clock, simulated TDO bytes) of running commands.
+
+    If initial_state is not None, the simulation assumes the TAP starts in it
+    with the pins driven, like a window of a capture.
+
+    """
+    jtag_fsm = TrajectoryFsm()
+    if initial_state is not None:
+        jtag_fsm.assume_state(initial_state)
+
+    replies = bytearray()
+    for command in commands:
+        replies += bytes(run_ftdi_command(command, jtag_fsm) or ())
+
+    return jtag_fsm.states, bytes(replies)
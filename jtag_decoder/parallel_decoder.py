@@ -0,0 +1,149 @@
+""" Parallel decoding of FTDI commands.
+
+OpenOCD writes commands in batches that end with a FLUSH, then reads the
+replies to the batch before writing the next one.  At the start of a batch,
+the TX and RX streams are aligned: every command before it has been written
+and replied to.  Such points (see find_resync_point) are used to cut the
+streams into segments that are decoded independently in worker processes.
+
+A segment only decodes the same commands as a sequential decode if it really
+starts at a command, with RX aligned.  Segments are stitched back in order,
+and a segment is only used if the decode before it ended exactly where it
+starts and it decoded cleanly up to the next cut.  Otherwise the commands are
+decoded sequentially across the seam, so the result (including any
+DecodeError) is the same as iter_commands.
+
+"""
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from .ftdi_decoder import (FtdiCommandType, DecodeError, FTDI_OPCODES, DECODE_HISTORY, CommandHistory,
+        decode_command, decode_unknown, find_resync_point, iter_commands)
+from .command_table import CommandTable
+
+# Target number of TX bytes decoded by each worker task.
+DECODE_SEGMENT_SIZE = 4 << 20
+
+
+def is_cut_point(ftdi_bytes, tx_index):
+    """ Returns True if the TX data around tx_index looks like the start of a batch.
+
+    The previous batch ends with a FLUSH, and the batch starts with a known
+    opcode.
+
+    """
+    with ftdi_bytes.view(tx_index - 1, tx_index + 1) as data:
+        return (data[0] == FtdiCommandType.FLUSH.value
+                and FTDI_OPCODES[data[1]].decode is not decode_unknown)
+
+
+def find_cut_points(ftdi_bytes, ftdi_replies, count):
+    """ Returns up to count (TX index, RX index) points to start segments at.
+
+    The first point is the current position of the buffers, and the others
+    are the first batch starts after evenly spaced TX offsets.
+
+    """
+    begin = ftdi_bytes.tell()
+    end = begin + len(ftdi_bytes)
+    cuts = [(begin, ftdi_replies.tell())]
+    for idx in range(1, count):
+        tx_index = max(begin + (end - begin) * idx // count, cuts[-1][0])
+        while True:
+            point = find_resync_point(ftdi_bytes, ftdi_replies, tx_index)
+            if point is None:
+                return cuts
+
+            _, tx_index, rx_index = point
+            if is_cut_point(ftdi_bytes, tx_index) and rx_index >= cuts[-1][1]:
+                break
+
+        cuts.append((tx_index, rx_index))
+
+    return cuts
+
+
+def decode_segment(segment):
+    """ Decode one segment of the streams in a worker process.
+
+    segment is (ftdi_bytes, ftdi_replies), slices of the streams holding
+    exactly the segment.  Returns the arrays of the CommandTable of its
+    commands, or None if the segment does not decode cleanly.
+
+    """
+    ftdi_bytes, ftdi_replies = segment
+    table = CommandTable(ftdi_bytes, ftdi_replies)
+    try:
+        for command in iter_commands(ftdi_bytes, ftdi_replies, history=0):
+            table.append(command, ftdi_bytes.tell(), ftdi_replies.tell())
+    except (DecodeError, IndexError):
+        return None
+
+    # Only the arrays are sent back, the rows are read from the parent's
+    # buffers, which use the same indices.
+    table.ftdi_bytes = None
+    table.ftdi_replies = None
+    return table
+
+
+def iter_segment_tables(executor, ftdi_bytes, ftdi_replies, segments, workers):
+    """ Yield the result of decode_segment for each (begin, end) segment, in order.
+
+    Only a few segments are copied out of the buffers at a time, to bound
+    memory use.
+
+    """
+    pending = deque()
+    for (tx_begin, rx_begin), (tx_end, rx_end) in segments:
+        if len(pending) >= workers * 2:
+            yield pending.popleft().result()
+
+        segment = (ftdi_bytes.slice(tx_begin, tx_end), ftdi_replies.slice(rx_begin, rx_end))
+        pending.append(executor.submit(decode_segment, segment))
+
+    while pending:
+        yield pending.popleft().result()
+
+
+def iter_commands_parallel(ftdi_bytes, ftdi_replies, workers=None, history=DECODE_HISTORY):
+    """ Yield each command decoded from ftdi_bytes, paired with replies, using a process pool.
+
+    Commands are yielded in order, as CommandRows for segments decoded by
+    workers, and as FtdiCommands where the seam between segments had to be
+    decoded sequentially.  Otherwise the same as iter_commands.
+
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    tx_end = ftdi_bytes.tell() + len(ftdi_bytes)
+    rx_end = ftdi_replies.tell() + len(ftdi_replies)
+    count = max(workers * 4, len(ftdi_bytes) // DECODE_SEGMENT_SIZE)
+    cuts = find_cut_points(ftdi_bytes, ftdi_replies, count)
+    segments = list(zip(cuts, cuts[1:] + [(tx_end, rx_end)]))
+
+    ftdi_commands = CommandHistory(history)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        tables = iter_segment_tables(executor, ftdi_bytes, ftdi_replies, segments, workers)
+        for ((tx_begin, rx_begin), (tx_end, rx_end)), table in zip(segments, tables):
+            position = (ftdi_bytes.tell(), ftdi_replies.tell())
+            if table is not None and position == (tx_begin, rx_begin):
+                table.ftdi_bytes = ftdi_bytes
+                table.ftdi_replies = ftdi_replies
+                ftdi_bytes.seek(tx_end)
+                ftdi_replies.seek(rx_end)
+                for command in table:
+                    ftdi_commands.append(command)
+                    yield command
+
+                continue
+
+            # Decode across the seam, the next segment is used if this ends
+            # exactly where it starts.
+            while ftdi_bytes.tell() < tx_end:
+                command = decode_command(ftdi_bytes, ftdi_replies, ftdi_commands)
+                ftdi_commands.append(command)
+                yield command
+
+    if len(ftdi_replies) != 0:
+        raise DecodeError('Leftover RX data, leftover = {}.'.format(len(ftdi_replies)), ftdi_commands)
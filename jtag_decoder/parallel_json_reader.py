@@ -0,0 +1,134 @@
+""" Parallel parsing of Wireshark JSON exports.
+
+Wireshark pretty prints the export, with each frame object starting on a line
+containing only "  {".  JSON strings cannot contain raw newlines, so such a
+line can only be the start of a top level array element, which makes it a safe
+point to split the export into chunks that are parsed independently.
+
+"""
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from .pcap_reader import json_loads, frame_payloads, collect_streams, pcap_json_reader, FTDI_DEFAULT_INTERFACES
+
+# Start of a top level frame object in a pretty printed export.
+FRAME_START_RE = re.compile(rb'\n  \{\r?\n')
+
+# Frames that do not contain this text are not FTDI frames, so they are
+# counted without being parsed.
+FTDI_PROTOCOL_MARKER = b'"usb:ftdift"'
+
+# Target amount of the export parsed by each worker task.
+JSON_CHUNK_SIZE = 32 << 20
+
+# Amount read at a time when searching for a frame start.
+FRAME_START_SEARCH_SIZE = 1 << 16
+
+
+def find_frame_start(f, offset, size):
+    """ Return the offset of the first frame start at or after offset, or size. """
+    while offset < size:
+        f.seek(offset)
+        data = f.read(FRAME_START_SEARCH_SIZE)
+        m = FRAME_START_RE.search(data)
+        if m is not None:
+            return offset + m.start() + 1
+
+        if len(data) < FRAME_START_SEARCH_SIZE:
+            break
+
+        # Overlap reads, so a start split across reads is still found.
+        offset += len(data) - 8
+
+    return size
+
+
+def find_chunks(path, workers):
+    """ Split the export at path into (begin, end) byte ranges of whole frames.
+
+    Returns None if the export is not pretty printed and cannot be split.
+
+    """
+    size = os.path.getsize(path)
+    num_chunks = max(workers * 4, size // JSON_CHUNK_SIZE)
+
+    with open(path, 'rb') as f:
+        starts = []
+        for idx in range(num_chunks):
+            start = find_frame_start(f, max(size * idx // num_chunks - 1, 0), size)
+            if start == size:
+                break
+
+            if not starts or start > starts[-1]:
+                starts.append(start)
+
+    if not starts:
+        return None
+
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def parse_json_chunk(chunk):
+    """ Parse the frames in one chunk of the export.
+
+    Returns the number of frames in the chunk, and a list of (StreamKey,
+    frame index within the chunk, tx bytes, rx bytes) for the FTDI frames.
+
+    """
+    path, begin, end, interfaces = chunk
+    with open(path, 'rb') as f:
+        f.seek(begin)
+        data = f.read(end - begin)
+
+    starts = [0] + [m.start() + 1 for m in FRAME_START_RE.finditer(data)]
+    ends = starts[1:] + [len(data)]
+
+    payloads = []
+    for idx, (frame_begin, frame_end) in enumerate(zip(starts, ends)):
+        text = data[frame_begin:frame_end]
+        if FTDI_PROTOCOL_MARKER not in text:
+            continue
+
+        # Drop the separator, and the end of the array after the last frame.
+        text = text.rstrip()
+        if text.endswith(b']'):
+            text = text[:-1].rstrip()
+        if text.endswith(b','):
+            text = text[:-1]
+
+        for key, tx_data, rx_data in frame_payloads(json_loads(text), interfaces):
+            payloads.append((key, idx, tx_data, rx_data))
+
+    return len(starts), payloads
+
+
+def iter_chunk_frames(results):
+    """ Yield (StreamKey, frame, tx bytes, rx bytes) from parse_json_chunk results, in chunk order. """
+    frame_base = 0
+    for num_frames, payloads in results:
+        for key, idx, tx_data, rx_data in payloads:
+            yield key, frame_base + idx + 1, tx_data, rx_data
+
+        frame_base += num_frames
+
+
+def pcap_json_parallel_reader(path, workers=None, interfaces=FTDI_DEFAULT_INTERFACES):
+    """ Read FTDI TX/RX payloads from a Wireshark JSON export using a process pool.
+
+    The export is split at frame boundaries, chunks are parsed in worker
+    processes, and payloads are merged back into the buffers in frame order.
+    Falls back to the streaming reader if the export cannot be split.
+    Returns {StreamKey: (ftdi_bytes, ftdi_replies)}.
+
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    chunks = find_chunks(path, workers)
+    if chunks is None:
+        with open(path) as f:
+            return pcap_json_reader(f, streaming=True, interfaces=interfaces)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(parse_json_chunk, ((path, begin, end, interfaces) for begin, end in chunks))
+        return collect_streams(iter_chunk_frames(results))
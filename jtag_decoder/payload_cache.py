@@ -0,0 +1,235 @@
+""" Binary sidecar cache of the FTDI payloads extracted from a capture.
+
+Parsing a capture is much slower than reading back the extracted payloads, so
+after the first load the TX bytes, RX bytes and their frame boundaries of
+every stream (FTDI interface of one USB device) are written next to the input.
+Later loads memory map the sidecar instead of parsing the capture again.
+
+Sidecar layout (little endian):
+
+    magic         8 bytes  PAYLOAD_CACHE_MAGIC
+    version       u32      PAYLOAD_CACHE_VERSION
+    source_len    u32      length of source
+    input_size    u64      size of the input capture
+    input_mtime   u64      st_mtime_ns of the input capture
+    input_hash    32 bytes blake2b digest of the head and tail of the input
+                           capture, see hash_file_sample
+    streams       u64      number of streams
+    source        source_len bytes, describes how the input was read
+    stream table  streams * PAYLOAD_CACHE_STREAM
+    then for each stream, in table order:
+        tx extents    tx_frames * (frame u64, begin u64, end u64)
+        rx extents    rx_frames * (frame u64, begin u64, end u64)
+        tx bytes
+        rx bytes
+
+Each PAYLOAD_CACHE_STREAM entry is:
+
+    bus           i64      USB bus number, -1 if unknown
+    device        i64      USB device address, -1 if unknown
+    interface     8 bytes  FTDI interface name
+    tx_len        u64      number of TX bytes
+    tx_frames     u64      number of TX frame extents
+    rx_len        u64      number of RX bytes
+    rx_frames     u64      number of RX frame extents
+
+"""
+import hashlib
+import mmap
+import os
+import struct
+import sys
+from array import array
+from .buffer import Buffer
+from .pcap_reader import StreamKey
+
+PAYLOAD_CACHE_MAGIC = b'FTDIPAY\0'
+PAYLOAD_CACHE_VERSION = 3
+PAYLOAD_CACHE_SUFFIX = '.ftdi_cache'
+PAYLOAD_CACHE_HEADER = struct.Struct('<8sII QQ32s Q')
+PAYLOAD_CACHE_STREAM = struct.Struct('<qq8s QQQQ')
+
+# Bytes hashed from each end of the input.  Hashing all of a multi-GB
+# capture would cost as much as a full read on every cache hit, the size and
+# modification time already catch most changes.
+HASH_SAMPLE_SIZE = 1 << 20
+
+
+def cache_path(path):
+    return path + PAYLOAD_CACHE_SUFFIX
+
+
+def hash_file_sample(path):
+    """ Returns blake2b digest of the first and last HASH_SAMPLE_SIZE bytes of the file at path. """
+    h = hashlib.blake2b(digest_size=32)
+    with open(path, 'rb') as f:
+        h.update(f.read(HASH_SAMPLE_SIZE))
+        size = os.fstat(f.fileno()).st_size
+        if size > HASH_SAMPLE_SIZE:
+            f.seek(max(HASH_SAMPLE_SIZE, size - HASH_SAMPLE_SIZE))
+            h.update(f.read(HASH_SAMPLE_SIZE))
+
+    return h.digest()
+
+
+def buffer_extents(buf):
+    """ Returns array of (frame, begin, end) triples for the frames in buf. """
+    extents = array('Q')
+    for frame, (begin, end) in buf.frames.items():
+        extents.extend((frame, begin, end))
+
+    if sys.byteorder == 'big':
+        extents.byteswap()
+
+    return extents
+
+
+def buffer_from_extents(data, extents):
+    """ Rebuild a Buffer from payload data and its frame extents. """
+    buf = Buffer()
+    for idx in range(0, len(extents), 3):
+        frame, begin, end = extents[idx:idx+3]
+        buf.extend(data[begin:end], frame=frame)
+
+    return buf
+
+
+def write_payload_cache(path, source, streams):
+    """ Write the sidecar cache of streams for the capture at path.
+
+    streams is {StreamKey: (ftdi_bytes, ftdi_replies)}.  The sidecar is
+    written to a temporary file and renamed into place, so a partially
+    written cache is never read.
+
+    """
+    st = os.stat(path)
+    source = source.encode('utf-8')
+
+    table = []
+    for key, (ftdi_bytes, ftdi_replies) in streams.items():
+        tx_extents = buffer_extents(ftdi_bytes)
+        rx_extents = buffer_extents(ftdi_replies)
+        entry = PAYLOAD_CACHE_STREAM.pack(
+                -1 if key.bus is None else key.bus,
+                -1 if key.device is None else key.device,
+                key.interface.encode('utf-8'),
+                len(ftdi_bytes.buf),
+                len(tx_extents) // 3,
+                len(ftdi_replies.buf),
+                len(rx_extents) // 3)
+        table.append((entry, tx_extents, rx_extents, ftdi_bytes, ftdi_replies))
+
+    header = PAYLOAD_CACHE_HEADER.pack(
+            PAYLOAD_CACHE_MAGIC,
+            PAYLOAD_CACHE_VERSION,
+            len(source),
+            st.st_size,
+            st.st_mtime_ns,
+            hash_file_sample(path),
+            len(table))
+
+    tmp_path = cache_path(path) + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        f.write(source)
+        for entry, _, _, _, _ in table:
+            f.write(entry)
+
+        for _, tx_extents, rx_extents, ftdi_bytes, ftdi_replies in table:
+            f.write(tx_extents.tobytes())
+            f.write(rx_extents.tobytes())
+            f.write(bytes(ftdi_bytes.buf))
+            f.write(bytes(ftdi_replies.buf))
+
+    os.replace(tmp_path, cache_path(path))
+
+
+def read_extents(data, offset, count):
+    """ Returns array of count (frame, begin, end) triples at offset in data. """
+    extents = array('Q')
+    extents.frombytes(data[offset:offset+count*3*8])
+    if sys.byteorder == 'big':
+        extents.byteswap()
+
+    return extents
+
+
+def read_payload_cache(path, source):
+    """ Returns {StreamKey: (ftdi_bytes, ftdi_replies)} from the sidecar cache of path.
+
+    Returns None if there is no cache, or it does not match the current
+    input file or source.  The input matches if its size, modification time
+    and the hash of its head and tail are unchanged.
+
+    """
+    try:
+        f = open(cache_path(path), 'rb')
+    except FileNotFoundError:
+        return None
+
+    with f:
+        if os.fstat(f.fileno()).st_size < PAYLOAD_CACHE_HEADER.size:
+            return None
+
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    # The payloads are copied into the Buffers, the mapping is not needed
+    # once they are built.
+    with data:
+        return read_cache_streams(data, path, source)
+
+
+def read_cache_streams(data, path, source):
+    """ Returns the streams of read_payload_cache from the mapped sidecar data, or None. """
+    (magic, version, source_len, input_size, input_mtime, input_hash,
+            num_streams) = PAYLOAD_CACHE_HEADER.unpack_from(data, 0)
+
+    if magic != PAYLOAD_CACHE_MAGIC or version != PAYLOAD_CACHE_VERSION:
+        return None
+
+    offset = PAYLOAD_CACHE_HEADER.size
+    if data[offset:offset+source_len] != source.encode('utf-8'):
+        return None
+    offset += source_len
+
+    st = os.stat(path)
+    if st.st_size != input_size or st.st_mtime_ns != input_mtime:
+        return None
+
+    if hash_file_sample(path) != input_hash:
+        return None
+
+    if len(data) < offset + num_streams * PAYLOAD_CACHE_STREAM.size:
+        return None
+
+    table = []
+    for _ in range(num_streams):
+        table.append(PAYLOAD_CACHE_STREAM.unpack_from(data, offset))
+        offset += PAYLOAD_CACHE_STREAM.size
+
+    expected_size = offset + sum(
+            (tx_frames + rx_frames) * 3 * 8 + tx_len + rx_len
+            for _, _, _, tx_len, tx_frames, rx_len, rx_frames in table)
+    if len(data) != expected_size:
+        return None
+
+    streams = {}
+    with memoryview(data) as view:
+        for bus, device, interface, tx_len, tx_frames, rx_len, rx_frames in table:
+            tx_extents = read_extents(data, offset, tx_frames)
+            offset += tx_frames*3*8
+            rx_extents = read_extents(data, offset, rx_frames)
+            offset += rx_frames*3*8
+
+            ftdi_bytes = buffer_from_extents(view[offset:offset+tx_len], tx_extents)
+            offset += tx_len
+            ftdi_replies = buffer_from_extents(view[offset:offset+rx_len], rx_extents)
+            offset += rx_len
+
+            key = StreamKey(
+                    None if bus < 0 else bus,
+                    None if device < 0 else device,
+                    interface.rstrip(b'\0').decode('utf-8'))
+            streams[key] = ftdi_bytes, ftdi_replies
+
+    return streams
@@ -1,41 +1,397 @@
 from .buffer import Buffer
+from collections import namedtuple
 import json
 
+# Use a faster JSON parser when one is installed.
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
 # It appears that if more than FTDI_MAX_PACKET_SIZE is returned in a reply,
 # the modem status is repeated. followed by the data bytes.
 #
 # This should've been handled in Wireshark, but the decoder likely has a bug.
 FTDI_MAX_PACKET_SIZE = 512
 
-def pcap_json_reader(fin):
-    ftdi_bytes = Buffer()
-    ftdi_replies = Buffer()
+# Interfaces of the FTDI multi-interface chips (FT2232 has A and B, FT4232
+# has A to D).  JTAG is decoded from interface A unless requested otherwise.
+FTDI_INTERFACES = 'ABCD'
+FTDI_DEFAULT_INTERFACES = ('A',)
 
-    for frame_idx, cap in enumerate(json.load(fin)):
-        protocol = cap.get('_source', {}).get('layers', {}).get('frame', {}).get('frame.protocols')
-        if protocol != 'usb:ftdift':
-            continue
+# Fields of a tshark field export without a header line.
+TSV_DEFAULT_FIELDS = ['frame.number'] + [
+        'ftdift.if_{}_{}_payload'.format(interface.lower(), direction)
+        for interface in FTDI_INTERFACES for direction in ('tx', 'rx')]
+
+# Identifies one FTDI command stream in a capture, an interface of one USB
+# device.  bus and device are None if the capture does not record them.
+StreamKey = namedtuple('StreamKey', 'bus device interface')
+
+# Amount of text read from the JSON export at a time when streaming.
+JSON_STREAM_CHUNK_SIZE = 1 << 20
+
+JSON_WHITESPACE = ' \t\n\r'
+
+# A JSONDecodeError this close to the end of the text may be caused by a
+# token cut by the end of a chunk (e.g. "fals" or "\u00"), the longest
+# being a \\uXXXX escape.
+JSON_TRUNCATED_TOKEN_LENGTH = 6
+
+
+def iter_json_array(fin, chunk_size=JSON_STREAM_CHUNK_SIZE, started=False):
+    """ Yield each element of the top level JSON array in fin.
+
+    Only one element (plus at most one chunk of unparsed text, or as much
+    text again as the element for elements larger than a chunk) is held in
+    memory at a time, so arbitrarily large Wireshark exports can be read.
+    Syntax errors are raised as soon as the text around them is read.
+
+    If started is set, fin is positioned at an element inside the array
+    instead of at the opening "[".
+
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+
+    def skip_whitespace():
+        nonlocal buf, pos, eof
+        while True:
+            while pos < len(buf) and buf[pos] in JSON_WHITESPACE:
+                pos += 1
+
+            if pos < len(buf) or eof:
+                return
+
+            buf = fin.read(chunk_size)
+            pos = 0
+            eof = len(buf) == 0
+
+    if not started:
+        skip_whitespace()
+        if pos >= len(buf) or buf[pos] != '[':
+            raise ValueError('Expected top level JSON array')
+        pos += 1
+
+    first = True
+    while True:
+        skip_whitespace()
+        if pos >= len(buf):
+            raise ValueError('Unterminated top level JSON array')
+
+        if buf[pos] == ']':
+            return
+
+        if not first:
+            if buf[pos] != ',':
+                raise ValueError('Expected "," between JSON array elements, found {!r}'.format(buf[pos]))
+            pos += 1
+            skip_whitespace()
+
+        first = False
+
+        while True:
+            try:
+                element, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError as e:
+                if eof or not json_error_at_end(e, buf):
+                    raise
+                end = None
+
+            # A bare number ending near the end of the buffer may continue
+            # in the next chunk (e.g. "1" then ".5").
+            if end is None or (end >= len(buf) - JSON_TRUNCATED_TOKEN_LENGTH and not eof):
+                # Read at least as much again as the partial element, so an
+                # element spanning many chunks is only parsed a logarithmic
+                # number of times.
+                more = fin.read(max(chunk_size, len(buf) - pos))
+                eof = len(more) == 0
+                buf = buf[pos:] + more
+                pos = 0
+                continue
+
+            break
+
+        yield element
+        pos = end
+
+        # Drop consumed text so the buffer stays around chunk_size.
+        if pos >= chunk_size:
+            buf = buf[pos:]
+            pos = 0
+
+
+def json_error_at_end(e, buf):
+    """ Returns True if JSONDecodeError e may be fixed by reading past the end of buf. """
+    return (e.pos >= len(buf) - JSON_TRUNCATED_TOKEN_LENGTH
+            or e.msg.startswith('Unterminated string'))
 
-        tx_data = cap.get('_source', {}).get('layers', {}).get('ftdift', {}).get('ftdift.if_a_tx_payload')
+
+def hex_payload_to_bytes(payload):
+    """ Convert a Wireshark colon separated hex string (e.g. "4b:04:1f") to bytes. """
+    return bytes.fromhex(payload.replace(':', ''))
+
+
+def strip_repeated_modem_status(data):
+    """ Remove modem status repeated after every FTDI_MAX_PACKET_SIZE bytes.
+
+    Wireshark already strips the modem status at the start of the reply.
+
+    """
+    view = memoryview(data)
+    stride = FTDI_MAX_PACKET_SIZE + 2
+    if len(view) <= FTDI_MAX_PACKET_SIZE:
+        return bytes(view)
+
+    return b''.join(view[idx:idx+FTDI_MAX_PACKET_SIZE] for idx in range(0, len(view), stride))
+
+
+def payload_field(interface, direction):
+    """ Returns the Wireshark ftdift payload field, e.g. 'ftdift.if_a_tx_payload'. """
+    return 'ftdift.if_{}_{}_payload'.format(interface.lower(), direction)
+
+
+def usb_address(value):
+    """ Convert a bus or device address field to int, or None if missing. """
+    if value is None or value == '':
+        return None
+    else:
+        return int(value)
+
+
+def interface_payloads(get_field, interfaces):
+    """ Yield (interface, tx bytes, rx bytes) from the ftdift payload fields of one frame.
+
+    get_field returns the hex string of a field, or None if the frame does
+    not have it.  Only interfaces with a payload in the frame are yielded,
+    one of tx bytes or rx bytes may be None.
+
+    """
+    for interface in interfaces:
+        tx_data = get_field(payload_field(interface, 'tx'))
         if tx_data is not None:
-            ftdi_bytes.extend((int(byte, 16) for byte in tx_data.split(':')), frame=frame_idx+1)
+            tx_data = hex_payload_to_bytes(tx_data)
 
-        rx_data = cap.get('_source', {}).get('layers', {}).get('ftdift', {}).get('ftdift.if_a_rx_payload')
+        rx_data = get_field(payload_field(interface, 'rx'))
         if rx_data is not None:
+            rx_data = strip_repeated_modem_status(hex_payload_to_bytes(rx_data))
+
+        if tx_data is not None or rx_data is not None:
+            yield interface, tx_data, rx_data
+
+
+def frame_payloads(cap, interfaces=FTDI_DEFAULT_INTERFACES):
+    """ Returns [(StreamKey, tx bytes, rx bytes)] from one Wireshark JSON frame object.
+
+    See interface_payloads, the list is empty if the frame is not an FTDI
+    frame.
+
+    """
+    layers = cap.get('_source', {}).get('layers', {})
+    protocol = layers.get('frame', {}).get('frame.protocols')
+    if protocol != 'usb:ftdift':
+        return []
+
+    usb = layers.get('usb', {})
+    bus = usb_address(usb.get('usb.bus_id'))
+    device = usb_address(usb.get('usb.device_address'))
+
+    return [(StreamKey(bus, device, interface), tx_data, rx_data)
+            for interface, tx_data, rx_data in interface_payloads(layers.get('ftdift', {}).get, interfaces)]
+
+
+def add_payloads(ftdi_bytes, ftdi_replies, frame, tx_data, rx_data):
+    """ Add the payloads of one frame to the buffers. """
+    if tx_data is not None:
+        ftdi_bytes.extend(tx_data, frame=frame)
+
+    if rx_data is not None:
+        ftdi_replies.extend(rx_data, frame=frame)
+
+
+def collect_streams(frames):
+    """ Returns {StreamKey: (ftdi_bytes, ftdi_replies)} Buffers of each stream in frames.
+
+    frames is an iterator of (StreamKey, frame, tx bytes, rx bytes), as
+    yielded by the iter_*_frames functions.  Streams are in the order they
+    first appear.
+
+    """
+    streams = {}
+    for key, frame, tx_data, rx_data in frames:
+        buffers = streams.get(key)
+        if buffers is None:
+            buffers = streams[key] = (Buffer(), Buffer())
+
+        add_payloads(*buffers, frame, tx_data, rx_data)
+
+    return streams
+
+
+def iter_json_frames(caps, first_frame=1, interfaces=FTDI_DEFAULT_INTERFACES):
+    """ Yield (StreamKey, frame, tx bytes, rx bytes) for the FTDI frames in Wireshark JSON frame objects.
+
+    first_frame is the frame number of the first object in caps.
+
+    """
+    for frame, cap in enumerate(caps, first_frame):
+        for key, tx_data, rx_data in frame_payloads(cap, interfaces):
+            yield key, frame, tx_data, rx_data
+
+
+def pcap_json_reader(fin, streaming=False, interfaces=FTDI_DEFAULT_INTERFACES):
+    """ Read FTDI TX/RX payloads from a Wireshark JSON export.
+
+    Returns {StreamKey: (ftdi_bytes, ftdi_replies)} for the requested FTDI
+    interfaces of each device.  If streaming is set, frames are parsed one
+    at a time instead of loading the whole JSON tree first.
+
+    """
+    if streaming:
+        caps = iter_json_array(fin)
+    else:
+        caps = json_loads(fin.read())
+
+    return collect_streams(iter_json_frames(caps, interfaces=interfaces))
+
+
+def tsv_columns(fields):
+    """ Returns {field name: column} of a tshark field export header line. """
+    if fields[0] != 'frame.number':
+        raise ValueError('The first field of the export must be frame.number, found {!r}'.format(fields[0]))
+
+    return {name: column for column, name in enumerate(fields)}
+
+
+def iter_tsv_frames(lines, interfaces=FTDI_DEFAULT_INTERFACES):
+    """ Yield (StreamKey, frame, tx bytes, rx bytes) from the lines of a tshark field export.
+
+    The export is expected to be generated with:
+
+        tshark -r <capture> -T fields -e frame.number \
+                -e ftdift.if_a_tx_payload -e ftdift.if_a_rx_payload
+
+    Without a header line, interfaces B, C and D are read from further tx/rx
+    payload field pairs in that order.  With a header line (-E header=y),
+    fields are found by name, which also allows adding usb.bus_id and
+    usb.device_address to separate devices.  frame.number must be first.
+
+    """
+    columns = None
+    for line in lines:
+        fields = line.rstrip('\r\n').split('\t')
+        if not fields[0].isdigit():
+            if columns is None and fields[0] == 'frame.number':
+                columns = tsv_columns(fields)
+            continue
+
+        if columns is None:
+            columns = tsv_columns(TSV_DEFAULT_FIELDS[:len(fields)])
+
+        if len(fields) != len(columns):
+            raise ValueError('Expected {} fields, found {} in line {!r}'.format(len(columns), len(fields), line))
+
+        frame = int(fields[0])
+        bus = device = None
+        if 'usb.bus_id' in columns:
+            bus = usb_address(fields[columns['usb.bus_id']])
+        if 'usb.device_address' in columns:
+            device = usb_address(fields[columns['usb.device_address']])
+
+        for interface in interfaces:
+            tx_field = payload_field(interface, 'tx')
+            rx_field = payload_field(interface, 'rx')
+            if tx_field not in columns or rx_field not in columns:
+                raise ValueError('No {} and {} fields in the export'.format(tx_field, rx_field))
+
+            tx_data = fields[columns[tx_field]]
+            rx_data = fields[columns[rx_field]]
+
+            if tx_data:
+                tx_data = hex_payload_to_bytes(tx_data)
+            else:
+                tx_data = None
+
+            if rx_data:
+                rx_data = strip_repeated_modem_status(hex_payload_to_bytes(rx_data))
+            else:
+                rx_data = None
+
+            if tx_data is not None or rx_data is not None:
+                yield StreamKey(bus, device, interface), frame, tx_data, rx_data
+
+
+def pcap_tsv_reader(fin, interfaces=FTDI_DEFAULT_INTERFACES):
+    """ Read FTDI TX/RX payloads from a tshark field export.
+
+    The export is read one line at a time, see iter_tsv_frames.  Returns
+    {StreamKey: (ftdi_bytes, ftdi_replies)}.
+
+    """
+    return collect_streams(iter_tsv_frames(fin, interfaces))
+
+
+def ek_field(layer, name):
+    """ Returns the value of field name (e.g. 'frame.number') from a tshark -T ek layer.
+
+    Depending on the tshark version, ek field names are the field name with
+    '.' replaced by '_', optionally prefixed by the layer name and '_'.
+
+    """
+    key = name.replace('.', '_')
+    value = layer.get(key)
+    if value is None:
+        value = layer.get(name.split('.')[0] + '_' + key)
+
+    return value
+
+
+def iter_ek_frames(lines, first_frame=1, interfaces=FTDI_DEFAULT_INTERFACES):
+    """ Yield (StreamKey, frame, tx bytes, rx bytes) from the lines of a tshark -T ek export.
+
+    The ek export is newline delimited JSON, alternating index lines and
+    packet documents, e.g. from "tshark -l -T ek".  Packet documents without
+    a frame number are numbered from first_frame.
+
+    """
+    frame_idx = first_frame - 1
+    for line in lines:
+        if not line.strip():
+            continue
+
+        doc = json_loads(line)
+        layers = doc.get('layers')
+        if layers is None:
+            # Index line
+            continue
+
+        frame_idx += 1
+        frame_layer = layers.get('frame', {})
+        frame = ek_field(frame_layer, 'frame.number')
+        if frame is None:
+            frame = frame_idx
+        else:
+            frame = int(frame)
+
+        if ek_field(frame_layer, 'frame.protocols') != 'usb:ftdift':
+            continue
+
+        usb = layers.get('usb', {})
+        bus = usb_address(ek_field(usb, 'usb.bus_id'))
+        device = usb_address(ek_field(usb, 'usb.device_address'))
+
+        ftdift = layers.get('ftdift', {})
+        for interface, tx_data, rx_data in interface_payloads(lambda name: ek_field(ftdift, name), interfaces):
+            yield StreamKey(bus, device, interface), frame, tx_data, rx_data
 
-            in_data = tuple(int(byte, 16) for byte in rx_data.split(':'))
-            idx = 0
-            out_data = []
-            while len(in_data) - idx >= FTDI_MAX_PACKET_SIZE:
-                out_data.extend(in_data[idx:idx+FTDI_MAX_PACKET_SIZE])
-                idx += FTDI_MAX_PACKET_SIZE
-                # Modem status is next two bytes, skip them
-                idx += 2
 
-            if idx < len(in_data):
-                assert len(in_data) - idx < FTDI_MAX_PACKET_SIZE
-                out_data.extend(in_data[idx:])
+def pcap_ek_reader(fin, interfaces=FTDI_DEFAULT_INTERFACES):
+    """ Read FTDI TX/RX payloads from a tshark -T ek export, one line at a time.
 
-            ftdi_replies.extend(out_data, frame=frame_idx+1)
+    Returns {StreamKey: (ftdi_bytes, ftdi_replies)}.
 
-    return ftdi_bytes, ftdi_replies
+    """
+    return collect_streams(iter_ek_frames(fin, interfaces=interfaces))
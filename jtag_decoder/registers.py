@@ -1,4 +1,5 @@
 from collections import deque
+from .utils import int_to_bits, int_to_bit_array, bits_to_int
 
 
 class ShiftRegister(object):
@@ -14,30 +15,35 @@ class ShiftRegister(object):
         self.data.append(int(di))
         return do
 
+    def shift_bits(self, value, length):
+        """ Shift in the length bits of value, LSB first, and return the bits shifted out. """
+        shifted = self.read() | (value << self.width)
+        self.load(shifted >> length)
+        return shifted & ((1 << length) - 1)
+
     def load(self, data):
-        for idx in range(self.width):
-            self.data[idx] = 1 if (data & (1 << idx)) != 0 else 0
+        self.data = deque(int_to_bits(data, self.width))
 
     def read(self):
-        data = 0
-        for idx, bit in enumerate(self.data):
-            if bit:
-                data |= (1 << idx)
-
-        return data
+        return bits_to_int(self.data)
 
 
 class SinkRegister(object):
     """ Represents a DR that simply sinks the clocked in data forever.
 
     The CFG_IN register uses this type to forward the input bitstream directly
-    to the configuration engine.
+    to the configuration engine.  The bits are kept as a bit array, see
+    utils.
     """
     def __init__(self):
-        self.data = []
+        self.data = bytearray()
 
     def shift(self, di):
-        self.data.append(di)
+        self.data.append(int(di))
+        return 0
+
+    def shift_bits(self, value, length):
+        self.data += int_to_bit_array(value, length)
         return 0
 
     def read(self):
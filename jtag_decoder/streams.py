@@ -0,0 +1,129 @@
+""" Decoding of several FTDI command streams from one capture in parallel.
+
+Each FTDI interface of each adapter is an independent MPSSE command stream
+driving its own JTAG chain, so each is decoded and simulated in its own
+worker process.
+
+"""
+import contextlib
+import os
+import shutil
+import sys
+import tempfile
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from .buffer import Buffer
+from .pcap_reader import StreamKey
+
+
+def stream_path(path, name):
+    """ Returns the output path for stream name, e.g. out.tcl -> out_B.tcl.
+
+    path is returned unchanged if it or name is None.
+
+    """
+    if path is None or name is None:
+        return path
+
+    root, ext = os.path.splitext(path)
+    return '{}_{}{}'.format(root, name, ext)
+
+
+def stream_names(keys, interfaces):
+    """ Returns {StreamKey: name} to tell the outputs of streams apart.
+
+    The name is made of the USB bus and device if keys span several devices,
+    e.g. '1-3', and the interface if several interfaces were requested, e.g.
+    '1-3_B'.  The name is None if neither is needed.
+
+    """
+    devices = {(key.bus, key.device) for key in keys}
+
+    names = {}
+    for key in keys:
+        parts = []
+        if len(devices) > 1:
+            parts.append('{}-{}'.format(key.bus, key.device))
+        if len(interfaces) > 1:
+            parts.append(key.interface)
+
+        names[key] = '_'.join(parts) or None
+
+    return names
+
+
+def stream_title(key):
+    """ Returns a description of the stream, e.g. 'bus 1 device 3 interface A'. """
+    if key.bus is None and key.device is None:
+        return 'interface {}'.format(key.interface)
+    else:
+        return 'bus {} device {} interface {}'.format(key.bus, key.device, key.interface)
+
+
+def run_captured(output_path, fn, *args):
+    """ Run fn(*args) with its printed output written to output_path.
+
+    Returns the formatted exception, or None if fn succeeded.  The output is
+    written to a file rather than returned, so the output of a long capture
+    is never held in memory.
+
+    """
+    with open(output_path, 'w') as output, contextlib.redirect_stdout(output):
+        try:
+            fn(*args)
+        except Exception:
+            return traceback.format_exc()
+
+    return None
+
+
+def decode_streams(decode_stream, args, streams):
+    """ Run decode_stream(args, name, ftdi_bytes, ftdi_replies) for each stream.
+
+    streams is {StreamKey: (ftdi_bytes, ftdi_replies)}, see stream_names for
+    name.  If streams is empty, the requested interfaces are decoded as empty
+    streams, so the outputs are still written.
+
+    A single stream is decoded in this process.  Otherwise each stream is
+    decoded in a worker process, at most one per CPU.  The output of each
+    worker goes to a temporary file, which is copied to stdout once it has
+    finished.
+
+    Returns False if decoding any of the streams failed.
+
+    """
+    if not streams:
+        streams = {StreamKey(None, None, interface): (Buffer(), Buffer()) for interface in args.interface}
+
+    names = stream_names(streams.keys(), args.interface)
+
+    if len(streams) == 1:
+        (key, (ftdi_bytes, ftdi_replies)), = streams.items()
+        decode_stream(args, names[key], ftdi_bytes, ftdi_replies)
+        return True
+
+    ok = True
+    workers = min(len(streams), os.cpu_count() or 1)
+    with tempfile.TemporaryDirectory(prefix='jtag_decoder_') as output_dir, \
+            ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for idx, (key, (ftdi_bytes, ftdi_replies)) in enumerate(streams.items()):
+            output_path = os.path.join(output_dir, 'stream_{}.txt'.format(idx))
+            future = executor.submit(run_captured, output_path, decode_stream, args, names[key], ftdi_bytes, ftdi_replies)
+            futures.append((key, output_path, future))
+
+        for key, output_path, future in futures:
+            error = future.result()
+            title = stream_title(key)
+            print('==== {}{} ===='.format(title[0].upper(), title[1:]))
+            sys.stdout.flush()
+            with open(output_path) as output:
+                shutil.copyfileobj(output, sys.stdout)
+            os.remove(output_path)
+
+            if error is not None:
+                print('Decoding {} failed:'.format(title), file=sys.stderr)
+                print(error, file=sys.stderr, end='')
+                ok = False
+
+    return ok
@@ -0,0 +1,343 @@
+""" Reads FTDI payloads directly from pcap/pcapng USB captures.
+
+Supports the Linux usbmon (LINKTYPE_USB_LINUX and LINKTYPE_USB_LINUX_MMAPPED)
+and Windows USBPcap (LINKTYPE_USBPCAP) link types, so captures do not need to
+be exported from Wireshark as JSON first.
+
+"""
+import io
+import mmap
+import os
+import struct
+from collections import namedtuple
+from .pcap_reader import FTDI_MAX_PACKET_SIZE, FTDI_DEFAULT_INTERFACES, StreamKey, collect_streams
+
+LINKTYPE_USB_LINUX = 189
+LINKTYPE_USB_LINUX_MMAPPED = 220
+LINKTYPE_USBPCAP = 249
+
+PCAP_MAGIC = 0xa1b2c3d4
+PCAP_MAGIC_NS = 0xa1b23c4d
+PCAPNG_SECTION_HEADER = 0x0a0d0d0a
+PCAPNG_BYTE_ORDER_MAGIC = 0x1a2b3c4d
+PCAPNG_INTERFACE_DESCRIPTION = 0x00000001
+PCAPNG_PACKET = 0x00000002
+PCAPNG_SIMPLE_PACKET = 0x00000003
+PCAPNG_ENHANCED_PACKET = 0x00000006
+
+USB_TRANSFER_CONTROL = 2
+USB_TRANSFER_BULK = 3
+
+FTDI_VENDOR_ID = 0x0403
+
+# Bulk (OUT, IN) endpoints of each FTDI multi-interface chip interface.
+FTDI_INTERFACE_ENDPOINTS = {
+        'A': (0x02, 0x81),
+        'B': (0x04, 0x83),
+        'C': (0x06, 0x85),
+        'D': (0x08, 0x87),
+        }
+
+USB_DEVICE_DESCRIPTOR_LENGTH = 18
+USB_DESCRIPTOR_TYPE_DEVICE = 1
+
+# Linux usbmon packet header, see Documentation/usb/usbmon.rst
+USBMON_HEADER_FORMAT = 'QcBBBHbbqiiII8s'
+USBMON_HEADER_SIZE = struct.calcsize('<' + USBMON_HEADER_FORMAT)
+USBMON_MMAPPED_HEADER_SIZE = 64
+USBMON_ISO_DESCRIPTOR_SIZE = 16
+
+# USBPcap packet header, see https://desowin.org/usbpcap/captureformat.html
+USBPCAP_HEADER = struct.Struct('<HQIHBHHBBI')
+USBPCAP_INFO_PDO_TO_FDO = 0x1
+
+# Decoded USB transfer, common to all supported link types.
+#
+#  completion - True if this packet is the URB completion, False if it is the
+#               URB submission.
+#  endpoint - Endpoint address, including the direction bit (0x80 for IN).
+UsbPacket = namedtuple('UsbPacket', 'completion transfer_type bus device endpoint data')
+
+
+def iter_pcap_packets(fin, start=None):
+    """ Yield (frame number, position, link type, byte order, packet data) from pcap data.
+
+    fin is read sequentially, it may be a file, mmap or decompression stream
+    of a pcap or pcapng file.  Frame numbers count every packet record,
+    matching Wireshark frame numbers.  A truncated final record (e.g. from a
+    capture that was killed) ends the iteration.
+
+    position is (section offset, record offset), the byte offsets of the
+    header describing the record (the pcapng section, or the pcap file
+    header) and of the record itself.  Passing (frame number, section
+    offset, record offset) of a previously yielded record as start resumes
+    reading at that record, in which case fin must be seekable.
+
+    """
+    if start is not None:
+        fin.seek(start[1])
+
+    header = fin.read(4)
+    if len(header) < 4:
+        return
+
+    magic_le, = struct.unpack('<I', header)
+    if magic_le == PCAPNG_SECTION_HEADER:
+        yield from iter_pcapng_packets(fin, header, start)
+        return
+
+    for byte_order in '<>':
+        magic, = struct.unpack(byte_order + 'I', header)
+        if magic in (PCAP_MAGIC, PCAP_MAGIC_NS):
+            break
+    else:
+        raise ValueError('Not a pcap or pcapng file, magic = 0x{:08x}'.format(magic_le))
+
+    header += fin.read(20)
+    if len(header) < 24:
+        return
+
+    network, = struct.unpack_from(byte_order + 'I', header, 20)
+    linktype = network & 0xffff
+
+    record_header = struct.Struct(byte_order + 'IIII')
+    frame = 0
+    offset = len(header)
+    if start is not None:
+        frame = start[0] - 1
+        offset = start[2]
+        fin.seek(offset)
+
+    while True:
+        header = fin.read(record_header.size)
+        if len(header) < record_header.size:
+            return
+
+        _, _, incl_len, _ = record_header.unpack(header)
+        packet = fin.read(incl_len)
+        if len(packet) < incl_len:
+            return
+
+        frame += 1
+        yield frame, (0, offset), linktype, byte_order, packet
+        offset += record_header.size + incl_len
+
+
+def iter_pcapng_packets(fin, block_type_bytes, start=None):
+    """ Yield (frame number, position, link type, byte order, packet data) from pcapng data.
+
+    block_type_bytes is the already read block type of the first block, see
+    iter_pcap_packets for position and start.  When resuming, the interfaces
+    of the section are read from the blocks before its first packet.
+
+    """
+    frame = 0
+    byte_order = '<'
+    linktypes = []
+    offset = 0
+    section = 0
+    if start is not None:
+        offset = section = start[1]
+
+    while True:
+        header = block_type_bytes + fin.read(8 - len(block_type_bytes))
+        block_type_bytes = b''
+        if len(header) < 8:
+            return
+
+        block_type, = struct.unpack_from(byte_order + 'I', header, 0)
+        if block_type == PCAPNG_SECTION_HEADER:
+            # Byte order (and interface numbering) can change per section.
+            bom_bytes = fin.read(4)
+            if len(bom_bytes) < 4:
+                return
+
+            for byte_order in '<>':
+                bom, = struct.unpack(byte_order + 'I', bom_bytes)
+                if bom == PCAPNG_BYTE_ORDER_MAGIC:
+                    break
+            else:
+                raise ValueError('Bad pcapng byte order magic')
+
+            linktypes = []
+            section = offset
+
+        block_len, = struct.unpack_from(byte_order + 'I', header, 4)
+        if block_len < 12:
+            raise ValueError('Bad pcapng block length {}'.format(block_len))
+
+        if block_type == PCAPNG_SECTION_HEADER:
+            body = bom_bytes + fin.read(block_len - 12)
+        else:
+            body = fin.read(block_len - 8)
+
+        if len(body) < block_len - 8:
+            return
+
+        if start is not None and block_type in (PCAPNG_ENHANCED_PACKET, PCAPNG_SIMPLE_PACKET, PCAPNG_PACKET):
+            # Section interfaces are known, skip to the resumed record.
+            frame = start[0] - 1
+            offset = start[2]
+            fin.seek(offset)
+            start = None
+            continue
+
+        position = (section, offset)
+        offset += block_len
+
+        if block_type == PCAPNG_INTERFACE_DESCRIPTION:
+            linktype, _, snaplen = struct.unpack_from(byte_order + 'HHI', body, 0)
+            linktypes.append((linktype, snaplen))
+        elif block_type == PCAPNG_ENHANCED_PACKET:
+            interface, _, _, cap_len, _ = struct.unpack_from(byte_order + 'IIIII', body, 0)
+            frame += 1
+            yield frame, position, linktypes[interface][0], byte_order, body[20:20+cap_len]
+        elif block_type == PCAPNG_SIMPLE_PACKET:
+            orig_len, = struct.unpack_from(byte_order + 'I', body, 0)
+            cap_len = min(orig_len, block_len - 16)
+            frame += 1
+            yield frame, position, linktypes[0][0], byte_order, body[4:4+cap_len]
+        elif block_type == PCAPNG_PACKET:
+            interface, _, _, _, cap_len, _ = struct.unpack_from(byte_order + 'HHIIII', body, 0)
+            frame += 1
+            yield frame, position, linktypes[interface][0], byte_order, body[20:20+cap_len]
+
+
+def parse_usb_packet(linktype, byte_order, packet):
+    """ Decode the USB header of one packet. Returns UsbPacket or None. """
+    if linktype in (LINKTYPE_USB_LINUX, LINKTYPE_USB_LINUX_MMAPPED):
+        if len(packet) < USBMON_HEADER_SIZE:
+            return None
+
+        (_, urb_type, transfer_type, endpoint, device, bus, _, flag_data,
+                _, _, _, _, len_cap, _) = struct.unpack_from(
+                        byte_order + USBMON_HEADER_FORMAT, packet, 0)
+
+        if linktype == LINKTYPE_USB_LINUX_MMAPPED:
+            ndesc, = struct.unpack_from(byte_order + 'I', packet, 60)
+            data_offset = USBMON_MMAPPED_HEADER_SIZE + ndesc * USBMON_ISO_DESCRIPTOR_SIZE
+        else:
+            data_offset = USBMON_HEADER_SIZE
+
+        if flag_data != 0:
+            # No data captured with this URB
+            data = packet[0:0]
+        else:
+            data = packet[data_offset:data_offset+len_cap]
+
+        return UsbPacket(
+                completion=urb_type == b'C',
+                transfer_type=transfer_type,
+                bus=bus,
+                device=device,
+                endpoint=endpoint,
+                data=data)
+    elif linktype == LINKTYPE_USBPCAP:
+        if len(packet) < USBPCAP_HEADER.size:
+            return None
+
+        (header_len, _, _, _, info, bus, device, endpoint, transfer_type,
+                data_len) = USBPCAP_HEADER.unpack_from(packet, 0)
+
+        return UsbPacket(
+                completion=(info & USBPCAP_INFO_PDO_TO_FDO) != 0,
+                transfer_type=transfer_type,
+                bus=bus,
+                device=device,
+                endpoint=endpoint,
+                data=packet[header_len:header_len+data_len])
+    else:
+        return None
+
+
+def device_vendor_id(usb_packet):
+    """ Returns idVendor if usb_packet carries a device descriptor, else None. """
+    if usb_packet.transfer_type != USB_TRANSFER_CONTROL or not usb_packet.completion:
+        return None
+
+    data = usb_packet.data
+    if len(data) < USB_DEVICE_DESCRIPTOR_LENGTH:
+        return None
+
+    if data[0] != USB_DEVICE_DESCRIPTOR_LENGTH or data[1] != USB_DESCRIPTOR_TYPE_DEVICE:
+        return None
+
+    return data[8] | (data[9] << 8)
+
+
+def strip_modem_status(data, max_packet_size=FTDI_MAX_PACKET_SIZE):
+    """ Remove the 2 modem status bytes that start every FTDI IN packet. """
+    return b''.join(data[idx+2:idx+max_packet_size] for idx in range(0, len(data), max_packet_size))
+
+
+def iter_usb_payloads(fin, interfaces=FTDI_DEFAULT_INTERFACES, max_packet_size=FTDI_MAX_PACKET_SIZE, start=None, vendor_ids=None):
+    """ Yield (StreamKey, frame, tx bytes, rx bytes) for each FTDI frame in a USB capture.
+
+    One of tx bytes or rx bytes is always None.
+
+    Bulk transfers are taken from the endpoints of the requested FTDI
+    interfaces, of every device on every bus in the capture.  If the capture contains the enumeration of a device, only
+    devices with the FTDI vendor ID are used, devices that were already
+    enumerated before the capture started are assumed to be FTDI devices.
+
+    start resumes reading at a packet record, see iter_pcap_packets.
+    Enumerations before that record are not seen, vendor_ids gives the
+    vendor ID of already enumerated devices by (bus, device).
+
+    """
+    out_endpoints = {}
+    in_endpoints = {}
+    for interface in interfaces:
+        out_endpoint, in_endpoint = FTDI_INTERFACE_ENDPOINTS[interface]
+        out_endpoints[out_endpoint] = interface
+        in_endpoints[in_endpoint] = interface
+
+    vendor_ids = dict(vendor_ids or {})
+
+    for frame, _, linktype, byte_order, packet in iter_pcap_packets(fin, start):
+        usb_packet = parse_usb_packet(linktype, byte_order, packet)
+        if usb_packet is None:
+            continue
+
+        vendor_id = device_vendor_id(usb_packet)
+        if vendor_id is not None:
+            vendor_ids[usb_packet.bus, usb_packet.device] = vendor_id
+            continue
+
+        if usb_packet.transfer_type != USB_TRANSFER_BULK:
+            continue
+
+        if vendor_ids.get((usb_packet.bus, usb_packet.device), FTDI_VENDOR_ID) != FTDI_VENDOR_ID:
+            continue
+
+        if usb_packet.endpoint in out_endpoints and not usb_packet.completion:
+            if len(usb_packet.data):
+                key = StreamKey(usb_packet.bus, usb_packet.device, out_endpoints[usb_packet.endpoint])
+                yield key, frame, usb_packet.data, None
+        elif usb_packet.endpoint in in_endpoints and usb_packet.completion:
+            rx_data = strip_modem_status(usb_packet.data, max_packet_size)
+            if len(rx_data):
+                key = StreamKey(usb_packet.bus, usb_packet.device, in_endpoints[usb_packet.endpoint])
+                yield key, frame, None, rx_data
+
+
+def map_capture(fin):
+    """ Returns a memory map of fin if it is a regular file, otherwise fin. """
+    if isinstance(getattr(fin, 'raw', fin), io.FileIO) and os.fstat(fin.fileno()).st_size > 0:
+        return mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+    else:
+        return fin
+
+
+def pcap_usb_reader(fin, interfaces=FTDI_DEFAULT_INTERFACES, max_packet_size=FTDI_MAX_PACKET_SIZE):
+    """ Read FTDI TX/RX payloads from a pcap/pcapng USB capture.
+
+    fin must be a binary file object.  Regular files are memory mapped,
+    other streams (e.g. decompression streams) are read sequentially, so the
+    capture is never read into memory as a whole.
+
+    Returns {StreamKey: (ftdi_bytes, ftdi_replies)}, see iter_usb_payloads
+    for which transfers are used.
+
+    """
+    return collect_streams(iter_usb_payloads(map_capture(fin), interfaces, max_packet_size))
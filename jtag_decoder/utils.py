@@ -1,34 +1,114 @@
+""" Packing and unpacking of bit vectors, LSB first.
+
+Bit vectors are sequences of 0/1 ints, either lists or bit arrays (bytes
+holding one 0 or 1 byte per bit, which take an eighth of the memory of a
+list).  Whole vectors are converted at once, with NumPy if it is installed,
+otherwise through the binary digits of an int, so no Python code runs per
+bit.
+
+"""
+
+# Optional, only used to speed up long bit vectors.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Bit vectors shorter than this are converted without NumPy, which has a
+# higher overhead per call.
+NUMPY_MIN_BITS = 1 << 12
+
+# Translations between bit values and binary digits.
+BITS_TO_DIGITS = bytes.maketrans(b'\x00\x01', b'01')
+DIGITS_TO_BITS = bytes.maketrans(b'01', b'\x00\x01')
+
+
+def int_to_bit_array(value, length):
+    """ Converts the low length bits of value to a bit array, LSB first.
+
+    >>> int_to_bit_array(0b110, 4)
+    b'\\x00\\x01\\x01\\x00'
+
+    """
+    if length == 0:
+        return b''
+
+    value &= (1 << length) - 1
+    if numpy is not None and length >= NUMPY_MIN_BITS:
+        data = numpy.frombuffer(value.to_bytes((length + 7) // 8, 'little'), dtype=numpy.uint8)
+        return numpy.unpackbits(data, count=length, bitorder='little').tobytes()
+
+    return '{:0{}b}'.format(value, length).encode('ascii')[::-1].translate(DIGITS_TO_BITS)
+
+
+def int_to_bits(value, length):
+    """ Converts the low length bits of value to a list of bits, LSB first.
+
+    >>> int_to_bits(0b110, 4)
+    [0, 1, 1, 0]
+    >>> int_to_bits(0b110, 0)
+    []
+
+    """
+    return list(int_to_bit_array(value, length))
+
+
+def bytes_to_bits(data, length=None):
+    """ Converts bytes to a list of bits, optionally only the first length bits.
+
+    >>> bytes_to_bits(b'\\x06\\x01')
+    [0, 1, 1, 0, 0, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0]
+    >>> bytes_to_bits(b'\\x06\\x01', 4)
+    [0, 1, 1, 0]
+
+    """
+    if length is None:
+        length = len(data) * 8
+
+    return int_to_bits(int.from_bytes(data, 'little'), length)
+
+
+def bits_to_int(in_bits):
+    """ Converts a list of bits, LSB first, to an int.
+
+    >>> bits_to_int([0, 1, 1, 0])
+    6
+    >>> bits_to_int([])
+    0
+
+    """
+    bit_array = bytes(in_bits)
+    if numpy is not None and len(bit_array) >= NUMPY_MIN_BITS:
+        return int.from_bytes(pack_bit_array(bit_array), 'little')
+
+    digits = bit_array[::-1].translate(BITS_TO_DIGITS)
+    return int(digits, 2) if digits else 0
+
+
+def pack_bit_array(bit_array):
+    """ Packs a bit array with NumPy. """
+    return numpy.packbits(numpy.frombuffer(bit_array, dtype=numpy.uint8), bitorder='little').tobytes()
+
+
 def bits_to_bytes(in_bits):
-    """ Converts list of bits to list of bytes 
+    """ Converts list of bits to bytes, the last byte is padded with 0 bits.
 
     >>> bits_to_bytes([])
+    b''
     >>> bits_to_bytes([0])
-    [0]
+    b'\\x00'
     >>> bits_to_bytes([1])
-    [1]
+    b'\\x01'
     >>> bits_to_bytes([1, 1, 1, 1, 1, 1, 1, 1])
-    [255]
+    b'\\xff'
     >>> bits_to_bytes([1, 1, 1, 1, 1, 1, 1, 1, 1])
-    [255, 1]
+    b'\\xff\\x01'
     >>> bits_to_bytes([1, 1, 1, 1, 1, 1, 1, 1, 0])
-    [255, 0]
+    b'\\xff\\x00'
 
     """
-    itr = iter(in_bits)
-    bit_offset = 0
-    byte = 0
-    while True:
-        try:
-            bit = next(itr)
-            if bit:
-                byte |= 1 << bit_offset
-
-            bit_offset += 1
-            if bit_offset == 8:
-                yield byte
-                bit_offset = 0
-                byte = 0
-        except StopIteration:
-            if bit_offset > 0:
-                yield byte
-            break
+    bit_array = bytes(in_bits)
+    if numpy is not None and len(bit_array) >= NUMPY_MIN_BITS:
+        return pack_bit_array(bit_array)
+
+    return bits_to_int(bit_array).to_bytes((len(bit_array) + 7) // 8, 'little')
@@ -22,6 +22,14 @@ class ZynqPsJtagModel(object):
         """ IR shift state has been entered, tdi is state of TDI pin, return state of TDO pin """
         return self.ir.shift(tdi)
 
+    def shift_dr_bits(self, value, length):
+        """ Shift the length bits of value through the DR in one call, see jtag_models.shift_dr_bits. """
+        return self.dr.shift_bits(value, length)
+
+    def shift_ir_bits(self, value, length):
+        """ Shift the length bits of value through the IR in one call, see jtag_models.shift_ir_bits. """
+        return self.ir.shift_bits(value, length)
+
     def update_dr(self):
         """ DR update state has been entered. """
         dr = self.dr.read()
@@ -203,6 +211,14 @@ class DapOutputGroupers(object):
             print('irscan $_CHIPNAME.tap [dap_ir ABORT]', file=self.f)
             print('drscan $_CHIPNAME.tap 35 0x{:09x}'.format(value+0), file=self.f)
             print(file=self.f)
+        elif command in (ArmDebugCommand.READ_AP_REGISTER, ArmDebugCommand.WRITE_AP_REGISTER) and ap_num is None:
+            # No DP SELECT seen yet, so the AP and its state are unknown.
+            if command == ArmDebugCommand.READ_AP_REGISTER:
+                print('# Skipped AP read of register 0x{:02x} before DP SELECT, AP unknown'.format(reg+0), file=self.f)
+            else:
+                print('# Skipped AP write of register 0x{:02x} = 0x{:08x} before DP SELECT, AP unknown'.format(
+                    reg+0, value+0), file=self.f)
+            print(file=self.f)
         elif command == ArmDebugCommand.READ_AP_REGISTER:
             result = self.arm_aps[ap_num].read_register(reg)
 
@@ -233,6 +249,8 @@ class DapOutputGroupers(object):
                 for l in self.lines:
                     print(l, file=self.f)
                 print(file=self.f)
+
+                self.lines = []
         elif command == ArmDebugCommand.READ_DP_REGISTER:
             print('# Reading {}'.format(ArmDpRegister(reg).name), file=self.f)
             print('set dp_reg_value [$_CHIPNAME.dap dpreg 0x{:02x}]'.format(reg+0), file=self.f)
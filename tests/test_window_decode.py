@@ -0,0 +1,40 @@
+""" Regression runs of usb_jtag_zynq_mpsoc_decoder.py on windows of a generated capture. """
+import os
+import subprocess
+import sys
+import pytest
+from jtag_decoder.capture_generator import write_capture, generate_capture
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Start frames landing between DP SELECT writes and the AP accesses after
+# them, in the middle of MEM-AP bursts and in bitstream loads.
+START_FRAMES = [2, 50, 500, 1001, 1500]
+
+
+@pytest.fixture(scope='module')
+def capture(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('capture') / 'capture.pcap')
+    generate_capture(write_capture(path, 'pcap'), 1 << 20, seed=7)
+    return path
+
+
+def decode_window(capture, tmp_path, *args):
+    script = str(tmp_path / 'window.tcl')
+    result = subprocess.run(
+            [sys.executable, os.path.join(REPO, 'usb_jtag_zynq_mpsoc_decoder.py'),
+                '--pcap', capture, '--openocd_script', script, '--no_cache'] + list(args),
+            cwd=REPO, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    with open(script) as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('start_frame', START_FRAMES)
+def test_window_with_dap_enabled(capture, tmp_path, start_frame):
+    decode_window(capture, tmp_path, '--start_frame', str(start_frame), '--dap_enabled_at_start')
+
+
+def test_ap_access_before_select(capture, tmp_path):
+    script = decode_window(capture, tmp_path, '--start_frame', '500', '--dap_enabled_at_start')
+    assert 'before DP SELECT, AP unknown' in script
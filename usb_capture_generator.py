@@ -0,0 +1,45 @@
+""" Generate a synthetic USB capture of OpenOCD debugging a Zynq UltraScale+ MPSoC.
+
+The capture can be written in any of the input formats of the decoders, and
+its size is set with --size, so the decoders can be load tested on
+reproducible inputs.  See jtag_decoder/capture_generator.py.
+
+"""
+import argparse
+import json
+from jtag_decoder.capture_generator import CAPTURE_FORMATS, parse_size, write_capture, generate_capture
+from jtag_decoder.capture_input import usb_device
+from jtag_decoder.pcap_reader import FTDI_INTERFACES
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--output', required=True, help='Output capture')
+    parser.add_argument('--format', choices=CAPTURE_FORMATS, default='json',
+            help='Wireshark JSON export (json), tshark field export (tsv), tshark -T ek export (ek) or usbmon pcap (pcap)')
+    parser.add_argument('--size', type=parse_size, default='1M',
+            help='Approximate size of the output, e.g. 512K, 100M or 2G')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random workload and TDO replies')
+    parser.add_argument('--workload',
+            help='JSON file with a list of steps to repeat, e.g. [{"step": "mem_read", "count": 64}], instead of the random workload')
+    parser.add_argument('--bitstream_size', type=parse_size, default='64K',
+            help='Size of the bitstreams loaded by the random workload')
+    parser.add_argument('--interface', choices=FTDI_INTERFACES, default='A', help='FTDI interface of the JTAG adapter')
+    parser.add_argument('--device', type=usb_device, default=(1, 3), metavar='BUS.DEVICE',
+            help='USB bus and device address of the adapter')
+
+    args = parser.parse_args()
+
+    workload = None
+    if args.workload is not None:
+        with open(args.workload) as f:
+            workload = json.load(f)
+
+    bus, device = args.device
+    writer = write_capture(args.output, args.format, bus, device, args.interface)
+    generate_capture(writer, args.size, seed=args.seed, workload=workload, bitstream_size=args.bitstream_size)
+    print('Wrote {} frames, {} bytes'.format(writer.frame, writer.size))
+
+
+if __name__ == "__main__":
+    main()
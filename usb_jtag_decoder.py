@@ -1,128 +1,140 @@
 import argparse
-import json
-from jtag_decoder.jtag_fsm import JtagFsm
+import sys
+from jtag_decoder.jtag_fsm import make_jtag_fsm, JtagState
+from jtag_decoder.jtag_models import DummyJtagModel
 from jtag_decoder.jtag_sim import run_ftdi_command
-from jtag_decoder.ftdi_decoder import FtdiCommandType, DecodeError, decode_commands
-from jtag_decoder.pcap_reader import pcap_json_reader
-
-
-class DummyJtagModel(object):
-    def __init__(self):
-        pass
-
-    def shift_dr(self, tdi):
-        return 1
+from jtag_decoder.ftdi_decoder import (FtdiCommandType, DecodeError, iter_commands, iter_commands_recovering,
+        print_decode_error, print_recoveries)
+from jtag_decoder.command_log import COMMAND_LOG_FORMATS, write_command_log, read_command_log
+from jtag_decoder.buffer import Buffer
+from jtag_decoder.parallel_decoder import iter_commands_parallel
+from jtag_decoder.capture_input import add_input_arguments, check_input_arguments, starts_mid_capture, load_capture, follow_capture, stream_capture
+from jtag_decoder.streams import decode_streams, stream_path
+
+
+def decode_stream(args, name, ftdi_bytes, ftdi_replies, ftdi_commands=None):
+    """ Decode and simulate the commands of one FTDI stream.
+
+    Outputs are written to the paths in args, suffixed with the stream name
+    if it is not None, see stream_names.  If ftdi_commands is None, commands
+    are decoded from the buffers, skipping over decode errors with
+    --recover.  Commands are simulated (and written to --ftdi_commands) as
+    they are decoded.
+
+    """
+    recoveries = []
+    if ftdi_commands is None:
+        print('Parsing data')
+        if args.recover:
+            ftdi_commands = iter_commands_recovering(ftdi_bytes, ftdi_replies, recoveries)
+        elif args.decode_workers is not None:
+            ftdi_commands = iter_commands_parallel(ftdi_bytes, ftdi_replies, workers=args.decode_workers or None)
+        else:
+            ftdi_commands = iter_commands(ftdi_bytes, ftdi_replies)
+
+    writer = None
+    if args.ftdi_commands:
+        print('Writing FTDI commands to disk')
+        writer = write_command_log(stream_path(args.ftdi_commands, name), args.ftdi_commands_format)
+        ftdi_commands = writer.tee(ftdi_commands)
 
-    def shift_ir(self, tdi):
-        return 1
+    jtag_fsm = make_jtag_fsm(
+            DummyJtagModel(),
+            print_transitions=args.print_transitions,
+            print_dr_shift=args.print_dr_shift,
+            print_ir_shift=args.print_ir_shift)
 
-    def update_dr(self):
-        pass
+    if starts_mid_capture(args):
+        # Windows start between batches of commands, which OpenOCD ends
+        # with the TAP idle.
+        jtag_fsm.assume_state(JtagState.RUN_IDLE)
 
-    def update_ir(self):
-        pass
+    if args.follow:
+        sys.stdout.reconfigure(line_buffering=True)
 
-    def capture_dr(self):
-        pass
+    print('Running JTAG simulation')
+    try:
+        for idx, cmd in enumerate(ftdi_commands):
+            # Decoding resumes after an error at the start of a batch of
+            # commands, like the start of a window.
+            if recoveries and recoveries[-1].command_index == idx and recoveries[-1].resume_frame is not None:
+                jtag_fsm.assume_state(JtagState.RUN_IDLE)
+
+            print('{: 8d} {:24s} opcode=0x{:02x} cf={: 8d} l={}'.format(
+                idx,
+                cmd.type.name,
+                cmd.opcode,
+                cmd.command_frame,
+                cmd.length))
+
+            if cmd.type == FtdiCommandType.FLUSH:
+                for _ in range(3):
+                    print('*** FLUSH ***')
+            if cmd.flags is not None:
+                print('Flags: [{}]'.format(', '.join(flag.name for flag in cmd.flags)))
+            if cmd.data is not None:
+                print('Command: {}'.format(':'.join('{:02x}'.format(b) for b in cmd.data)))
+
+            output = run_ftdi_command(cmd, jtag_fsm)
+
+            if cmd.reply is not None:
+                print('Real Reply(rf={: 8d}): {}'.format(cmd.reply_frame, ':'.join('{:02x}'.format(b) for b in cmd.reply)))
+                print(' Sim Reply    {:8s} : {}'.format('', ':'.join('{:02x}'.format(b) for b in output)))
 
-    def capture_ir(self):
-        pass
+    except DecodeError as e:
+        print_decode_error(e, ftdi_bytes, ftdi_replies)
+        raise
+    except KeyboardInterrupt:
+        if not args.follow:
+            raise
 
-    def reset(self):
-        pass
+        print('Stopped following capture')
+    finally:
+        if writer is not None:
+            writer.close()
 
-    def run_idle(self):
-        pass
+    print_recoveries(recoveries)
 
 
 def main():
     parser = argparse.ArgumentParser(description=__doc__)
-    parser.add_argument('--json_pcap', required=True, help='Input JSON PCAP data')
+    add_input_arguments(parser)
     parser.add_argument('--ftdi_commands', help='Output of FTDI commands')
+    parser.add_argument('--ftdi_commands_format', choices=COMMAND_LOG_FORMATS, default='json',
+            help='Format of --ftdi_commands: a JSON array, JSON lines with hex payloads, or an indexed binary log (default json)')
+    parser.add_argument('--recover', action='store_true', help='Skip to the next batch of commands on decode errors instead of stopping, and report the skipped spans')
+    parser.add_argument('--decode_workers', type=int, help='Decode FTDI commands in segments with this many worker processes, 0 uses all CPUs')
     parser.add_argument('--print_transitions', action='store_true')
     parser.add_argument('--print_dr_shift', action='store_true')
     parser.add_argument('--print_ir_shift', action='store_true')
 
     args = parser.parse_args()
-
-    print('Loading data')
-    with open(args.json_pcap) as f:
-        ftdi_bytes, ftdi_replies = pcap_json_reader(f)
-
-    print('Parsing data')
-    try:
-        ftdi_commands = decode_commands(ftdi_bytes, ftdi_replies)
-    except DecodeError as e:
-        print('Failed decode at:', hex(e.get_last_byte()))
-        print('Next TX frame', ftdi_bytes.current_frame())
-        print('Next RX frame', ftdi_replies.current_frame())
-        print('Context:')
-        C = 50
-        for offset, context_bytes in ftdi_bytes.get_context(C=C):
-            print(offset+1, hex(context_bytes))
-
-        # Find previous two flushes to get sufficient context
-        if e.commands is not None:
-            flush_count = 0
-            for idx, cmd in enumerate(e.commands[::-1]):
-                if cmd.type == FtdiCommandType.FLUSH:
-                    flush_count += 1
-                    if flush_count == 2:
-                        break
-
-            idx += 1
-
-            print('Last {} commands (2 flushes backward):'.format(idx))
-            for cmd in e.commands[-idx:]:
-                print(cmd)
-        raise
-
-    if args.ftdi_commands:
-        print('Writing FTDI commands to disk')
-        with open(args.ftdi_commands, 'w') as f:
-            outputs = []
-            for cmd in ftdi_commands:
-                o = cmd._asdict()
-                o['type'] = cmd.type.name
-                if cmd.flags is not None:
-                    o['flags'] = [flag.name for flag in cmd.flags]
-
-                for k in cmd._asdict():
-                    if o[k] is None:
-                        del o[k]
-
-                outputs.append(o)
-
-            json.dump(outputs, f, indent=2)
-
-    jtag_fsm = JtagFsm(
-            DummyJtagModel(),
-            print_transitions=args.print_transitions,
-            print_dr_shift=args.print_dr_shift,
-            print_ir_shift=args.print_ir_shift)
-
-    print('Running JTAG simulation')
-    for idx, cmd in enumerate(ftdi_commands):
-        print('{: 8d} {:24s} opcode=0x{:02x} cf={: 8d} l={}'.format(
-            idx,
-            cmd.type.name,
-            cmd.opcode,
-            cmd.command_frame,
-            cmd.length))
-
-        if cmd.type == FtdiCommandType.FLUSH:
-            for _ in range(3):
-                print('*** FLUSH ***')
-        if cmd.flags is not None:
-            print('Flags: [{}]'.format(', '.join(flag.name for flag in cmd.flags)))
-        if cmd.data is not None:
-            print('Command: {}'.format(':'.join('{:02x}'.format(b) for b in cmd.data)))
-
-        output = run_ftdi_command(cmd, jtag_fsm)
-
-        if cmd.reply is not None:
-            print('Real Reply(rf={: 8d}): {}'.format(cmd.reply_frame, ':'.join('{:02x}'.format(b) for b in cmd.reply)))
-            print(' Sim Reply    {:8s} : {}'.format('', ':'.join('{:02x}'.format(b) for b in output)))
+    check_input_arguments(parser, args)
+    if args.recover and (args.follow or args.bounded_memory):
+        parser.error('--recover is not supported with --follow or --bounded_memory')
+
+    if args.decode_workers is not None and (args.follow or args.bounded_memory or args.recover):
+        parser.error('--decode_workers is not supported with --follow, --bounded_memory or --recover')
+
+    if args.command_log is not None and (args.recover or args.decode_workers is not None):
+        parser.error('--recover and --decode_workers are not supported with --command_log')
+
+    if args.follow:
+        print('Following capture')
+        follower = follow_capture(args)
+        decode_stream(args, None, follower.ftdi_bytes, follower.ftdi_replies, follower.commands())
+    elif args.bounded_memory:
+        print('Decoding capture while reading it')
+        decoder = stream_capture(args)
+        decode_stream(args, None, decoder.ftdi_bytes, decoder.ftdi_replies, decoder.commands())
+    elif args.command_log is not None:
+        print('Loading FTDI commands')
+        decode_stream(args, None, Buffer(), Buffer(), read_command_log(args.command_log))
+    else:
+        print('Loading data')
+        streams = load_capture(args)
+        if not decode_streams(decode_stream, args, streams):
+            sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,93 @@
+""" Re-encode the FTDI commands of a capture into an optimized MPSSE stream.
+
+Reports how many bytes the host could have saved, see
+jtag_decoder/mpsse_encoder.py for the optimizations.
+
+"""
+import argparse
+import sys
+from jtag_decoder.jtag_fsm import JtagState
+from jtag_decoder.ftdi_decoder import DecodeError, decode_commands, print_decode_error
+from jtag_decoder.command_log import read_command_log
+from jtag_decoder.mpsse_encoder import encode_commands, optimize_commands, tap_trajectory
+from jtag_decoder.buffer import Buffer
+from jtag_decoder.capture_input import add_input_arguments, check_input_arguments, starts_mid_capture, load_capture
+from jtag_decoder.streams import decode_streams, stream_path
+
+
+def percent_smaller(before, after):
+    return 100.0 * (before - after) / before if before else 0.0
+
+
+def optimize_stream(args, name, ftdi_bytes, ftdi_replies, ftdi_commands=None):
+    """ Optimize the commands of one FTDI stream, see decode_streams. """
+    tx_bytes = None
+    if ftdi_commands is None:
+        tx_bytes = bytes(ftdi_bytes.view(ftdi_bytes.tell(), ftdi_bytes.tell() + len(ftdi_bytes)))
+
+        print('Parsing data')
+        try:
+            ftdi_commands = decode_commands(ftdi_bytes, ftdi_replies)
+        except DecodeError as e:
+            print_decode_error(e, ftdi_bytes, ftdi_replies)
+            raise
+    else:
+        ftdi_commands = list(ftdi_commands)
+
+    encoded = encode_commands(ftdi_commands)
+    if tx_bytes is not None:
+        if encoded == tx_bytes:
+            print('Round trip: re-encoded commands match the captured TX bytes')
+        else:
+            print('Round trip: re-encoded commands DIFFER from the captured TX bytes')
+
+    print('Optimizing commands')
+    optimized, stats = optimize_commands(ftdi_commands)
+    optimized_bytes = encode_commands(optimized)
+
+    print('Commands: {} -> {} ({:.1f}% fewer)'.format(
+        len(ftdi_commands), len(optimized), percent_smaller(len(ftdi_commands), len(optimized))))
+    print('TX bytes: {} -> {} ({:.1f}% smaller)'.format(
+        len(encoded), len(optimized_bytes), percent_smaller(len(encoded), len(optimized_bytes))))
+    for description, count in sorted(stats.items()):
+        print('  {}: {}'.format(description, count))
+
+    if args.output:
+        with open(stream_path(args.output, name), 'wb') as f:
+            f.write(optimized_bytes)
+
+    if args.verify:
+        print('Verifying TAP state trajectory')
+        initial_state = JtagState.RUN_IDLE if starts_mid_capture(args) else None
+        states, replies = tap_trajectory(ftdi_commands, initial_state)
+        optimized_states, optimized_replies = tap_trajectory(optimized, initial_state)
+        if states == optimized_states and replies == optimized_replies:
+            print('Verified: same TAP states and TDO over {} clocks'.format(len(states)))
+        else:
+            raise RuntimeError('Optimized commands do not clock the TAP through the same states')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    add_input_arguments(parser)
+    parser.add_argument('--output', help='Output of the optimized MPSSE byte stream')
+    parser.add_argument('--verify', action='store_true',
+            help='Simulate the original and optimized commands, and check the TAP goes through the same states')
+
+    args = parser.parse_args()
+    check_input_arguments(parser, args)
+    if args.follow or args.bounded_memory:
+        parser.error('--follow and --bounded_memory are not supported')
+
+    if args.command_log is not None:
+        print('Loading FTDI commands')
+        optimize_stream(args, None, Buffer(), Buffer(), read_command_log(args.command_log))
+    else:
+        print('Loading data')
+        streams = load_capture(args)
+        if not decode_streams(optimize_stream, args, streams):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()